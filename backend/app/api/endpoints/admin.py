@@ -2,8 +2,14 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Any
 
 from app.auth.permissions import admin_permission
+from app.auth.sessions import revocation_filter
+from app.auth.throttle import login_throttle
+from app.auth.token_cache import token_cache
+from app.auth.user_cache import user_cache
+from app.core.security import password_hasher
 from app.db.models import User, VM
 from app.db.mongodb import db
+from app.db.audit import write_log
 from app.aws.sts import get_role_credentials
 from app.aws.ec2 import list_instances, get_instance_by_id
 
@@ -22,7 +28,7 @@ async def get_instances(current_user: User = Depends(admin_permission)) -> Any:
         instances = list_instances(credentials)
         
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "list_instances",
             "details": {"role": "admin", "count": len(instances)}
@@ -51,7 +57,7 @@ async def get_instance(
         instance = get_instance_by_id(credentials, instance_id)
         
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "get_instance",
             "details": {"role": "admin", "instance_id": instance_id}
@@ -82,10 +88,23 @@ async def get_users(current_user: User = Depends(admin_permission)) -> Any:
         user["id"] = str(user.pop("_id"))
     
     # Log the action
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": current_user.id,
         "event_type": "list_users",
         "details": {"role": "admin", "count": len(users)}
     })
     
-    return users
\ No newline at end of file
+    return users
+
+@router.get("/auth-status", response_model=dict)
+async def get_auth_status(current_user: User = Depends(admin_permission)) -> Any:
+    """
+    Get load and cache figures of this worker's authentication path (Admin only)
+    """
+    return {
+        "password_hashing": password_hasher.status(),
+        "token_cache": token_cache.status(),
+        "user_cache": user_cache.status(),
+        "login_throttle": login_throttle.status(),
+        "revoked_sessions": revocation_filter.status(),
+    }
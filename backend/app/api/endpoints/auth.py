@@ -1,17 +1,52 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
 from typing import Any
+from pymongo.errors import DuplicateKeyError
 
 from app.core.config import settings
-from app.core.security import create_access_token, verify_password, get_password_hash
+from app.core.security import HasherOverloaded, create_access_token, password_hasher
 from app.auth.mfa import generate_totp_secret, get_totp_uri, generate_qr_code, verify_totp
-from app.db.models import User, Token, UserCreate, MFASetup, MFAVerify
+from app.db.models import User, Token, TokenPayload, RefreshRequest, UserCreate, MFASetup, MFAVerify
 from app.db.mongodb import db
-from app.auth.jwt_handler import get_current_user
+from app.db.audit import client_ip, write_log
+from app.auth import sessions
+from app.auth.jwt_handler import get_current_user, get_token_claims, oauth2_scheme
+from app.auth.token_cache import token_cache, token_digest
+from app.auth.throttle import LOGIN, VERIFY_MFA, Throttled, login_throttle
+from app.auth.user_cache import user_cache, user_query
 
 router = APIRouter()
 
+def _hashing_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many login attempts in progress, try again shortly",
+        headers={"Retry-After": str(settings.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+    )
+
+def _throttled(e: Throttled) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+async def _open_session(request: Request, user: dict) -> dict:
+    """Start a session for a logged-in user and issue its first tokens"""
+    session_id, refresh_token = await sessions.create_session(
+        str(user["_id"]), client_ip(request), request.headers.get("user-agent")
+    )
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    return {
+        "access_token": create_access_token(
+            subject=str(user["_id"]), expires_delta=access_token_expires, session_id=session_id
+        ),
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "role": user["role"]
+    }
+
 @router.post("/register", response_model=User)
 async def register_user(user_data: UserCreate) -> Any:
     """
@@ -19,63 +54,81 @@ async def register_user(user_data: UserCreate) -> Any:
     """
     user_collection = db.db.users
     
-    # Check if username already exists
-    if await user_collection.find_one({"username": user_data.username}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already exists"
-        )
-    
-    # Check if email already exists
-    if await user_collection.find_one({"email": user_data.email}):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already exists"
-        )
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except HasherOverloaded:
+        raise _hashing_busy()
     
     # Create new user
     user = User(
         username=user_data.username,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=hashed_password,
         role=user_data.role,
         mfa_enabled=False
     )
     
-    # Insert user to database
-    result = await user_collection.insert_one(user.dict(exclude={"id"}))
+    # Insert user to database. The unique indexes on username and email
+    # reject duplicates, which also closes the race two pre-checks left open
+    try:
+        result = await user_collection.insert_one(user.dict(exclude={"id"}))
+    except DuplicateKeyError as e:
+        field = "Email" if "email" in (e.details or {}).get("keyPattern", {}) else "Username"
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{field} already exists"
+        )
     user.id = str(result.inserted_id)
     
     # Log user creation
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": user.id,
         "event_type": "user_created",
         "details": {"username": user.username, "role": user.role}
-    })
+    }, durable=True)
     
     return user
 
 @router.post("/login", response_model=Token)
-async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
     """
     Get an access token for future requests
     """
+    # Locked-out usernames and addresses are turned away before any lookup
+    # or password hashing
+    source_ip = client_ip(request)
+    try:
+        await login_throttle.check(LOGIN, form_data.username, source_ip)
+    except Throttled as e:
+        raise _throttled(e)
+    
     user_collection = db.db.users
     user = await user_collection.find_one({"username": form_data.username})
     
     if not user:
+        await login_throttle.failure(LOGIN, form_data.username, source_ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not verify_password(form_data.password, user["hashed_password"]):
+    # bcrypt runs on the hashing pool, not the event loop
+    try:
+        verified, new_hash = await password_hasher.verify(form_data.password, user["hashed_password"])
+    except HasherOverloaded:
+        raise _hashing_busy()
+    if not verified:
+        await login_throttle.failure(LOGIN, form_data.username, source_ip, str(user["_id"]))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # Stored with an older BCRYPT_ROUNDS; only the right password can upgrade it
+        await user_collection.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
+        await user_cache.invalidate(str(user["_id"]))
     
     # Check if MFA is enabled for user
     if user.get("mfa_enabled", False):
@@ -87,37 +140,42 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()) -> Any:
             "role": user["role"]
         }
     
-    # Create access token if MFA is not enabled
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        subject=str(user["_id"]), expires_delta=access_token_expires
-    )
+    # Failures are only forgotten once a token is issued, so a known
+    # password does not reset the count of MFA guesses
+    await login_throttle.success(form_data.username)
+    
+    # Open a session if MFA is not enabled
+    tokens = await _open_session(request, user)
     
     # Log successful login
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": str(user["_id"]),
         "event_type": "user_login",
         "details": {"username": user["username"], "mfa_used": False}
-    })
+    }, durable=True)
     
-    return {
-        "access_token": access_token,
-        "token_type": "bearer",
-        "role": user["role"]
-    }
+    return tokens
 
 @router.post("/verify-mfa", response_model=Token)
 async def verify_mfa(
+    request: Request,
     username: str,
     verification: MFAVerify
 ) -> Any:
     """
     Verify MFA token and get access token
     """
+    source_ip = client_ip(request)
+    try:
+        await login_throttle.check(VERIFY_MFA, username, source_ip)
+    except Throttled as e:
+        raise _throttled(e)
+    
     user_collection = db.db.users
     user = await user_collection.find_one({"username": username})
     
     if not user:
+        await login_throttle.failure(VERIFY_MFA, username, source_ip)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid username",
@@ -132,31 +190,100 @@ async def verify_mfa(
     
     # Verify the TOTP token
     if not verify_totp(user["mfa_secret"], verification.token):
+        await login_throttle.failure(VERIFY_MFA, username, source_ip, str(user["_id"]))
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid MFA token",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    await login_throttle.success(username)
     
-    # Create access token
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        subject=str(user["_id"]), expires_delta=access_token_expires
-    )
+    # Open a session
+    tokens = await _open_session(request, user)
     
     # Log successful MFA verification
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": str(user["_id"]),
         "event_type": "user_login",
         "details": {"username": user["username"], "mfa_used": True}
-    })
+    }, durable=True)
+    
+    return tokens
+
+@router.post("/refresh", response_model=Token)
+async def refresh(body: RefreshRequest) -> Any:
+    """
+    Exchange a refresh token for a new access token and refresh token
+    """
+    try:
+        session_id, user_id, refresh_token = await sessions.rotate(body.refresh_token)
+    except sessions.RefreshTokenReused as e:
+        await write_log({
+            "user_id": "",
+            "event_type": "refresh_token_reuse",
+            "details": {"session_id": body.refresh_token.partition(".")[0]}
+        }, durable=True)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
+    except sessions.InvalidRefreshToken as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(e))
     
+    user = await user_cache.get(user_id)
+    if not user:
+        await sessions.revoke(session_id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+        )
+    
+    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     return {
-        "access_token": access_token,
+        "access_token": create_access_token(
+            subject=user_id, expires_delta=access_token_expires, session_id=session_id
+        ),
+        "refresh_token": refresh_token,
         "token_type": "bearer",
-        "role": user["role"]
+        "role": user.role
     }
 
+@router.post("/logout", response_model=bool)
+async def logout(
+    token: str = Depends(oauth2_scheme),
+    claims: TokenPayload = Depends(get_token_claims)
+) -> Any:
+    """
+    End the session of the current token, revoking its refresh token and access tokens
+    """
+    # Refused at once by this worker, whether or not it belongs to a session
+    token_cache.revoke(token_digest(token), claims.exp or 0)
+    if claims.sid:
+        await sessions.revoke(claims.sid)
+    
+    await write_log({
+        "user_id": claims.sub or "",
+        "event_type": "user_logout",
+        "details": {"session_id": claims.sid}
+    }, durable=True)
+    return True
+
+@router.post("/logout-all", response_model=int)
+async def logout_all(
+    token: str = Depends(oauth2_scheme),
+    current_user: User = Depends(get_current_user)
+) -> Any:
+    """
+    Revoke every session of the current user; returns how many were open
+    """
+    claims = await get_token_claims(token)
+    token_cache.revoke(token_digest(token), claims.exp or 0)
+    revoked = await sessions.revoke_all(current_user.id)
+    
+    await write_log({
+        "user_id": current_user.id,
+        "event_type": "sessions_revoked",
+        "details": {"username": current_user.username, "sessions": revoked}
+    }, durable=True)
+    return revoked
+
 @router.post("/setup-mfa", response_model=MFASetup)
 async def setup_mfa(current_user: User = Depends(get_current_user)) -> Any:
     """
@@ -175,9 +302,10 @@ async def setup_mfa(current_user: User = Depends(get_current_user)) -> Any:
     
     # Update user in database with the secret (but don't enable MFA yet)
     await user_collection.update_one(
-        {"_id": current_user.id},
+        user_query(current_user.id),
         {"$set": {"mfa_secret": secret}}
     )
+    await user_cache.invalidate(current_user.id)
     
     return {
         "secret": secret,
@@ -193,7 +321,8 @@ async def enable_mfa(
     Enable MFA after verifying token
     """
     user_collection = db.db.users
-    user = await user_collection.find_one({"_id": current_user.id})
+    # Read from the database: the cached user may predate setup-mfa
+    user = await user_collection.find_one(user_query(current_user.id))
     
     if not user.get("mfa_secret"):
         raise HTTPException(
@@ -210,15 +339,16 @@ async def enable_mfa(
     
     # Enable MFA for the user
     await user_collection.update_one(
-        {"_id": current_user.id},
+        user_query(current_user.id),
         {"$set": {"mfa_enabled": True}}
     )
+    await user_cache.invalidate(current_user.id)
     
     # Log MFA enablement
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": current_user.id,
         "event_type": "mfa_enabled",
         "details": {"username": current_user.username}
-    })
+    }, durable=True)
     
     return True
\ No newline at end of file
@@ -4,6 +4,7 @@ from typing import List, Any
 from app.auth.permissions import developer_permission
 from app.db.models import User, VM, SSHSession
 from app.db.mongodb import db
+from app.db.audit import write_log
 from app.aws.sts import get_role_credentials
 from app.aws.ec2 import list_instances, get_instance_by_id
 from app.ssh.gateway import create_ssh_session, handle_ssh_websocket, end_ssh_session
@@ -29,7 +30,7 @@ async def get_dev_instances(current_user: User = Depends(developer_permission))
         ]
         
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "list_dev_instances",
             "details": {"role": "developer", "count": len(dev_instances)}
@@ -76,7 +77,7 @@ async def create_new_ssh_session(
         session_token = await create_ssh_session(current_user.id, instance_id, vm_ip, credentials)
         
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "ssh_session_created",
             "details": {
@@ -139,7 +140,7 @@ async def close_ssh_session(
     
     if success:
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "ssh_session_closed",
             "details": {
@@ -1,27 +1,73 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from typing import List, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import List, Any, AsyncIterator, Dict, Optional
 from datetime import datetime, timedelta
+from bson import ObjectId
+from bson.errors import InvalidId
 
-from app.auth.permissions import soc_permission
-from app.db.models import User, LogEntry, LogAnalysisResult
+from app.auth.jwt_handler import get_current_user
+from app.core.config import settings
+from app.auth.permissions import admin_or_soc_permission, soc_permission
+from app.db.models import User, Role, LogView, LogAnalysisResult, Incident, TrainingJob, AnalyticsQuery
 from app.db.mongodb import db
+from app.db import analytics, rollups
+from app.db.audit import audit_log, write_log
+from app.db.archive import build_filter, dedupe, find_archived, hot_query, hot_since, iter_logs
+from app.db.export import CSV, MEDIA_TYPES, NDJSON, serialize
+from app.db.ingest import BatchTooLarge, read_batch
+from app.db.pagination import LOG_SORT, decode_cursor, encode_cursor
 from app.aws.sts import get_role_credentials
-from app.ml.predict import detect_anomalies, get_recent_logs
-from app.ml.train import train_model
+from app.ml.predict import detect_anomalies
+from app.ml.results import list_incidents
+from app.ml.jobs import training_jobs
+from app.ml.train import MIN_TRAINING_LOGS
+from app.ml.registry import model_registry
+from app.ml.streaming import anomaly_broadcaster, streaming_scorer
 
 router = APIRouter()
 
-@router.get("/logs", response_model=List[LogEntry])
+# Fields /soc/logs can return; "id" is always included
+LOG_FIELDS = {"user_id", "event_type", "details", "timestamp", "source_ip", "user_agent"}
+# Column order of exports
+EXPORT_COLUMNS = ["id", "timestamp", "user_id", "event_type", "source_ip", "user_agent", "details"]
+
+def _requested_fields(fields: Optional[str]) -> Optional[set]:
+    """The fields a comma-separated `fields` parameter asks for, None for all"""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - LOG_FIELDS
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+        )
+    return requested
+
+async def _without_timestamp(logs: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+    """Drop the timestamp read only to order the logs"""
+    async for log in logs:
+        log.pop("timestamp", None)
+        yield log
+
+@router.get("/logs", response_model=List[LogView], response_model_exclude_unset=True)
 async def get_logs(
+    response: Response,
     start_time: Optional[datetime] = None,
     end_time: Optional[datetime] = None,
-    event_type: Optional[str] = None,
+    event_type: Optional[str] = Query(None, description="Exact event type, or a prefix ending in *"),
     user_id: Optional[str] = None,
     limit: int = Query(100, gt=0, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. event_type,timestamp"),
     current_user: User = Depends(soc_permission)
 ) -> Any:
     """
     Get system logs with optional filters (SOC only)
+    
+    Logs are returned newest first. When more match, the X-Next-Cursor
+    response header holds a token for the next page.
     """
     # Set default time range if not provided
     if not end_time:
@@ -29,24 +75,39 @@ async def get_logs(
     if not start_time:
         start_time = end_time - timedelta(hours=24)
     
-    # Build query
-    query = {"timestamp": {"$gte": start_time, "$lte": end_time}}
-    if event_type:
-        query["event_type"] = {"$regex": event_type, "$options": "i"}
-    if user_id:
-        query["user_id"] = user_id
+    requested = _requested_fields(fields)
+    # The cursor is built from the timestamp, so it is always read
+    projection = {field: 1 for field in requested | {"timestamp"}} if requested is not None else None
     
-    # Get logs from database
-    log_collection = db.db.logs
-    cursor = log_collection.find(query).sort("timestamp", -1).limit(limit)
-    logs = await cursor.to_list(length=limit)
+    log_filter = build_filter(start_time, end_time, event_type, user_id)
+    if cursor:
+        try:
+            log_filter = log_filter._replace(after=decode_cursor(cursor))
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    
+    # Get logs from database, one extra to know whether a next page exists
+    log_collection = db.logs
+    db_cursor = log_collection.find(hot_query(log_filter), projection).sort(LOG_SORT).limit(limit + 1)
+    logs = await db_cursor.to_list(length=limit + 1)
+    # Windows reaching past the hot tier continue into the archive
+    if start_time < hot_since():
+        logs = dedupe(logs + await find_archived(log_filter, limit + 1, projection))
+    if len(logs) > limit:
+        logs = logs[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(logs[-1]["timestamp"], logs[-1]["_id"])
     
     # Convert ObjectId to string for each log
     for log in logs:
         log["id"] = str(log.pop("_id"))
+        if requested is not None and "timestamp" not in requested:
+            del log["timestamp"]
     
     # Log the action
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": current_user.id,
         "event_type": "logs_viewed",
         "details": {
@@ -56,13 +117,159 @@ async def get_logs(
                 "end_time": end_time.isoformat(),
                 "event_type": event_type,
                 "user_id": user_id,
-                "limit": limit
+                "limit": limit,
+                "cursor": cursor
             }
         }
     })
     
     return logs
 
+@router.get("/logs/export")
+async def export_logs(
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    event_type: Optional[str] = Query(None, description="Exact event type, or a prefix ending in *"),
+    user_id: Optional[str] = None,
+    format: str = Query(NDJSON, pattern=f"^({NDJSON}|{CSV})$"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to export, e.g. event_type,timestamp"),
+    after_id: Optional[str] = Query(None, description="Resume after this log; pass its timestamp as start_time"),
+    compress: bool = Query(True, description="gzip the export"),
+    current_user: User = Depends(soc_permission)
+) -> Any:
+    """
+    Export system logs matching the filters, oldest first (SOC only)
+    
+    Unlike /logs there is no row limit: logs are read, serialized and
+    compressed as the response is sent. To resume an interrupted export,
+    repeat the request with start_time and after_id set to the timestamp
+    and id of the last row received.
+    """
+    if not end_time:
+        end_time = datetime.utcnow()
+    if not start_time:
+        start_time = end_time - timedelta(hours=24)
+    
+    requested = _requested_fields(fields)
+    # Hot and archived logs are merged by timestamp, so it is always read
+    projection = {field: 1 for field in requested | {"timestamp"}} if requested is not None else None
+    columns = [column for column in EXPORT_COLUMNS if requested is None or column == "id" or column in requested]
+    
+    log_filter = build_filter(start_time, end_time, event_type, user_id)
+    if after_id:
+        try:
+            log_filter = log_filter._replace(since=(start_time, ObjectId(after_id)))
+        except InvalidId as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid after_id: {str(e)}"
+            )
+    
+    # Log the action before streaming starts; the export may run for long
+    await write_log({
+        "user_id": current_user.id,
+        "event_type": "logs_exported",
+        "details": {
+            "role": "soc",
+            "format": format,
+            "filter": {
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+                "event_type": event_type,
+                "user_id": user_id,
+                "after_id": after_id
+            }
+        }
+    })
+    
+    logs = iter_logs(log_filter, projection)
+    if requested is not None and "timestamp" not in requested:
+        logs = _without_timestamp(logs)
+    
+    filename = f"logs-{start_time:%Y%m%dT%H%M%S}-{end_time:%Y%m%dT%H%M%S}.{format}"
+    if compress:
+        filename += ".gz"
+    return StreamingResponse(
+        serialize(logs, format, columns, compress=compress),
+        media_type="application/gzip" if compress else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.post("/logs/ingest", response_model=dict, status_code=status.HTTP_202_ACCEPTED)
+async def ingest_logs(
+    request: Request,
+    current_user: User = Depends(admin_or_soc_permission)
+) -> Any:
+    """
+    Ingest a batch of external events, one LogEntry per NDJSON line (Admin or SOC only)
+    
+    Valid lines are queued for the same writer as the API's own audit
+    logs, so they reach scoring, training and stats like any other log;
+    invalid lines are skipped and reported. When the writer cannot take
+    the whole batch, nothing is queued and 429 is returned with a
+    Retry-After header.
+    """
+    try:
+        entries, invalid, errors = await read_batch(
+            request.stream(), settings.INGEST_MAX_EVENTS, settings.INGEST_MAX_LINE_BYTES, settings.INGEST_MAX_BODY_BYTES
+        )
+    except BatchTooLarge as e:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    
+    if entries and not await audit_log.ingest(entries):
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Log writer is busy, retry later",
+            headers={"Retry-After": str(settings.INGEST_RETRY_AFTER_SECONDS)}
+        )
+    
+    # Log the action
+    await write_log({
+        "user_id": current_user.id,
+        "event_type": "logs_ingested",
+        "details": {"role": current_user.role, "accepted": len(entries), "rejected": invalid}
+    })
+    
+    return {"accepted": len(entries), "rejected": invalid, "errors": errors}
+
+@router.post("/analytics", response_model=dict)
+async def run_analytics(
+    spec: AnalyticsQuery,
+    current_user: User = Depends(soc_permission)
+) -> Any:
+    """
+    Aggregate logs on the server (SOC only)
+    
+    Counts logs matching the filters per combination of `group_by`
+    dimensions and time `bucket`, optionally with distinct counts of
+    another dimension or only the `top` groups, and returns just the
+    counts.
+    """
+    try:
+        result = await analytics.run(spec)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except analytics.QueryTooExpensive as e:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT if e.timed_out else status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    # Log the action
+    await write_log({
+        "user_id": current_user.id,
+        "event_type": "analytics_viewed",
+        "details": {"role": "soc", "query": jsonable_encoder(spec), "groups": len(result["rows"])}
+    })
+    
+    return result
+
 @router.get("/anomalies", response_model=List[LogAnalysisResult])
 async def get_anomalies(
     hours: int = Query(24, gt=0, le=168),
@@ -77,7 +284,7 @@ async def get_anomalies(
         anomalies = await detect_anomalies(hours=hours, threshold=threshold)
         
         # Log the action
-        await db.db.logs.insert_one({
+        await write_log({
             "user_id": current_user.id,
             "event_type": "anomalies_detected",
             "details": {
@@ -95,78 +302,154 @@ async def get_anomalies(
             detail=f"Failed to detect anomalies: {str(e)}"
         )
 
-@router.post("/train-model", response_model=dict)
-async def train_anomaly_model(current_user: User = Depends(soc_permission)) -> Any:
+@router.get("/incidents", response_model=List[Incident])
+async def get_incidents(
+    hours: int = Query(24, gt=0, le=720),
+    user_id: Optional[str] = None,
+    limit: int = Query(100, gt=0, le=1000),
+    current_user: User = Depends(soc_permission)
+) -> Any:
+    """
+    Get anomalies grouped by user and time into incidents (SOC only)
+    
+    Incidents are built as anomalies are stored, by /soc/anomalies and the
+    streaming scorer; this lists those active in the last `hours`.
+    """
+    return await list_incidents(datetime.utcnow() - timedelta(hours=hours), user_id=user_id, limit=limit)
+
+@router.websocket("/anomalies/stream")
+async def stream_anomalies(websocket: WebSocket, token: str = Query(...)):
     """
-    Train the anomaly detection model using historical logs (SOC only)
+    Push anomalies to SOC analysts as new logs are scored (SOC only)
+    
+    Browsers cannot set headers on a WebSocket, so the access token is
+    passed as a query parameter.
     """
     try:
-        # Train the model
-        result = await train_model()
-        
-        # Log the action
-        await db.db.logs.insert_one({
-            "user_id": current_user.id,
-            "event_type": "model_trained",
-            "details": {
-                "role": "soc", 
-                "success": result
-            }
-        })
-        
-        return {"success": result}
-    except Exception as e:
+        current_user = await get_current_user(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    if current_user.role != Role.SOC:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    queue = anomaly_broadcaster.subscribe()
+    try:
+        while True:
+            result = await queue.get()
+            await websocket.send_json(jsonable_encoder(result))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        anomaly_broadcaster.unsubscribe(queue)
+
+@router.get("/model", response_model=dict)
+async def get_model_info(current_user: User = Depends(soc_permission)) -> Any:
+    """
+    Get the version of the anomaly detection model serving this worker (SOC only)
+    """
+    return {
+        **model_registry.status(),
+        "streaming": streaming_scorer.mode
+    }
+
+@router.post("/train-model", response_model=TrainingJob, status_code=status.HTTP_202_ACCEPTED)
+async def train_anomaly_model(
+    sample_size: Optional[int] = Query(None, ge=MIN_TRAINING_LOGS, le=1_000_000),
+    current_user: User = Depends(soc_permission)
+) -> Any:
+    """
+    Start training the anomaly detection model in the background (SOC only)
+    
+    Returns the job handle. If a training job is already running, that job
+    is returned instead of starting a second one. `sample_size` overrides
+    how many logs the training sample holds.
+    """
+    job, created = await training_jobs.submit(current_user.id, sample_size)
+    
+    # Log the action
+    await write_log({
+        "user_id": current_user.id,
+        "event_type": "model_training_requested",
+        "details": {
+            "role": "soc", 
+            "job_id": job.id,
+            "created": created,
+            "sample_size": sample_size
+        }
+    })
+    
+    return job
+
+@router.get("/train-model/{job_id}", response_model=TrainingJob)
+async def get_training_job(job_id: str, current_user: User = Depends(soc_permission)) -> Any:
+    """
+    Get status and progress of a training job (SOC only)
+    """
+    job = await training_jobs.get(job_id)
+    if not job:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to train model: {str(e)}"
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Training job not found"
         )
+    return job
+
+@router.post("/train-model/{job_id}/cancel", response_model=TrainingJob)
+async def cancel_training_job(job_id: str, current_user: User = Depends(soc_permission)) -> Any:
+    """
+    Cancel a training job (SOC only)
+    """
+    job = await training_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Training job not found"
+        )
+    return job
 
 @router.get("/stats", response_model=dict)
-async def get_security_stats(current_user: User = Depends(soc_permission)) -> Any:
+async def get_security_stats(
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    group_by: Optional[str] = Query(None, pattern="^(hour|day)$"),
+    current_user: User = Depends(soc_permission)
+) -> Any:
     """
     Get security statistics from logs (SOC only)
-    """
-    log_collection = db.db.logs
     
+    Figures are summed from hourly/daily rollup buckets, never by counting
+    logs. Pass start_time/end_time for a custom window and group_by to get
+    it broken down per hour or day.
+    """
     # Calculate time ranges
     now = datetime.utcnow()
     last_24h = now - timedelta(hours=24)
     last_7d = now - timedelta(days=7)
     
-    # Get count of logs in different time periods
-    total_logs = await log_collection.count_documents({})
-    logs_24h = await log_collection.count_documents({"timestamp": {"$gte": last_24h}})
-    logs_7d = await log_collection.count_documents({"timestamp": {"$gte": last_7d}})
-    
-    # Get login attempt stats
-    login_attempts = await log_collection.count_documents({"event_type": "user_login"})
-    failed_logins = await log_collection.count_documents({
-        "event_type": "user_login",
-        "details.success": False
-    })
-    
-    # Get SSH session stats
-    ssh_sessions = await log_collection.count_documents({"event_type": "ssh_session_created"})
-    
-    # Get anomaly stats
-    anomaly_collection = db.db.anomaly_results
-    total_anomalies = await anomaly_collection.count_documents({})
-    high_severity = await anomaly_collection.count_documents({"severity": "high"})
+    # Get counts for different time periods
+    overall = (await rollups.query())["counts"]
+    logs_24h = (await rollups.query(start=last_24h))["counts"]["events"]
+    logs_7d = (await rollups.query(start=last_7d))["counts"]["events"]
     
     # Compile stats
     stats = {
-        "total_logs": total_logs,
+        "total_logs": overall["events"],
         "logs_last_24h": logs_24h,
         "logs_last_7d": logs_7d,
-        "login_attempts": login_attempts,
-        "failed_logins": failed_logins,
-        "ssh_sessions": ssh_sessions,
-        "total_anomalies": total_anomalies,
-        "high_severity_anomalies": high_severity
+        "login_attempts": overall["event_type"].get("user_login", 0),
+        "failed_logins": overall["login"].get("failure", 0),
+        "ssh_sessions": overall["event_type"].get("ssh_session_created", 0),
+        "total_anomalies": sum(overall["anomaly_severity"].values()),
+        "high_severity_anomalies": overall["anomaly_severity"].get("high", 0),
+        "throttled_logins": sum(overall["throttled"].values())
     }
+    if start_time or end_time or group_by:
+        stats["window"] = await rollups.query(start=start_time, end=end_time, group_by=group_by)
     
     # Log the action
-    await db.db.logs.insert_one({
+    await write_log({
         "user_id": current_user.id,
         "event_type": "security_stats_viewed",
         "details": {"role": "soc"}
@@ -4,26 +4,49 @@ from jose import JWTError, jwt
 from pydantic import ValidationError
 from typing import Optional
 
+from app.auth.sessions import revocation_filter
+from app.auth.token_cache import token_cache, token_digest
+from app.auth.user_cache import user_cache
 from app.core.config import settings
 from app.db.models import TokenPayload, User
-from app.db.mongodb import db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_STR}/auth/login")
 
+def _invalid_credentials() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Could not validate credentials",
+    )
+
+async def get_token_claims(token: str = Depends(oauth2_scheme)) -> TokenPayload:
+    """Claims of a valid, unexpired token whose session is not revoked"""
+    digest = token_digest(token)
+    if token_cache.is_revoked(digest):
+        raise _invalid_credentials()
+    
+    # Tokens seen before skip the signature check until they expire
+    token_data = token_cache.get(digest)
+    if token_data is None:
+        try:
+            payload = jwt.decode(
+                token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
+            )
+            token_data = TokenPayload(**payload)
+        except (JWTError, ValidationError):
+            raise _invalid_credentials()
+        token_cache.put(digest, token_data)
+    
+    # Only sessions in the revocation filter cost a lookup
+    if token_data.sid and await revocation_filter.is_revoked(token_data.sid):
+        token_cache.revoke(digest, token_data.exp or 0)
+        raise _invalid_credentials()
+    return token_data
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
-    try:
-        payload = jwt.decode(
-            token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM]
-        )
-        token_data = TokenPayload(**payload)
-    except (JWTError, ValidationError):
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
-        
-    user_collection = db.db.users
-    user = await user_collection.find_one({"_id": token_data.sub})
+    token_data = await get_token_claims(token)
+    
+    # Users are cached per worker and invalidated when they change
+    user = await user_cache.get(token_data.sub) if token_data.sub else None
     
     if not user:
         raise HTTPException(
@@ -31,4 +54,4 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
             detail="User not found",
         )
         
-    return User(**user)
\ No newline at end of file
+    return user
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""
+Login sessions, refresh tokens and revocation of access tokens.
+
+Each login opens a session in `sessions`, and the tokens it hands out
+carry the session id (`sid`). The refresh token is "<session id>.<secret>".
+Only a SHA-256 hash of the secret is stored, and every refresh replaces
+it. Presenting a secret that was already rotated out means the token was
+copied, so the whole session is revoked.
+
+Access tokens stay self-contained JWTs. To refuse those of a revoked
+session without a database read on every request, each worker holds a
+Bloom filter of the sessions revoked within the last access-token
+lifetime. It is rebuilt from `sessions` every
+SESSION_REVOCATION_SYNC_SECONDS, and revocations made by the worker are
+added at once. Session ids the filter does not contain, which is nearly
+all of them, are accepted right away. A possible match is confirmed
+against the session document, and the answer is remembered until the
+next rebuild.
+"""
+import asyncio
+import hashlib
+import hmac
+import math
+import secrets
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.db.mongodb import db
+
+# Bytes of randomness in session ids and refresh secrets
+SESSION_ID_BYTES = 16
+REFRESH_SECRET_BYTES = 32
+
+# Smallest filter built, so a handful of revocations is not rebuilt into a tiny one
+MIN_FILTER_CAPACITY = 1024
+
+class InvalidRefreshToken(Exception):
+    pass
+
+class RefreshTokenReused(InvalidRefreshToken):
+    """A rotated-out refresh token was presented; its session is now revoked"""
+
+def _hash(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+def _access_lifetime() -> timedelta:
+    return timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+class BloomFilter:
+    """Set membership with no false negatives and about `error_rate` false positives at capacity"""
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+    
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RevocationFilter:
+    """Per-worker view of revoked sessions, kept in sync with `sessions`"""
+    def __init__(self, sync_seconds: float, error_rate: float):
+        self.sync_seconds = sync_seconds
+        self.error_rate = error_rate
+        self._filter = BloomFilter(MIN_FILTER_CAPACITY, error_rate)
+        self._count = 0
+        # Possible matches found live since the last rebuild
+        self._live: Set[str] = set()
+        self.confirmed = 0
+        self.false_positives = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    async def is_revoked(self, session_id: str) -> bool:
+        if not self._count or session_id not in self._filter or session_id in self._live:
+            return False
+        doc = await db.db.sessions.find_one({"_id": session_id}, {"revoked_at": 1})
+        # A session purged after expiring has no valid tokens left either
+        if doc is None or doc.get("revoked_at") is not None:
+            self.confirmed += 1
+            return True
+        self.false_positives += 1
+        self._live.add(session_id)
+        return False
+    
+    def add(self, session_id: str):
+        self._filter.add(session_id)
+        self._count += 1
+        self._live.discard(session_id)
+    
+    async def sync(self):
+        """Rebuild the filter from sessions revoked within one access-token lifetime"""
+        since = datetime.utcnow() - _access_lifetime()
+        revoked = [doc["_id"] async for doc in db.db.sessions.find({"revoked_at": {"$gte": since}}, {"_id": 1})]
+        # Room to grow until the next rebuild without losing accuracy
+        rebuilt = BloomFilter(max(MIN_FILTER_CAPACITY, 2 * len(revoked)), self.error_rate)
+        for session_id in revoked:
+            rebuilt.add(session_id)
+        self._filter, self._count, self._live = rebuilt, len(revoked), set()
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "revoked": self._count,
+            "filter_bytes": len(self._filter._bits),
+            "confirmed": self.confirmed,
+            "false_positives": self.false_positives,
+        }
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except Exception as e:
+                print(f"Error syncing revoked sessions: {str(e)}")
+            await asyncio.sleep(self.sync_seconds)
+
+revocation_filter = RevocationFilter(
+    sync_seconds=settings.SESSION_REVOCATION_SYNC_SECONDS,
+    error_rate=settings.SESSION_FILTER_ERROR_RATE,
+)
+
+async def create_session(user_id: str, source_ip: Optional[str] = None, user_agent: Optional[str] = None) -> Tuple[str, str]:
+    """Open a session; returns its id and first refresh token"""
+    session_id = secrets.token_urlsafe(SESSION_ID_BYTES)
+    secret = secrets.token_urlsafe(REFRESH_SECRET_BYTES)
+    now = datetime.utcnow()
+    expires_at = now + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+    await db.db.sessions.insert_one({
+        "_id": session_id,
+        "user_id": user_id,
+        "refresh_hash": _hash(secret),
+        "created_at": now,
+        "last_used_at": now,
+        "expires_at": expires_at,
+        # Kept until the last access token it could have issued is expired
+        "purge_at": expires_at + _access_lifetime(),
+        "source_ip": source_ip,
+        "user_agent": user_agent,
+    })
+    return session_id, f"{session_id}.{secret}"
+
+async def rotate(refresh_token: str) -> Tuple[str, str, str]:
+    """
+    Exchange a refresh token for a new one. Returns the session id, its
+    user id and the new refresh token.
+    """
+    session_id, _, secret = refresh_token.partition(".")
+    if not session_id or not secret:
+        raise InvalidRefreshToken("Malformed refresh token")
+    presented = _hash(secret)
+    new_secret = secrets.token_urlsafe(REFRESH_SECRET_BYTES)
+    now = datetime.utcnow()
+    # Only one of several concurrent refreshes with the same token wins
+    session = await db.db.sessions.find_one_and_update(
+        {
+            "_id": session_id,
+            "refresh_hash": presented,
+            "revoked_at": {"$exists": False},
+            "expires_at": {"$gt": now},
+        },
+        {"$set": {"refresh_hash": _hash(new_secret), "previous_hash": presented, "last_used_at": now}},
+        return_document=ReturnDocument.AFTER
+    )
+    if session is not None:
+        return session_id, session["user_id"], f"{session_id}.{new_secret}"
+    
+    session = await db.db.sessions.find_one({"_id": session_id})
+    if session is not None and hmac.compare_digest(session.get("previous_hash", ""), presented):
+        await revoke(session_id)
+        raise RefreshTokenReused("Refresh token was already used; the session has been revoked")
+    raise InvalidRefreshToken("Refresh token is invalid, expired or revoked")
+
+async def revoke(session_id: str) -> bool:
+    """Revoke one session; False if it was unknown or already revoked"""
+    result = await db.db.sessions.update_one(
+        {"_id": session_id, "revoked_at": {"$exists": False}},
+        {"$set": {"revoked_at": datetime.utcnow()}}
+    )
+    revocation_filter.add(session_id)
+    return result.modified_count > 0
+
+async def revoke_all(user_id: str) -> int:
+    """Revoke every open session of a user; returns how many there were"""
+    live = {"user_id": user_id, "revoked_at": {"$exists": False}}
+    session_ids: List[str] = [doc["_id"] async for doc in db.db.sessions.find(live, {"_id": 1})]
+    if not session_ids:
+        return 0
+    await db.db.sessions.update_many(
+        {"_id": {"$in": session_ids}, "revoked_at": {"$exists": False}},
+        {"$set": {"revoked_at": datetime.utcnow()}}
+    )
+    for session_id in session_ids:
+        revocation_filter.add(session_id)
+    return len(session_ids)
@@ -0,0 +1,240 @@
+"""
+Brute-force throttling of /auth/login and /auth/verify-mfa.
+
+Failed attempts are counted per username and per source IP over a
+sliding window of LOGIN_THROTTLE_WINDOW_SECONDS: the current fixed window
+plus the previous one, weighted by how much of it the sliding window
+still covers. A key that reaches its limit is locked out for
+LOGIN_LOCKOUT_SECONDS, doubling with every further lockout up to
+LOGIN_LOCKOUT_MAX_SECONDS. The escalation is forgotten once a key has
+gone LOGIN_LOCKOUT_RESET_SECONDS without a lockout.
+
+check() only reads lockouts, so attempts against a locked key are turned
+away before the user is looked up or any password is hashed. Counters are
+kept in memory per worker by default; with LOGIN_THROTTLE_STORE=mongo
+they live in `login_throttle` and are shared by all workers.
+
+Throttled attempts are not logged one by one. They are summed in memory
+and added to the /soc/stats rollups every LOGIN_THROTTLE_FLUSH_SECONDS;
+only the start of a lockout is written to the audit log.
+"""
+import asyncio
+import math
+import re
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.db import rollups
+from app.db.audit import write_log
+from app.db.mongodb import db
+
+MEMORY = "memory"
+MONGO = "mongo"
+
+# Attempt kinds, as counted in the rollups
+LOGIN = "login"
+VERIFY_MFA = "verify_mfa"
+
+# (until, lockouts, forget_at) in epoch seconds
+Lock = Tuple[float, int, float]
+
+class Throttled(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many failed attempts, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class MemoryThrottleStore:
+    """Counters of this worker only, bounded to max_keys in LRU order"""
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._counts: "OrderedDict[str, Dict[int, int]]" = OrderedDict()
+        self._locks: "OrderedDict[str, Lock]" = OrderedDict()
+    
+    def _bound(self, entries: OrderedDict):
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+    
+    async def hit(self, key: str, window: int) -> Tuple[int, int]:
+        """Count a failure in `window`; returns the previous and current window's counts"""
+        counts = self._counts.pop(key, {})
+        counts = {w: n for w, n in counts.items() if w >= window - 1}
+        counts[window] = counts.get(window, 0) + 1
+        self._counts[key] = counts
+        self._bound(self._counts)
+        return counts.get(window - 1, 0), counts[window]
+    
+    async def locked_until(self, keys: List[str], now: float) -> float:
+        """Latest lockout end among keys, 0 if none is locked"""
+        return max((self._locks[key][0] for key in keys if key in self._locks and self._locks[key][0] > now), default=0)
+    
+    async def lockouts(self, key: str, now: float) -> int:
+        lock = self._locks.get(key)
+        return lock[1] if lock is not None and lock[2] > now else 0
+    
+    async def lock(self, key: str, lock: Lock):
+        self._locks.pop(key, None)
+        self._locks[key] = lock
+        self._bound(self._locks)
+    
+    async def reset(self, key: str):
+        self._counts.pop(key, None)
+        self._locks.pop(key, None)
+
+class MongoThrottleStore:
+    """Counters shared by every worker; documents expire on their own"""
+    def _expires(self, at: float) -> datetime:
+        return datetime.utcfromtimestamp(at)
+    
+    async def hit(self, key: str, window: int) -> Tuple[int, int]:
+        window_seconds = settings.LOGIN_THROTTLE_WINDOW_SECONDS
+        current = await db.db.login_throttle.find_one_and_update(
+            {"_id": f"{key}|{window}"},
+            {"$inc": {"count": 1}, "$setOnInsert": {"expires_at": self._expires((window + 2) * window_seconds)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await db.db.login_throttle.find_one({"_id": f"{key}|{window - 1}"})
+        return (previous or {}).get("count", 0), current["count"]
+    
+    async def locked_until(self, keys: List[str], now: float) -> float:
+        cursor = db.db.login_throttle.find({"_id": {"$in": [f"{key}|lock" for key in keys]}, "until": {"$gt": now}})
+        return max([doc["until"] async for doc in cursor], default=0)
+    
+    async def lockouts(self, key: str, now: float) -> int:
+        doc = await db.db.login_throttle.find_one({"_id": f"{key}|lock"})
+        return doc["lockouts"] if doc is not None and doc["forget_at"] > now else 0
+    
+    async def lock(self, key: str, lock: Lock):
+        until, lockouts, forget_at = lock
+        await db.db.login_throttle.update_one(
+            {"_id": f"{key}|lock"},
+            {"$set": {"until": until, "lockouts": lockouts, "forget_at": forget_at, "expires_at": self._expires(forget_at)}},
+            upsert=True
+        )
+    
+    async def reset(self, key: str):
+        await db.db.login_throttle.delete_many({"_id": {"$regex": f"^{re.escape(key)}\\|"}})
+
+class LoginThrottle:
+    def __init__(self, store, window_seconds: float, user_limit: int, ip_limit: int,
+                 lockout_seconds: float, max_lockout_seconds: float, reset_seconds: float, flush_seconds: float):
+        self.store = store
+        self.window_seconds = window_seconds
+        self.user_limit = user_limit
+        self.ip_limit = ip_limit
+        self.lockout_seconds = lockout_seconds
+        self.max_lockout_seconds = max_lockout_seconds
+        self.reset_seconds = reset_seconds
+        self.flush_seconds = flush_seconds
+        # Throttled attempts by kind since the last flush
+        self._throttled: Dict[str, int] = defaultdict(int)
+        self.throttled_total = 0
+        self.lockouts = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    def _keys(self, username: Optional[str], source_ip: Optional[str]) -> List[Tuple[str, int]]:
+        keys = []
+        if username:
+            keys.append((f"user:{username.lower()}", self.user_limit))
+        if source_ip:
+            keys.append((f"ip:{source_ip}", self.ip_limit))
+        return keys
+    
+    async def check(self, kind: str, username: Optional[str], source_ip: Optional[str]):
+        """Raise Throttled if the username or address is locked out"""
+        now = time.time()
+        until = await self.store.locked_until([key for key, _ in self._keys(username, source_ip)], now)
+        if until:
+            self._throttled[kind] += 1
+            self.throttled_total += 1
+            raise Throttled(max(1, math.ceil(until - now)))
+    
+    async def failure(self, kind: str, username: Optional[str], source_ip: Optional[str], user_id: Optional[str] = None):
+        """
+        Count a failed attempt, locking out any key that reached its limit.
+        `user_id` is the id of the account the username belongs to, if any.
+        """
+        now = time.time()
+        window = int(now // self.window_seconds)
+        # Share of the previous window the sliding window still covers
+        overlap = 1 - (now % self.window_seconds) / self.window_seconds
+        for key, limit in self._keys(username, source_ip):
+            previous, current = await self.store.hit(key, window)
+            if previous * overlap + current < limit:
+                continue
+            lockouts = await self.store.lockouts(key, now)
+            duration = min(self.lockout_seconds * 2 ** lockouts, self.max_lockout_seconds)
+            await self.store.lock(key, (now + duration, lockouts + 1, now + duration + self.reset_seconds))
+            self.lockouts += 1
+            await self._log_lockout(kind, key, username, user_id, duration)
+    
+    async def success(self, username: str):
+        """Forget the username's failures after a successful attempt"""
+        await self.store.reset(f"user:{username.lower()}")
+    
+    async def _log_lockout(self, kind: str, key: str, username: Optional[str], user_id: Optional[str], duration: float):
+        # The attempted name may not be an account, so it only goes in details
+        await write_log({
+            "user_id": user_id,
+            "event_type": "login_lockout",
+            "details": {
+                "username": username,
+                "scope": key.split(":", 1)[0],
+                "attempt": kind,
+                "lockout_seconds": int(duration),
+            }
+        })
+    
+    def status(self) -> Dict[str, int]:
+        return {"throttled": self.throttled_total, "lockouts": self.lockouts}
+    
+    async def flush(self):
+        """Add throttled attempts counted since the last flush to the rollups"""
+        if not self._throttled:
+            return
+        counts, self._throttled = self._throttled, defaultdict(int)
+        try:
+            await rollups.record_throttled(counts, datetime.utcnow())
+        except Exception:
+            # Keep them for the next flush
+            for kind, n in counts.items():
+                self._throttled[kind] += n
+            raise
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error recording throttled logins: {str(e)}")
+
+login_throttle = LoginThrottle(
+    store=MongoThrottleStore() if settings.LOGIN_THROTTLE_STORE == MONGO else MemoryThrottleStore(settings.LOGIN_THROTTLE_MAX_KEYS),
+    window_seconds=settings.LOGIN_THROTTLE_WINDOW_SECONDS,
+    user_limit=settings.LOGIN_MAX_FAILURES_PER_USER,
+    ip_limit=settings.LOGIN_MAX_FAILURES_PER_IP,
+    lockout_seconds=settings.LOGIN_LOCKOUT_SECONDS,
+    max_lockout_seconds=settings.LOGIN_LOCKOUT_MAX_SECONDS,
+    reset_seconds=settings.LOGIN_LOCKOUT_RESET_SECONDS,
+    flush_seconds=settings.LOGIN_THROTTLE_FLUSH_SECONDS,
+)
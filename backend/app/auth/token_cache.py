@@ -0,0 +1,77 @@
+"""
+Validated bearer-token claims, cached per worker.
+
+Every protected request presents the same token many times over its
+lifetime. Claims are kept in an LRU keyed by the token's SHA-256 digest
+(tokens themselves are never held), so a repeat request costs one hash
+instead of a signature check and payload validation. An entry lives until
+the token's own `exp`, and tokens in the revocation set are refused
+whether cached or not.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.db.models import TokenPayload
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()
+
+class TokenCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Tuple[TokenPayload, float]]" = OrderedDict()
+        # Digest -> the token's exp; a revoked token is only refused until then
+        self._revoked: Dict[bytes, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.refused = 0
+    
+    def get(self, digest: bytes) -> Optional[TokenPayload]:
+        """Claims of a token validated earlier and not yet expired"""
+        entry = self._entries.get(digest)
+        if entry is not None and entry[1] > time.time():
+            self.hits += 1
+            self._entries.move_to_end(digest)
+            return entry[0]
+        if entry is not None:
+            del self._entries[digest]
+        self.misses += 1
+        return None
+    
+    def put(self, digest: bytes, claims: TokenPayload):
+        # Tokens without an expiry are validated every time
+        if claims.exp is None:
+            return
+        self._entries[digest] = (claims, float(claims.exp))
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def revoke(self, digest: bytes, exp: float):
+        """Refuse a token from now until it expires"""
+        now = time.time()
+        self._revoked = {key: until for key, until in self._revoked.items() if until > now}
+        self._revoked[digest] = exp
+        self._entries.pop(digest, None)
+    
+    def is_revoked(self, digest: bytes) -> bool:
+        if digest in self._revoked:
+            self.refused += 1
+            return True
+        return False
+    
+    def status(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "revoked": len(self._revoked),
+            "refused": self.refused,
+        }
+
+token_cache = TokenCache(max_entries=settings.TOKEN_CACHE_MAX_ENTRIES)
@@ -0,0 +1,175 @@
+"""
+In-process cache of the users behind authenticated requests.
+
+get_current_user runs on every protected request, so users are kept in
+memory for USER_CACHE_TTL_SECONDS, bounded to USER_CACHE_MAX_ENTRIES in
+LRU order. Tokens of users that no longer exist are remembered for a
+shorter time, and concurrent requests for a user that is not cached share
+one query.
+
+Code that changes a user calls invalidate(), which drops the local entry
+and publishes the id to `user_invalidations`. Every worker listens on
+that collection (a change stream, or polling on a standalone server) and
+drops its own copy.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.core.config import settings
+from app.db.models import User
+from app.db.mongodb import db
+
+# Error code Mongo returns for change streams on a standalone server
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+# Wait before listening again after an unexpected error
+RETRY_SECONDS = 5
+
+# How far before the newest invalidation seen a poll starts reading
+POLL_OVERLAP = timedelta(seconds=5)
+
+def user_query(user_id: str) -> Dict[str, Any]:
+    """Filter matching a user by the id given out in tokens"""
+    return {"_id": ObjectId(user_id) if ObjectId.is_valid(user_id) else user_id}
+
+class UserCache:
+    """TTL and LRU bounded users by id; None marks a user known not to exist"""
+    def __init__(self, max_entries: int, ttl_seconds: float, negative_ttl_seconds: float, poll_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.poll_seconds = poll_seconds
+        self._entries: "OrderedDict[str, Tuple[Optional[User], float]]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.mode: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    async def get(self, user_id: str) -> Optional[User]:
+        cached = self._entries.get(user_id)
+        if cached is not None:
+            if cached[1] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(user_id)
+                return cached[0].copy() if cached[0] is not None else None
+            del self._entries[user_id]
+        self.misses += 1
+        
+        loading = self._loading.get(user_id)
+        if loading is None:
+            loading = asyncio.ensure_future(self._load(user_id))
+            self._loading[user_id] = loading
+            loading.add_done_callback(lambda _: self._loaded(user_id, loading))
+        # A cancelled request must not cancel the load others wait on
+        user = await asyncio.shield(loading)
+        return user.copy() if user is not None else None
+    
+    async def _load(self, user_id: str) -> Optional[User]:
+        doc = await db.db.users.find_one(user_query(user_id))
+        if doc is None:
+            return None
+        doc["id"] = str(doc.pop("_id"))
+        return User(**doc)
+    
+    def _loaded(self, user_id: str, loading: asyncio.Future):
+        # An invalidation while the query ran replaced or removed the load
+        if self._loading.get(user_id) is not loading:
+            return
+        del self._loading[user_id]
+        if loading.cancelled() or loading.exception() is not None:
+            return
+        user = loading.result()
+        ttl = self.ttl_seconds if user is not None else self.negative_ttl_seconds
+        self._entries[user_id] = (user, time.monotonic() + ttl)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def discard(self, user_id: str):
+        """Drop a user from this worker's cache only"""
+        self._entries.pop(user_id, None)
+        self._loading.pop(user_id, None)
+    
+    async def invalidate(self, user_id: str):
+        """Drop a user from the cache of every worker, after changing or deleting it"""
+        self.discard(user_id)
+        await db.db.user_invalidations.insert_one({"user_id": user_id, "at": datetime.utcnow()})
+    
+    def clear(self):
+        self._entries.clear()
+        self._loading.clear()
+    
+    def status(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses, "mode": self.mode}
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        resume_token = None
+        while True:
+            try:
+                self.mode = "change_stream"
+                resume_token = await self._tail_change_stream(resume_token)
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"User cache listener error: {str(e)}")
+                    self.clear()
+                    await asyncio.sleep(RETRY_SECONDS)
+                    continue
+                self.mode = "polling"
+                await self._poll()
+            except PyMongoError as e:
+                # Invalidations may have been missed while disconnected
+                print(f"User cache listener error: {str(e)}")
+                self.clear()
+                await asyncio.sleep(RETRY_SECONDS)
+    
+    async def _tail_change_stream(self, resume_token: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with db.db.user_invalidations.watch(pipeline, resume_after=resume_token) as stream:
+            async for change in stream:
+                self.discard(change["fullDocument"]["user_id"])
+                resume_token = stream.resume_token
+        return resume_token
+    
+    async def _poll(self):
+        # Anything published before now predates this worker's cache
+        watermark = ObjectId()
+        seen = set()
+        while True:
+            # ObjectIds from different workers are only ordered to the second,
+            # so re-read a short overlap and skip what was already applied
+            since = ObjectId.from_datetime(watermark.generation_time - POLL_OVERLAP)
+            recent = set()
+            async for doc in db.db.user_invalidations.find({"_id": {"$gte": since}}).sort("_id", 1):
+                recent.add(doc["_id"])
+                if doc["_id"] not in seen:
+                    self.discard(doc["user_id"])
+                watermark = max(watermark, doc["_id"])
+            seen = recent
+            await asyncio.sleep(self.poll_seconds)
+
+user_cache = UserCache(
+    max_entries=settings.USER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.USER_CACHE_TTL_SECONDS,
+    negative_ttl_seconds=settings.USER_CACHE_NEGATIVE_TTL_SECONDS,
+    poll_seconds=settings.USER_INVALIDATION_POLL_SECONDS,
+)
@@ -16,6 +16,39 @@ class Settings(BaseSettings):
 
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Validated tokens cached per worker until they expire
+    TOKEN_CACHE_MAX_ENTRIES: int = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+    # Sessions: refresh tokens are valid this long from login, and revoked
+    # sessions reach every worker's filter within the sync interval
+    REFRESH_TOKEN_EXPIRE_DAYS: int = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+    SESSION_REVOCATION_SYNC_SECONDS: float = float(os.getenv("SESSION_REVOCATION_SYNC_SECONDS", "2"))
+    SESSION_FILTER_ERROR_RATE: float = float(os.getenv("SESSION_FILTER_ERROR_RATE", "0.01"))
+
+    # Password Hashing Settings
+    # bcrypt cost of new password hashes; existing hashes are upgraded on login
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    # Threads hashing passwords, and how many more checks may wait for one
+    # before logins are turned away with 503
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_WAITING: int = int(os.getenv("PASSWORD_HASH_MAX_WAITING", "64"))
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = int(os.getenv("PASSWORD_HASH_RETRY_AFTER_SECONDS", "1"))
+
+    # Login Throttling Settings
+    # Failed logins or MFA checks allowed per username and per source IP
+    # within a sliding window, before that key is locked out. Lockouts double
+    # each time up to the maximum, and start over after a quiet period
+    LOGIN_THROTTLE_WINDOW_SECONDS: int = int(os.getenv("LOGIN_THROTTLE_WINDOW_SECONDS", "900"))
+    LOGIN_MAX_FAILURES_PER_USER: int = int(os.getenv("LOGIN_MAX_FAILURES_PER_USER", "5"))
+    LOGIN_MAX_FAILURES_PER_IP: int = int(os.getenv("LOGIN_MAX_FAILURES_PER_IP", "20"))
+    LOGIN_LOCKOUT_SECONDS: float = float(os.getenv("LOGIN_LOCKOUT_SECONDS", "60"))
+    LOGIN_LOCKOUT_MAX_SECONDS: float = float(os.getenv("LOGIN_LOCKOUT_MAX_SECONDS", "3600"))
+    LOGIN_LOCKOUT_RESET_SECONDS: float = float(os.getenv("LOGIN_LOCKOUT_RESET_SECONDS", "86400"))
+    # "memory" counts per worker; "mongo" shares counters between workers
+    LOGIN_THROTTLE_STORE: str = os.getenv("LOGIN_THROTTLE_STORE", "memory")
+    # Usernames and addresses tracked at most by the memory store
+    LOGIN_THROTTLE_MAX_KEYS: int = int(os.getenv("LOGIN_THROTTLE_MAX_KEYS", "100000"))
+    # How often throttled attempts are added to the stats rollups
+    LOGIN_THROTTLE_FLUSH_SECONDS: float = float(os.getenv("LOGIN_THROTTLE_FLUSH_SECONDS", "10"))
 
     # MongoDB Settings
     MONGODB_URI: str = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
@@ -45,10 +78,95 @@ class Settings(BaseSettings):
     if not all([ADMIN_ROLE_ARN, DEVELOPER_ROLE_ARN, SOC_ROLE_ARN]):
         raise ValueError("❌ One or more AWS IAM Role ARNs are missing in the environment variables!")
 
+    # Refuse to start if a hot query would scan a whole collection
+    VERIFY_QUERY_PLANS: bool = os.getenv("VERIFY_QUERY_PLANS", "true").lower() == "true"
+
+    # Stats rollups: hourly counters older than this are compacted into
+    # daily ones, checked every ROLLUP_COMPACT_INTERVAL_SECONDS
+    ROLLUP_HOURLY_RETENTION_DAYS: int = int(os.getenv("ROLLUP_HOURLY_RETENTION_DAYS", "30"))
+    ROLLUP_COMPACT_INTERVAL_SECONDS: float = float(os.getenv("ROLLUP_COMPACT_INTERVAL_SECONDS", "3600"))
+
+    # Guardrails of /soc/analytics: longest window, most groups returned,
+    # server-side time limit, and whether big groupings may spill to disk
+    ANALYTICS_MAX_WINDOW_DAYS: int = int(os.getenv("ANALYTICS_MAX_WINDOW_DAYS", "31"))
+    ANALYTICS_MAX_GROUPS: int = int(os.getenv("ANALYTICS_MAX_GROUPS", "1000"))
+    ANALYTICS_MAX_TIME_MS: int = int(os.getenv("ANALYTICS_MAX_TIME_MS", "10000"))
+    ANALYTICS_ALLOW_DISK_USE: bool = os.getenv("ANALYTICS_ALLOW_DISK_USE", "false").lower() == "true"
+
+    # Audit log tiers: logs older than LOG_HOT_RETENTION_DAYS are moved into
+    # compressed hourly archive documents every LOG_ARCHIVE_INTERVAL_SECONDS,
+    # which expire after LOG_ARCHIVE_RETENTION_DAYS (0 keeps them forever).
+    # Keep the hot tier at least as long as TRAINING_WINDOW_DAYS
+    LOG_HOT_RETENTION_DAYS: int = int(os.getenv("LOG_HOT_RETENTION_DAYS", "90"))
+    LOG_ARCHIVE_RETENTION_DAYS: int = int(os.getenv("LOG_ARCHIVE_RETENTION_DAYS", "365"))
+    LOG_ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("LOG_ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+    # Audit Log Settings
+    # Entries are queued and written with insert_many every AUDIT_FLUSH_SECONDS
+    # or AUDIT_BATCH_SIZE entries, whichever comes first
+    AUDIT_BATCH_SIZE: int = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+    AUDIT_FLUSH_SECONDS: float = float(os.getenv("AUDIT_FLUSH_SECONDS", "0.5"))
+    # Entries held in memory at most; when full, "block" makes callers wait
+    # for the next flush and "drop" discards new entries
+    AUDIT_QUEUE_SIZE: int = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+    AUDIT_BACKPRESSURE: str = os.getenv("AUDIT_BACKPRESSURE", "block")
+    # Most events one ingestion request may carry. A batch is only queued
+    # when all of it fits, so keep this well below AUDIT_QUEUE_SIZE
+    INGEST_MAX_EVENTS: int = int(os.getenv("INGEST_MAX_EVENTS", "5000"))
+    # Longest line and largest body read before the batch is refused with 413
+    INGEST_MAX_LINE_BYTES: int = int(os.getenv("INGEST_MAX_LINE_BYTES", "65536"))
+    INGEST_MAX_BODY_BYTES: int = int(os.getenv("INGEST_MAX_BODY_BYTES", "16777216"))
+    # Seconds a client is told to wait when ingestion is pushed back
+    INGEST_RETRY_AFTER_SECONDS: int = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "1"))
+
     # SSH Gateway Settings
     SSH_HOST: str = os.getenv("SSH_HOST", "localhost")
     SSH_PORT: int = int(os.getenv("SSH_PORT", "22"))
 
+    # Users of authenticated requests cached per worker, and how long a
+    # token of a missing user is remembered as such
+    USER_CACHE_MAX_ENTRIES: int = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+    USER_CACHE_TTL_SECONDS: float = float(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    USER_CACHE_NEGATIVE_TTL_SECONDS: float = float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "10"))
+    # How often workers without change streams check for invalidated users
+    USER_INVALIDATION_POLL_SECONDS: float = float(os.getenv("USER_INVALIDATION_POLL_SECONDS", "1"))
+
+    # Anomaly Detection Settings
+    ANOMALY_MODEL_PATH: str = os.getenv("ANOMALY_MODEL_PATH", "ml_models/anomaly_detector.joblib")
+    # How often a worker checks whether a retrain replaced the model artifact
+    MODEL_RELOAD_INTERVAL_SECONDS: float = float(os.getenv("MODEL_RELOAD_INTERVAL_SECONDS", "5"))
+    # Logs scored per batch, and the most anomalies one query returns
+    ANOMALY_SCORING_BATCH_SIZE: int = int(os.getenv("ANOMALY_SCORING_BATCH_SIZE", "5000"))
+    ANOMALY_MAX_RESULTS: int = int(os.getenv("ANOMALY_MAX_RESULTS", "500"))
+    # Cached /soc/anomalies results, kept per (hours, threshold, model version)
+    ANOMALY_CACHE_MAX_ENTRIES: int = int(os.getenv("ANOMALY_CACHE_MAX_ENTRIES", "64"))
+    ANOMALY_CACHE_MAX_BYTES: int = int(os.getenv("ANOMALY_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+    # Scores above which an anomaly rates medium and high severity. Scores
+    # are 0.25 + s / 2 for the forest's isolation score s, so they cannot
+    # pass 0.75. On the synthetic benchmark, 0.58 flags 0.4% of logs, all of
+    # them injected anomalies
+    ANOMALY_MEDIUM_SCORE: float = float(os.getenv("ANOMALY_MEDIUM_SCORE", "0.55"))
+    ANOMALY_HIGH_SCORE: float = float(os.getenv("ANOMALY_HIGH_SCORE", "0.58"))
+    # Real-time scoring of newly written logs
+    STREAMING_SCORER_ENABLED: bool = os.getenv("STREAMING_SCORER_ENABLED", "true").lower() == "true"
+    STREAMING_BATCH_SIZE: int = int(os.getenv("STREAMING_BATCH_SIZE", "500"))
+    STREAMING_BATCH_SECONDS: float = float(os.getenv("STREAMING_BATCH_SECONDS", "2"))
+    # At 0.55 the synthetic benchmark flags injected anomalies with ~0.95
+    # precision and ~0.63 recall
+    STREAMING_THRESHOLD: float = float(os.getenv("STREAMING_THRESHOLD", "0.55"))
+    # Severities pushed live to connected SOC clients; the rest are only stored
+    STREAMING_PUSH_SEVERITIES: str = os.getenv("STREAMING_PUSH_SEVERITIES", "high")
+    # Anomalies of one user at most this far apart belong to one incident
+    INCIDENT_WINDOW_MINUTES: int = int(os.getenv("INCIDENT_WINDOW_MINUTES", "30"))
+    # Per-user activity counters: bucket width, and how many buckets make
+    # up the sliding window a log's features are counted over
+    FEATURE_BUCKET_SECONDS: int = int(os.getenv("FEATURE_BUCKET_SECONDS", "60"))
+    FEATURE_WINDOW_BUCKETS: int = int(os.getenv("FEATURE_WINDOW_BUCKETS", "5"))
+    # Training reads a stratified sample (by day and event type) of this
+    # window; a bigger sample trains slower but covers rare events better
+    TRAINING_WINDOW_DAYS: int = int(os.getenv("TRAINING_WINDOW_DAYS", "30"))
+    TRAINING_SAMPLE_SIZE: int = int(os.getenv("TRAINING_SAMPLE_SIZE", "10000"))
+
     class Config:
         case_sensitive = True
 
@@ -1,15 +1,19 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, Union
+from typing import Any, Callable, Deque, Dict, Optional, Tuple, Union
 
 from jose import jwt
 from passlib.context import CryptContext
 
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Recent admission waits kept for the wait-time percentiles
+WAIT_SAMPLES = 1000
 
 def create_access_token(
-    subject: Union[str, Any], expires_delta: Optional[timedelta] = None
+    subject: Union[str, Any], expires_delta: Optional[timedelta] = None, session_id: Optional[str] = None
 ) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -18,11 +22,83 @@ def create_access_token(
             minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES
         )
     to_encode = {"exp": expire, "sub": str(subject)}
+    if session_id:
+        to_encode["sid"] = session_id
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+class HasherOverloaded(Exception):
+    """More password hashes are waiting than PASSWORD_HASH_MAX_WAITING"""
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
\ No newline at end of file
+class PasswordHasher:
+    """
+    bcrypt off the event loop.
+    
+    Hashes run on a dedicated pool of PASSWORD_HASH_WORKERS threads (bcrypt
+    releases the GIL while it works), so a burst of logins only slows
+    other logins. Callers beyond the pool wait in an admission queue of at
+    most PASSWORD_HASH_MAX_WAITING; past that, HasherOverloaded is raised
+    instead of queueing without bound.
+    """
+    def __init__(self, workers: int, max_waiting: int, rounds: int):
+        self.workers = workers
+        self.max_waiting = max_waiting
+        # Hashes with another cost still verify, and are flagged for rehashing
+        self.context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers)
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        # Seconds recent hashes waited for a worker
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+    
+    async def _run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise HasherOverloaded("Too many password checks in progress")
+        loop = asyncio.get_running_loop()
+        queued = loop.time()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self._waits.append(loop.time() - queued)
+        self.running += 1
+        try:
+            return await loop.run_in_executor(self._executor, fn, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+    
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+    
+    async def verify(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Whether the password matches, and a new hash if the stored one uses an outdated cost"""
+        return await self._run(self.context.verify_and_update, password, hashed_password)
+    
+    def status(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        def percentile(q: float) -> float:
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))] * 1000, 1) if waits else 0.0
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1.0)},
+        }
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_waiting=settings.PASSWORD_HASH_MAX_WAITING,
+    rounds=settings.BCRYPT_ROUNDS,
+)
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""
+Server-side aggregation of audit logs for /soc/analytics.
+
+An AnalyticsQuery is compiled into one aggregation pipeline that starts
+with the same $match as /soc/logs, so it is served by the logs indexes,
+and only the grouped counts leave the server. Queries are bounded by a
+maximum window, a maximum number of groups and a server-side time limit.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from app.core.config import settings
+from app.db.archive import build_filter, hot_query, hot_since
+from app.db.codec import log_codec
+from app.db.models import AnalyticsQuery
+from app.db.mongodb import db
+
+# A $group ran out of memory and spilling to disk is not allowed
+MEMORY_LIMIT_EXCEEDED = 292
+
+class QueryTooExpensive(Exception):
+    """The server gave up on a query within the guardrails"""
+    def __init__(self, message: str, timed_out: bool):
+        super().__init__(message)
+        self.timed_out = timed_out
+
+def window(spec: AnalyticsQuery) -> Dict[str, datetime]:
+    """The spec's time range, with the /soc/logs defaults; ValueError if out of bounds"""
+    end = spec.end_time or datetime.utcnow()
+    start = spec.start_time or end - timedelta(hours=24)
+    if start >= end:
+        raise ValueError("start_time must be before end_time")
+    if end - start > timedelta(days=settings.ANALYTICS_MAX_WINDOW_DAYS):
+        raise ValueError(f"Window is longer than {settings.ANALYTICS_MAX_WINDOW_DAYS} days")
+    # Archived logs are compressed and cannot be aggregated on the server
+    if start < hot_since():
+        raise ValueError(f"Logs before {hot_since().isoformat()} are archived; use /soc/stats for older windows")
+    return {"start": start, "end": end}
+
+def compile_pipeline(spec: AnalyticsQuery, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    """
+    The aggregation pipeline answering a query.
+    
+    Each output document holds the group's key fields (and "bucket" when
+    bucketed by time) in _id, "count" and, with `distinct`, "distinct".
+    With `distinct`, logs are first grouped by key and value, then the values
+    are counted, so no group keeps a set of values in memory.
+    """
+    if spec.top is not None and spec.top > settings.ANALYTICS_MAX_GROUPS:
+        raise ValueError(f"top may be at most {settings.ANALYTICS_MAX_GROUPS}")
+    
+    match = hot_query(build_filter(start, end, spec.event_type, spec.user_id))
+    if spec.source_ip:
+        match["source_ip"] = spec.source_ip
+    
+    # The bucket goes first, so groups sort chronologically
+    key: Dict[str, Any] = {}
+    if spec.bucket is not None:
+        key["bucket"] = {"$dateTrunc": {"date": "$timestamp", "unit": spec.bucket.value}}
+    for dimension in dict.fromkeys(spec.group_by):
+        key[dimension.value] = f"${dimension.value}"
+    
+    pipeline: List[Dict[str, Any]] = [{"$match": match}]
+    if spec.distinct is not None:
+        pipeline += [
+            {"$group": {"_id": {**key, "_value": f"${spec.distinct.value}"}, "count": {"$sum": 1}}},
+            {"$group": {
+                "_id": {name: f"$_id.{name}" for name in key} or None,
+                "count": {"$sum": "$count"},
+                "distinct": {"$sum": 1},
+            }},
+        ]
+    else:
+        pipeline.append({"$group": {"_id": key or None, "count": {"$sum": 1}}})
+    
+    if spec.top is not None:
+        pipeline += [{"$sort": {"count": -1, "_id": 1}}, {"$limit": spec.top}]
+    else:
+        # One more than allowed tells the caller the result was cut short
+        pipeline += [{"$sort": {"_id": 1}}, {"$limit": settings.ANALYTICS_MAX_GROUPS + 1}]
+    return pipeline
+
+async def run(spec: AnalyticsQuery) -> Dict[str, Any]:
+    """Run a query; ValueError if the spec is out of bounds, QueryTooExpensive if the server gave up"""
+    bounds = window(spec)
+    pipeline = compile_pipeline(spec, bounds["start"], bounds["end"])
+    try:
+        groups = await db.logs.aggregate(
+            pipeline,
+            maxTimeMS=settings.ANALYTICS_MAX_TIME_MS,
+            allowDiskUse=settings.ANALYTICS_ALLOW_DISK_USE,
+        )
+    except ExecutionTimeout:
+        raise QueryTooExpensive(
+            f"Query ran longer than {settings.ANALYTICS_MAX_TIME_MS} ms; narrow the window or filters",
+            timed_out=True
+        )
+    except OperationFailure as e:
+        if e.code != MEMORY_LIMIT_EXCEEDED:
+            raise
+        raise QueryTooExpensive("Too many groups to count in memory; narrow the window or group_by", timed_out=False)
+    
+    rows = [
+        await log_codec.decode_fields({**(group["_id"] or {}), **{k: v for k, v in group.items() if k != "_id"}})
+        for group in groups
+    ]
+    truncated = spec.top is None and len(rows) > settings.ANALYTICS_MAX_GROUPS
+    return {
+        "start_time": bounds["start"],
+        "end_time": bounds["end"],
+        "group_by": [dimension.value for dimension in spec.group_by],
+        "bucket": spec.bucket.value if spec.bucket is not None else None,
+        "rows": rows[:settings.ANALYTICS_MAX_GROUPS],
+        "truncated": truncated,
+    }
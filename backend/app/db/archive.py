@@ -0,0 +1,296 @@
+"""
+Cold tier for audit logs.
+
+`logs` only holds the last LOG_HOT_RETENTION_DAYS. Older logs are moved,
+an hour at a time, into `log_archive` documents holding a zlib-compressed
+BSON array of up to ARCHIVE_CHUNK_SIZE logs, together with their time
+range and the distinct users and event types inside so reads can skip
+chunks. Archive documents expire after LOG_ARCHIVE_RETENTION_DAYS through
+a TTL index (0 keeps them forever).
+
+/soc/logs reads both tiers, so history stays queryable while the hot
+collection, and its indexes, stay bounded.
+"""
+import asyncio
+import heapq
+import itertools
+import re
+import zlib
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+
+import bson
+from bson import Binary, ObjectId
+
+from app.core.config import settings
+from app.db.audit import normalize_event_type
+from app.db.codec import log_codec, migrate
+from app.db.mongodb import db
+from app.db.pagination import after_cursor
+
+# Logs per archive document; the compressed chunk must stay under 16MB
+ARCHIVE_CHUNK_SIZE = 5000
+ZLIB_LEVEL = 6
+
+class LogFilter(NamedTuple):
+    """What /soc/logs asks for, in a form both tiers can apply"""
+    start: datetime
+    end: datetime
+    event_type: Optional[str] = None
+    event_prefix: Optional[str] = None
+    user_id: Optional[str] = None
+    # Only logs sorted after this (timestamp, _id) position, newest first
+    after: Optional[Tuple[datetime, ObjectId]] = None
+    # Only logs sorted after this position, oldest first
+    since: Optional[Tuple[datetime, ObjectId]] = None
+
+def build_filter(
+    start: datetime,
+    end: datetime,
+    event_type: Optional[str] = None,
+    user_id: Optional[str] = None
+) -> LogFilter:
+    """Filter of a log listing; event_type is exact, or a prefix ending in *"""
+    log_filter = LogFilter(start=start, end=end, user_id=user_id or None)
+    if event_type:
+        normalized = normalize_event_type(event_type)
+        if normalized.endswith("*"):
+            log_filter = log_filter._replace(event_prefix=normalized[:-1])
+        else:
+            log_filter = log_filter._replace(event_type=normalized)
+    return log_filter
+
+def hot_since() -> datetime:
+    """Logs before this may already have been moved to the archive"""
+    return datetime.utcnow() - timedelta(days=settings.LOG_HOT_RETENTION_DAYS)
+
+def _hour(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def _sort_key(log: Dict[str, Any]) -> Tuple[datetime, ObjectId]:
+    return log["timestamp"], log["_id"]
+
+def _matches(log: Dict[str, Any], log_filter: LogFilter) -> bool:
+    if not log_filter.start <= log["timestamp"] <= log_filter.end:
+        return False
+    if log_filter.event_type is not None and log.get("event_type") != log_filter.event_type:
+        return False
+    if log_filter.event_prefix is not None and not str(log.get("event_type", "")).startswith(log_filter.event_prefix):
+        return False
+    if log_filter.user_id is not None and log.get("user_id") != log_filter.user_id:
+        return False
+    if log_filter.after is not None and _sort_key(log) >= log_filter.after:
+        return False
+    if log_filter.since is not None and _sort_key(log) <= log_filter.since:
+        return False
+    return True
+
+def hot_query(log_filter: LogFilter) -> Dict[str, Any]:
+    """
+    The filter as a query on the logs collection. Event types are
+    normalized when written, so the event type is an exact match or an
+    anchored prefix, both served by the index.
+    """
+    query: Dict[str, Any] = {"timestamp": {"$gte": log_filter.start, "$lte": log_filter.end}}
+    if log_filter.event_type is not None:
+        query["event_type"] = log_filter.event_type
+    elif log_filter.event_prefix:
+        query["event_type"] = {"$regex": f"^{re.escape(log_filter.event_prefix)}"}
+    if log_filter.user_id is not None:
+        query["user_id"] = log_filter.user_id
+    if log_filter.after is not None:
+        query = after_cursor(query, log_filter.after)
+    if log_filter.since is not None:
+        timestamp, log_id = log_filter.since
+        query["timestamp"]["$gte"] = max(log_filter.start, timestamp)
+        query["$or"] = [{"timestamp": {"$gt": timestamp}}, {"_id": {"$gt": log_id}}]
+    return query
+
+def _archive_query(log_filter: LogFilter) -> Dict[str, Any]:
+    """Archive chunks that may hold logs matching the filter"""
+    query: Dict[str, Any] = {"end": {"$gte": log_filter.start}, "start": {"$lte": log_filter.end}}
+    if log_filter.after is not None:
+        query["start"]["$lte"] = min(log_filter.end, log_filter.after[0])
+    if log_filter.since is not None:
+        query["end"]["$gte"] = max(log_filter.start, log_filter.since[0])
+    if log_filter.event_type is not None:
+        query["event_types"] = log_filter.event_type
+    elif log_filter.event_prefix:
+        query["event_types"] = {"$regex": f"^{re.escape(log_filter.event_prefix)}"}
+    if log_filter.user_id is not None:
+        query["user_ids"] = log_filter.user_id
+    return query
+
+def _project(log: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    if projection is None:
+        return log
+    return {k: v for k, v in log.items() if k == "_id" or k in projection}
+
+def _compress(logs: List[Dict[str, Any]]) -> Binary:
+    return Binary(zlib.compress(bson.encode({"logs": logs}), ZLIB_LEVEL))
+
+def _decompress(data: bytes) -> List[Dict[str, Any]]:
+    return bson.decode(zlib.decompress(data))["logs"]
+
+async def _archive_chunk(logs: List[Dict[str, Any]]):
+    """
+    Write one archive document, then drop its logs from the hot tier.
+
+    The document id comes from the chunk's first log, and chunks are cut
+    in _id order, so a run interrupted between the two steps rewrites the
+    same document instead of archiving logs twice. Until the logs are
+    dropped they are in both tiers, and readers drop the second copy.
+    """
+    timestamps = [log["timestamp"] for log in logs]
+    await db.db.log_archive.replace_one({"_id": logs[0]["_id"]}, {
+        "bucket": _hour(logs[0]["timestamp"]),
+        "start": min(timestamps),
+        "end": max(timestamps),
+        "count": len(logs),
+        "event_types": sorted({str(log.get("event_type")) for log in logs}),
+        "user_ids": sorted({str(log.get("user_id")) for log in logs}),
+        "data": _compress(logs),
+    }, upsert=True)
+    await db.logs.delete_many({"_id": {"$in": [log["_id"] for log in logs]}})
+
+async def archive_logs(before: Optional[datetime] = None) -> int:
+    """Move hot logs older than `before` into the archive, hour by hour"""
+    if before is None:
+        before = hot_since()
+
+    archived = 0
+    while True:
+        oldest = await db.logs.find_one({"timestamp": {"$lt": before}}, sort=[("timestamp", 1)])
+        if oldest is None:
+            return archived
+        hour = _hour(oldest["timestamp"])
+        window = {"$gte": hour, "$lt": min(hour + timedelta(hours=1), before)}
+        while True:
+            cursor = db.logs.find({"timestamp": window}).sort("_id", 1).limit(ARCHIVE_CHUNK_SIZE)
+            logs = await cursor.to_list(length=ARCHIVE_CHUNK_SIZE)
+            if not logs:
+                break
+            await _archive_chunk(logs)
+            archived += len(logs)
+
+async def find_archived(
+    log_filter: LogFilter,
+    limit: int,
+    projection: Optional[Dict[str, int]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Up to `limit` archived logs matching the filter, newest first.
+
+    Chunks are read newest first and reading stops once no remaining
+    chunk can hold a log newer than the ones already found.
+    """
+    found: List[Dict[str, Any]] = []
+    cursor = db.db.log_archive.find(_archive_query(log_filter)).sort("end", -1)
+    async for chunk in cursor:
+        if len(found) >= limit and chunk["end"] < found[limit - 1]["timestamp"]:
+            break
+        found.extend(log for log in _decompress(chunk["data"]) if _matches(log, log_filter))
+        found = dedupe(found)
+        del found[limit:]
+
+    return [_project(log, projection) for log in found]
+
+def dedupe(logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Logs newest first with one copy of each _id. A chunk rewritten with
+    other boundaries after an interrupted run can repeat archived logs,
+    and logs are in both tiers until their chunk is written.
+    """
+    unique = {log["_id"]: log for log in logs}
+    return sorted(unique.values(), key=_sort_key, reverse=True)
+
+async def _next(iterator: AsyncIterator[Any]) -> Any:
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def iter_logs(
+    log_filter: LogFilter,
+    projection: Optional[Dict[str, int]] = None,
+    batch_size: int = 1000
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Every log matching the filter, from both tiers, oldest first.
+
+    The hot tier is read through one cursor in batches of `batch_size`.
+    Archive chunks are decompressed only once the merge reaches their
+    start, so memory is bounded by the chunks overlapping in time, not by
+    the number of logs exported. Copies of a log in both tiers, or in two
+    chunks, sort next to each other and only the first is yielded.
+    """
+    hot = db.logs.find(hot_query(log_filter), projection).sort([("timestamp", 1), ("_id", 1)])
+    hot = hot.batch_size(batch_size).__aiter__()
+    chunks = None
+    if log_filter.start < hot_since():
+        chunks = db.db.log_archive.find(_archive_query(log_filter)).sort("start", 1).batch_size(1)
+
+    # The counter keeps two copies of a log from comparing their dicts
+    pending: List[Tuple[datetime, ObjectId, int, Dict[str, Any]]] = []
+    order = itertools.count()
+    last: Optional[Tuple[datetime, ObjectId]] = None
+    next_hot = await _next(hot)
+    next_chunk = await _next(chunks) if chunks is not None else None
+    while True:
+        heads = [_sort_key(next_hot)] if next_hot is not None else []
+        if pending:
+            heads.append(pending[0][:2])
+        # Open every chunk that may hold a log sorted before the next one
+        while next_chunk is not None and (not heads or next_chunk["start"] <= min(heads)[0]):
+            for log in _decompress(next_chunk["data"]):
+                if _matches(log, log_filter):
+                    heapq.heappush(pending, (log["timestamp"], log["_id"], next(order), _project(log, projection)))
+            next_chunk = await _next(chunks)
+            if pending:
+                heads.append(pending[0][:2])
+        if not heads:
+            return
+        if pending and (next_hot is None or pending[0][:2] < _sort_key(next_hot)):
+            timestamp, log_id, _, log = heapq.heappop(pending)
+            key = (timestamp, log_id)
+        else:
+            log, key = next_hot, _sort_key(next_hot)
+            next_hot = await _next(hot)
+        if key != last:
+            last = key
+            yield log
+
+class LogArchiver:
+    """Periodically moves expired hot logs into the archive"""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                # Logs still in the uncompact layout are re-encoded first
+                if await log_codec.legacy():
+                    migrated = await migrate()
+                    print(f"Re-encoded {migrated} logs")
+                archived = await archive_logs()
+                if archived:
+                    print(f"Archived {archived} logs")
+            except Exception as e:
+                print(f"Error archiving logs: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+log_archiver = LogArchiver(interval=settings.LOG_ARCHIVE_INTERVAL_SECONDS)
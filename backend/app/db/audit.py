@@ -0,0 +1,224 @@
+import asyncio
+import re
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from fastapi import Request
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.db import rollups
+from app.db.mongodb import db
+from app.ml.feature_store import record_logs
+
+# Client address and user agent of the request being handled, set by the
+# middleware in main.py so every entry is stamped without each call site
+# passing them along
+request_context: ContextVar[Dict[str, Optional[str]]] = ContextVar("audit_request_context", default={})
+
+# Attempts at writing a batch before it is given up on
+MAX_FLUSH_ATTEMPTS = 3
+RETRY_SECONDS = 1
+
+# Error code of an insert whose _id is already stored
+DUPLICATE_KEY = 11000
+
+# Queued by close(): the writer flushes the batch it holds and stops
+_STOP = object()
+
+def client_ip(request: Request) -> Optional[str]:
+    """Address a request is attributed to, in audit entries and login throttling"""
+    return request.client.host if request.client else None
+
+def normalize_event_type(event_type: str) -> str:
+    """Canonical spelling of an event type: lower-case words joined by underscores"""
+    return re.sub(r"[\s\-]+", "_", event_type.strip()).lower()
+
+def stamp(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Fill in timestamp, source_ip and user_agent the caller left out, and
+    normalize event_type so readers can match it exactly
+    """
+    entry.setdefault("timestamp", datetime.utcnow())
+    if isinstance(entry.get("event_type"), str):
+        entry["event_type"] = normalize_event_type(entry["event_type"])
+    context = request_context.get()
+    for field in ("source_ip", "user_agent"):
+        if entry.get(field) is None:
+            entry[field] = context.get(field)
+    return entry
+
+class AuditLogWriter:
+    """
+    Batches audit entries into insert_many calls.
+
+    Entries wait in a bounded queue and are flushed every `flush_seconds`,
+    or as soon as `batch_size` are waiting. Until start() is called, and
+    after close(), entries are written directly.
+    """
+    def __init__(self, batch_size: int, flush_seconds: float, queue_size: int, backpressure: str):
+        if backpressure not in ("block", "drop"):
+            raise ValueError(f"Unknown audit backpressure policy: {backpressure}")
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.backpressure = backpressure
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            # The queue is handed over, as close() may run before the task first does
+            self._task = asyncio.create_task(self._run(self._queue))
+
+    async def close(self):
+        """Write out everything still queued and go back to direct writes"""
+        if self._task is None:
+            return
+        task, queue = self._task, self._queue
+        self._task, self._queue = None, None
+        # Not cancelled: the writer may hold a batch taken off the queue, or
+        # be writing one, and finishes that before it reaches the marker
+        await queue.put(_STOP)
+        await task
+
+        # Entries of callers that were waiting for room in the queue
+        batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        for start in range(0, len(batch), self.batch_size):
+            await self._flush(batch[start:start + self.batch_size])
+
+    async def write(self, entry: Dict[str, Any], durable: bool = False):
+        stamp(entry)
+        if durable or self._queue is None:
+            await self._flush([entry], raise_errors=True)
+            return
+
+        if self.backpressure == "drop":
+            try:
+                self._queue.put_nowait(entry)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                print("Audit log queue full, dropping entry")
+        else:
+            await self._queue.put(entry)
+
+    async def ingest(self, entries: List[Dict[str, Any]]) -> bool:
+        """
+        Queue a batch of externally sourced entries, all or nothing.
+
+        Unlike write(), entries are not stamped with the current request's
+        client, and a full queue does not block: False is returned, with
+        nothing queued, so the caller can push back on its source.
+        """
+        if self._queue is None:
+            for start in range(0, len(entries), self.batch_size):
+                await self._flush(entries[start:start + self.batch_size], raise_errors=True)
+            return True
+
+        if self._queue.maxsize - self._queue.qsize() < len(entries):
+            self.rejected += len(entries)
+            return False
+        for entry in entries:
+            self._queue.put_nowait(entry)
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _STOP:
+                    await self._flush(batch)
+                    return
+                batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Dict[str, Any]], raise_errors: bool = False):
+        # Ids are fixed before the first attempt, so an entry a failed
+        # attempt did store is recognized as written when it is retried
+        for entry in batch:
+            entry.setdefault("_id", ObjectId())
+        pending = batch
+        for attempt in range(1, MAX_FLUSH_ATTEMPTS + 1):
+            try:
+                # Unordered so one bad entry does not hold back the rest
+                await db.logs.insert_many(pending, ordered=False)
+                pending = []
+                break
+            except Exception as e:
+                if isinstance(e, BulkWriteError):
+                    # Only retry the entries that were not stored
+                    failed = sorted({
+                        error["index"] for error in e.details["writeErrors"] if error["code"] != DUPLICATE_KEY
+                    })
+                    pending = [pending[index] for index in failed]
+                    if not pending:
+                        break
+                if raise_errors:
+                    raise
+                if attempt == MAX_FLUSH_ATTEMPTS:
+                    self.dropped += len(pending)
+                    print(f"Error writing {len(pending)} audit log entries: {str(e)}")
+                    break
+                await asyncio.sleep(RETRY_SECONDS)
+        if pending:
+            dropped = {id(entry) for entry in pending}
+            batch = [entry for entry in batch if id(entry) not in dropped]
+            if not batch:
+                return
+        self.written += len(batch)
+
+        # The audit entries are what matters; a failed counter update must
+        # not fail the request that wrote them
+        try:
+            await record_logs(batch)
+        except Exception as e:
+            print(f"Error updating feature store: {str(e)}")
+        try:
+            await rollups.record_logs(batch)
+        except Exception as e:
+            print(f"Error updating stat rollups: {str(e)}")
+
+audit_log = AuditLogWriter(
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_seconds=settings.AUDIT_FLUSH_SECONDS,
+    queue_size=settings.AUDIT_QUEUE_SIZE,
+    backpressure=settings.AUDIT_BACKPRESSURE,
+)
+
+async def write_log(entry: Dict[str, Any], durable: bool = False):
+    """
+    Record an audit log entry and fold it into the per-user feature counters.
+
+    Entries are buffered and written in batches. Pass durable=True for
+    security-critical events: the entry is written before this returns,
+    and a failure to write it is raised to the caller.
+    """
+    await audit_log.write(entry, durable=durable)
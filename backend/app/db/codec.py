@@ -0,0 +1,653 @@
+"""
+Compact storage encoding of audit logs.
+
+Documents in `logs` are stored with short field names and event types
+as small integers:
+
+    user_id          "u"
+    event_type       "e"   integer code, names kept in `event_types`
+    details          "d"   well-known keys shortened
+    timestamp        "t"
+    source_ip        "ip"
+    user_agent       "ua"
+
+Missing values are not stored at all. Everything outside this module
+reads and writes logs through `db.logs`, a LogCollection that encodes
+documents, queries, projections, sorts and pipelines on the way in and
+decodes documents on the way out, so callers and LogEntry keep the
+logical shape.
+
+Other values are stored as they are, so decoding a log only renames its
+keys and looks up its event type, and any log round-trips unchanged.
+
+Logs written before this encoding are re-encoded in the background by the
+log archiver. Until it records in `migrations` that none is left, every
+read covers both layouts: finds and counts query each layout with its own
+field names (and indexes) and merge the results, and aggregations take
+the old documents in through $unionWith, reshaped to the compact layout.
+
+To re-encode them in one go instead (with the app stopped):
+    python -m app.db.codec --migrate
+"""
+import argparse
+import asyncio
+import functools
+import re
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from app.core.config import settings
+from app.db.mongodb import db
+
+# Logical field name -> stored field name
+FIELDS = {
+    "user_id": "u",
+    "event_type": "e",
+    "details": "d",
+    "timestamp": "t",
+    "source_ip": "ip",
+    "user_agent": "ua",
+}
+
+# Well-known detail keys -> stored key
+DETAIL_FIELDS = {
+    "success": "ok",
+    "command": "cmd",
+    "username": "un",
+    "role": "r",
+    "mfa_used": "mfa",
+    "session_token": "tok",
+    "instance_id": "vm",
+    "vm_id": "vid",
+    "vm_ip": "vip",
+    "count": "n",
+    "filter": "f",
+}
+
+# Fields LogEntry declares optional; decoded as None when not stored
+NULLABLE_FIELDS = ("source_ip", "user_agent")
+
+# Stored code of event types missing from the registry: matches nothing
+UNKNOWN_EVENT_TYPE = -1
+
+# Logs re-encoded per bulk write by --migrate
+MIGRATION_BATCH_SIZE = 1000
+
+# Index names of the uncompact layout, dropped after migrating
+LEGACY_INDEXES = ["timestamp_id", "event_type_timestamp_id", "user_id_timestamp_id", "event_type_success"]
+
+# Document in `migrations` written once no log is left in the uncompact layout
+MIGRATION_ID = "log_encoding"
+
+# How often a worker still reading both layouts checks whether migration finished
+LEGACY_CHECK_SECONDS = 10
+
+# Error code of dropping an index that is already gone
+INDEX_NOT_FOUND = 27
+
+_STORED_DETAILS = {stored: name for name, stored in DETAIL_FIELDS.items()}
+# Prefix of unknown detail keys that would read as a stored key
+_ESCAPE = "~"
+
+def _detail_key(key: str) -> str:
+    stored = DETAIL_FIELDS.get(key)
+    if stored is not None:
+        return stored
+    if key in _STORED_DETAILS or key.startswith(_ESCAPE):
+        return _ESCAPE + key
+    return key
+
+def _detail_name(key: str) -> str:
+    if key.startswith(_ESCAPE):
+        return key[len(_ESCAPE):]
+    return _STORED_DETAILS.get(key, key)
+
+def _encode_details(details: Dict[str, Any]) -> Dict[str, Any]:
+    return {_detail_key(key): value for key, value in details.items()}
+
+def _decode_details(details: Any) -> Any:
+    if not isinstance(details, dict):
+        return details
+    return {_detail_name(key): value for key, value in details.items()}
+
+def _projected(name: str, projection: Optional[Dict[str, Any]]) -> bool:
+    """Whether a projection returns a top-level field"""
+    if projection is None:
+        return True
+    inclusive = any(value for key, value in projection.items() if key != "_id")
+    return bool(projection.get(name)) if inclusive else name not in projection
+
+def path(name: str) -> str:
+    """Stored form of a dotted field path, e.g. details.success -> d.ok"""
+    prefix = ""
+    if name.startswith("fullDocument."):
+        prefix, name = "fullDocument.", name[len("fullDocument."):]
+    parts = name.split(".")
+    if parts[0] not in FIELDS:
+        return prefix + name
+    if parts[0] == "details" and len(parts) > 1:
+        parts[1] = _detail_key(parts[1])
+    parts[0] = FIELDS[parts[0]]
+    return prefix + ".".join(parts)
+
+def _field_of(name: str) -> str:
+    """Logical top-level field of a (possibly change stream) path"""
+    if name.startswith("fullDocument."):
+        name = name[len("fullDocument."):]
+    return name
+
+class _EventNames(dict):
+    """Event type names by code; a code missing from it reads as itself"""
+    def __missing__(self, code: Any) -> Any:
+        return code if isinstance(code, str) else str(code)
+
+class LogCodec:
+    """
+    Encoder and decoder of log documents.
+    
+    Holds the event type registry in memory: all of it is read on first
+    use and again whenever a name or code is missing, and new names are
+    registered as they are first written.
+    """
+    def __init__(self):
+        self._codes: Dict[str, int] = {}
+        self._names: Dict[int, str] = _EventNames()
+        self._lock: Optional[asyncio.Lock] = None
+        # Whether logs may remain in the uncompact layout, and when that was last checked
+        self._legacy = True
+        self._legacy_checked = float("-inf")
+        self._legacy_registered = False
+        # Stored key -> logical name and how its value is decoded, if at all
+        self._decoders: Dict[str, Tuple[str, Any]] = {stored: (name, None) for name, stored in FIELDS.items()}
+        self._decoders[FIELDS["event_type"]] = ("event_type", self._names.__getitem__)
+        self._decoders[FIELDS["details"]] = ("details", _decode_details)
+    
+    async def legacy(self) -> bool:
+        """Whether reads must still cover logs in the uncompact layout"""
+        if self._legacy and time.monotonic() - self._legacy_checked >= LEGACY_CHECK_SECONDS:
+            self._legacy_checked = time.monotonic()
+            self._legacy = await db.db.migrations.find_one({"_id": MIGRATION_ID}) is None
+        return self._legacy
+    
+    async def _reload(self):
+        async for row in db.db.event_types.find({}):
+            self._codes[row["name"]] = row["_id"]
+            self._names[row["_id"]] = row["name"]
+    
+    async def _register(self, names: Sequence[str]):
+        missing = [name for name in dict.fromkeys(names) if name not in self._codes]
+        if not missing:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            await self._reload()
+            for name in missing:
+                # Another writer may pick the same code first; take the next
+                while name not in self._codes:
+                    code = max(self._names, default=0) + 1
+                    try:
+                        await db.db.event_types.insert_one({"_id": code, "name": name})
+                        self._codes[name] = code
+                        self._names[code] = name
+                    except DuplicateKeyError:
+                        await self._reload()
+    
+    async def _known(self, codes: Sequence[Any]):
+        if any(isinstance(code, int) and code not in self._names for code in codes):
+            await self._reload()
+    
+    async def event_code(self, name: str) -> int:
+        """Stored code of an event type, UNKNOWN_EVENT_TYPE if it was never written"""
+        if name not in self._codes:
+            await self._reload()
+        return self._codes.get(name, UNKNOWN_EVENT_TYPE)
+    
+    async def event_name(self, code: Any) -> Any:
+        """Event type name of a stored code; anything else is returned as it is"""
+        if not isinstance(code, int) or isinstance(code, bool):
+            return code
+        await self._known([code])
+        return self._names.get(code, str(code))
+    
+    def _encode_doc(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        doc = {}
+        for key, value in entry.items():
+            stored = FIELDS.get(key)
+            if stored is None:
+                doc[key] = value
+            elif value is None:
+                continue
+            elif key == "event_type" and isinstance(value, str):
+                doc[stored] = self._codes[value]
+            elif key == "details" and isinstance(value, dict):
+                doc[stored] = _encode_details(value)
+            else:
+                doc[stored] = value
+        return doc
+    
+    def _decode_doc(self, doc: Dict[str, Any], nullable: Sequence[str] = NULLABLE_FIELDS) -> Dict[str, Any]:
+        """
+        Turn a stored log into its logical form, in place, which spares a
+        second dict per log on large scans. `nullable` are the missing
+        fields to decode as None. Other keys (_id, or a log written before
+        the compact encoding) are left as they are.
+        """
+        decoders = self._decoders
+        for key in [key for key in doc if key in decoders]:
+            name, decode = decoders[key]
+            value = doc.pop(key)
+            doc[name] = value if decode is None else decode(value)
+        for name in nullable:
+            if name not in doc:
+                doc[name] = None
+        return doc
+    
+    async def encode_many(self, entries: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        await self._register([
+            entry["event_type"] for entry in entries if isinstance(entry.get("event_type"), str)
+        ])
+        return [self._encode_doc(entry) for entry in entries]
+    
+    async def decode_many(
+        self,
+        docs: Sequence[Dict[str, Any]],
+        projection: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """Decode documents as returned by the driver; they are changed in place"""
+        await self._known([doc.get(FIELDS["event_type"]) for doc in docs])
+        nullable = [name for name in NULLABLE_FIELDS if _projected(name, projection)]
+        return [self._decode_doc(doc, nullable) for doc in docs]
+    
+    async def decode_fields(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """Decode the values of a flat row keyed by logical field names, e.g. a $group key"""
+        decoded = dict(row)
+        for name, value in row.items():
+            if name == "event_type":
+                decoded[name] = await self.event_name(value)
+        return decoded
+    
+    async def _encode_value(self, value: Any) -> Any:
+        return await self.event_code(value) if isinstance(value, str) else value
+    
+    async def _encode_condition(self, field: str, condition: Any) -> Any:
+        if field != "event_type":
+            return condition
+        if not isinstance(condition, dict):
+            return await self._encode_value(condition)
+        
+        if "$regex" in condition:
+            if set(condition) - {"$regex", "$options"}:
+                raise ValueError("$regex on event_type cannot be combined with other operators")
+            # Codes say nothing about names; match the registry instead
+            await self._reload()
+            pattern = re.compile(condition["$regex"], re.IGNORECASE if "i" in condition.get("$options", "") else 0)
+            return {"$in": [code for name, code in self._codes.items() if pattern.search(name)]}
+        encoded = {}
+        for operator, operand in condition.items():
+            if operator in ("$eq", "$ne"):
+                encoded[operator] = await self._encode_value(operand)
+            elif operator in ("$in", "$nin", "$all"):
+                encoded[operator] = [await self._encode_value(item) for item in operand]
+            elif operator == "$not":
+                encoded[operator] = await self._encode_condition(field, operand)
+            elif operator == "$exists":
+                encoded[operator] = operand
+            else:
+                # Codes follow registration order, so ranges over names cannot be encoded
+                raise ValueError(f"{operator} is not supported on event_type")
+        return encoded
+    
+    async def encode_query(self, query: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if query is None:
+            return None
+        encoded = {}
+        for key, condition in query.items():
+            if key in ("$or", "$and", "$nor"):
+                encoded[key] = [await self.encode_query(clause) for clause in condition]
+            else:
+                encoded[path(key)] = await self._encode_condition(_field_of(key), condition)
+        return encoded
+    
+    async def layout_queries(self, query: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        The query as it matches each layout logs may be stored in: the
+        compact one, then while migration is pending the uncompact one.
+        Each only matches documents of its own layout.
+        """
+        compact = await self.encode_query(query) or {}
+        if not await self.legacy():
+            return [compact]
+        return [_of_layout(compact, FIELDS["timestamp"]), _of_layout(dict(query or {}), "timestamp")]
+    
+    async def compact_shape(self) -> Dict[str, Any]:
+        """$project turning an uncompact log into the compact layout, as far as a pipeline can"""
+        if not self._legacy_registered:
+            # Old event types need codes to be grouped with the new logs
+            await self._register([name for name in await db.db.logs.distinct("event_type") if isinstance(name, str)])
+            self._legacy_registered = True
+        event_type: Any = "$event_type"
+        if self._codes:
+            event_type = {"$switch": {
+                "branches": [{"case": {"$eq": ["$event_type", name]}, "then": code} for name, code in self._codes.items()],
+                "default": "$event_type",
+            }}
+        detail_key = {"$switch": {
+            "branches": [{"case": {"$eq": ["$$this.k", name]}, "then": stored} for name, stored in DETAIL_FIELDS.items()] + [{
+                "case": {"$or": [
+                    {"$in": ["$$this.k", list(_STORED_DETAILS)]},
+                    {"$eq": [{"$substrCP": ["$$this.k", 0, 1]}, _ESCAPE]},
+                ]},
+                "then": {"$concat": [_ESCAPE, "$$this.k"]},
+            }],
+            "default": "$$this.k",
+        }}
+        return {
+            FIELDS["user_id"]: "$user_id",
+            FIELDS["event_type"]: event_type,
+            FIELDS["details"]: {"$arrayToObject": {"$map": {
+                "input": {"$objectToArray": {"$ifNull": ["$details", {}]}},
+                "in": {"k": detail_key, "v": "$$this.v"},
+            }}},
+            FIELDS["timestamp"]: "$timestamp",
+            FIELDS["source_ip"]: "$source_ip",
+            FIELDS["user_agent"]: "$user_agent",
+        }
+    
+    async def encode_pipeline(self, pipeline: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        encoded = []
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            if operator == "$match":
+                encoded.append({operator: await self.encode_query(spec)})
+            elif operator in ("$sort", "$project"):
+                encoded.append({operator: {path(key): _encode_paths(value) for key, value in spec.items()}})
+            else:
+                encoded.append({operator: _encode_paths(spec)})
+        return encoded
+
+def _encode_paths(value: Any) -> Any:
+    """Rewrite "$field" references inside an aggregation expression"""
+    if isinstance(value, str):
+        if value.startswith("$") and not value.startswith("$$"):
+            return "$" + path(value[1:])
+        return value
+    if isinstance(value, dict):
+        return {key: _encode_paths(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode_paths(item) for item in value]
+    return value
+
+def _of_layout(query: Dict[str, Any], timestamp_field: str) -> Dict[str, Any]:
+    """Restrict a query to the layout whose timestamp is stored under timestamp_field"""
+    stored = {timestamp_field: {"$exists": True}}
+    if timestamp_field in query:
+        return {"$and": [query, stored]}
+    return {**query, **stored}
+
+def encode_projection(projection: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if projection is None:
+        return None
+    return {path(key): value for key, value in projection.items()}
+
+def _sort_spec(key_or_list: Union[str, List[Tuple[str, int]]], direction: Optional[int] = None) -> List[Tuple[str, int]]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    return list(key_or_list)
+
+def encode_sort(key_or_list: Union[str, List[Tuple[str, int]]], direction: Optional[int] = None):
+    return [(path(key), order) for key, order in _sort_spec(key_or_list, direction)]
+
+def _value(entry: Dict[str, Any], name: str) -> Any:
+    for part in name.split("."):
+        entry = entry.get(part) if isinstance(entry, dict) else None
+    return entry
+
+def _order_key(sort: List[Tuple[str, int]]):
+    """Key ordering decoded logs as the server sorts them, missing values first"""
+    def compare(a: Dict[str, Any], b: Dict[str, Any]) -> int:
+        for name, direction in sort:
+            x, y = _value(a, name), _value(b, name)
+            if x == y:
+                continue
+            if x is None:
+                return -direction
+            if y is None or x > y:
+                return direction
+            return -direction
+        return 0
+    return functools.cmp_to_key(compare)
+
+async def _next(iterator: AsyncIterator[Any]) -> Any:
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+log_codec = LogCodec()
+
+class LogCursor:
+    """
+    A find cursor on logs that yields decoded documents. While migration is
+    pending it reads each layout with its own cursor and merges them.
+    """
+    def __init__(self, collection, query: Optional[Dict[str, Any]], projection: Optional[Dict[str, Any]]):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: Optional[List[Tuple[str, int]]] = None
+        self._limit = 0
+        self._batch_size = 0
+    
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "LogCursor":
+        self._sort = _sort_spec(key_or_list, direction)
+        return self
+    
+    def limit(self, limit: int) -> "LogCursor":
+        self._limit = limit
+        return self
+    
+    def batch_size(self, batch_size: int) -> "LogCursor":
+        self._batch_size = batch_size
+        return self
+    
+    async def _open(self) -> List[Any]:
+        cursors = []
+        for layout, query in enumerate(await log_codec.layout_queries(self._query)):
+            compact = layout == 0
+            cursor = self._collection.find(query, encode_projection(self._projection) if compact else self._projection)
+            if self._sort:
+                cursor = cursor.sort(encode_sort(self._sort) if compact else self._sort)
+            if self._limit:
+                cursor = cursor.limit(self._limit)
+            if self._batch_size:
+                cursor = cursor.batch_size(self._batch_size)
+            cursors.append(cursor)
+        return cursors
+    
+    async def to_list(self, length: Optional[int]) -> List[Dict[str, Any]]:
+        cursors = await self._open()
+        if len(cursors) == 1:
+            docs = await cursors[0].to_list(length=length)
+            return await log_codec.decode_many(docs, self._projection)
+        entries = []
+        async for entry in self._merge(cursors):
+            entries.append(entry)
+            if length and len(entries) >= length:
+                break
+        return entries
+    
+    async def __aiter__(self) -> AsyncIterator[Dict[str, Any]]:
+        cursors = await self._open()
+        if len(cursors) == 1:
+            async for entry in self._decode(cursors[0]):
+                yield entry
+            return
+        async for entry in self._merge(cursors):
+            yield entry
+    
+    async def _decode(self, cursor) -> AsyncIterator[Dict[str, Any]]:
+        batch: List[Dict[str, Any]] = []
+        # Decode a driver batch at a time, not one await per document
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= (self._batch_size or 101):
+                for entry in await log_codec.decode_many(batch, self._projection):
+                    yield entry
+                batch = []
+        for entry in await log_codec.decode_many(batch, self._projection):
+            yield entry
+    
+    async def _merge(self, cursors: List[Any]) -> AsyncIterator[Dict[str, Any]]:
+        """Entries of every layout in sort order (one layout after the other when unsorted), up to the limit"""
+        streams = [self._decode(cursor).__aiter__() for cursor in cursors]
+        heads = [await _next(stream) for stream in streams]
+        key = _order_key(self._sort) if self._sort else None
+        returned = 0
+        while not self._limit or returned < self._limit:
+            live = [index for index, head in enumerate(heads) if head is not None]
+            if not live:
+                return
+            index = min(live, key=lambda i: key(heads[i])) if key else live[0]
+            yield heads[index]
+            returned += 1
+            heads[index] = await _next(streams[index])
+
+class LogCollection:
+    """The logs collection, read and written in the logical shape"""
+    def __init__(self, collection):
+        self.collection = collection
+    
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> LogCursor:
+        return LogCursor(self.collection, query, projection)
+    
+    async def find_one(
+        self,
+        query: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None,
+        sort: Optional[List[Tuple[str, int]]] = None
+    ) -> Optional[Dict[str, Any]]:
+        cursor = self.find(query, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        entries = await cursor.to_list(length=1)
+        return entries[0] if entries else None
+    
+    async def insert_many(self, entries: List[Dict[str, Any]], ordered: bool = True):
+        docs = await log_codec.encode_many(entries)
+        result = await self.collection.insert_many(docs, ordered=ordered)
+        # As the driver does for the documents it is given
+        for entry, doc in zip(entries, docs):
+            entry["_id"] = doc["_id"]
+        return result
+    
+    async def count_documents(self, query: Dict[str, Any]) -> int:
+        return sum([
+            await self.collection.count_documents(layout_query)
+            for layout_query in await log_codec.layout_queries(query)
+        ])
+    
+    async def delete_many(self, query: Dict[str, Any]) -> int:
+        """Delete matching logs; returns how many there were"""
+        deleted = 0
+        for layout_query in await log_codec.layout_queries(query):
+            deleted += (await self.collection.delete_many(layout_query)).deleted_count
+        return deleted
+    
+    async def aggregate(self, pipeline: Sequence[Dict[str, Any]], **kwargs) -> List[Dict[str, Any]]:
+        """
+        Run a pipeline written against logical field names. Output is not
+        decoded, since its shape is the pipeline's; see decode_fields.
+        """
+        cursor = self.collection.aggregate(await self._layout_pipeline(pipeline), **kwargs)
+        return await cursor.to_list(length=None)
+    
+    async def _layout_pipeline(self, pipeline: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """The encoded pipeline, reading uncompact logs too while migration is pending"""
+        if not await log_codec.legacy():
+            return await log_codec.encode_pipeline(pipeline)
+        # Split the leading $match per layout; other stages see compact documents
+        match, rest = ({}, list(pipeline))
+        if pipeline and "$match" in pipeline[0]:
+            match, rest = pipeline[0]["$match"], list(pipeline[1:])
+        compact, legacy = await log_codec.layout_queries(match)
+        return [
+            {"$match": compact},
+            {"$unionWith": {"coll": self.collection.name, "pipeline": [
+                {"$match": legacy},
+                {"$project": await log_codec.compact_shape()},
+            ]}},
+            *await log_codec.encode_pipeline(rest),
+        ]
+    
+    async def watch(self, pipeline: Sequence[Dict[str, Any]], **kwargs):
+        """A change stream; decode fullDocument with decode()"""
+        return self.collection.watch(await log_codec.encode_pipeline(pipeline), **kwargs)
+    
+    async def decode(self, docs: Sequence[Dict[str, Any]], projection: Optional[Dict[str, Any]] = None):
+        return await log_codec.decode_many(docs, projection)
+
+async def migrate() -> int:
+    """
+    Re-encode logs stored in the uncompact layout, then drop its indexes
+    and record that reads no longer need to cover it. Safe to run from
+    several workers at once.
+    """
+    migrated = 0
+    legacy = db.db.logs.find({"timestamp": {"$exists": True}}).batch_size(MIGRATION_BATCH_SIZE)
+    batch: List[Dict[str, Any]] = []
+    async for doc in legacy:
+        batch.append(doc)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            migrated += await _migrate_batch(batch)
+            batch = []
+    if batch:
+        migrated += await _migrate_batch(batch)
+    
+    existing = await db.db.logs.index_information()
+    for name in LEGACY_INDEXES:
+        if name in existing:
+            try:
+                await db.db.logs.drop_index(name)
+            except OperationFailure as e:
+                # Another worker finished first
+                if e.code != INDEX_NOT_FOUND:
+                    raise
+    await db.db.migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$setOnInsert": {"finished_at": datetime.utcnow(), "migrated": migrated}},
+        upsert=True
+    )
+    log_codec._legacy = False
+    return migrated
+
+async def _migrate_batch(batch: List[Dict[str, Any]]) -> int:
+    docs = await log_codec.encode_many(batch)
+    # A log another worker already re-encoded is left alone
+    await db.db.logs.bulk_write([
+        ReplaceOne({"_id": doc["_id"], "timestamp": {"$exists": True}}, doc) for doc in docs
+    ], ordered=False)
+    return len(docs)
+
+async def _main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--migrate", action="store_true", help="re-encode logs in the uncompact layout")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+    
+    from motor.motor_asyncio import AsyncIOMotorClient
+    db.client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db.db = db.client[settings.MONGODB_DB_NAME]
+    try:
+        print(f"Re-encoded {await migrate()} logs")
+    finally:
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
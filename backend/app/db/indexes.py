@@ -0,0 +1,244 @@
+"""
+Index declarations for every collection, and a check that the hot queries
+use them.
+
+Run on its own to create the indexes and print each query's plan:
+    python -m app.db.indexes
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from app.core.config import settings
+from app.db.codec import log_codec, path
+from app.db.mongodb import db
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    # Logs are stored in the compact encoding (app.db.codec), so their
+    # indexes are on the stored field names
+    "logs": [
+        # Time-window reads, newest first (/soc/logs, scoring, training).
+        # _id makes the order total for keyset pagination
+        IndexModel([(path("timestamp"), DESCENDING), ("_id", DESCENDING)], name="t_id"),
+        IndexModel(
+            [(path("event_type"), ASCENDING), (path("timestamp"), DESCENDING), ("_id", DESCENDING)],
+            name="e_t_id"
+        ),
+        IndexModel(
+            [(path("user_id"), ASCENDING), (path("timestamp"), DESCENDING), ("_id", DESCENDING)],
+            name="u_t_id"
+        ),
+        # Only login outcomes carry details.success
+        IndexModel(
+            [(path("event_type"), ASCENDING), (path("details.success"), ASCENDING)],
+            name="e_ok",
+            partialFilterExpression={path("details.success"): {"$exists": True}},
+        ),
+    ],
+    "event_types": [
+        IndexModel([("name", ASCENDING)], name="name", unique=True),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username", unique=True),
+        IndexModel([("email", ASCENDING)], name="email", unique=True),
+    ],
+    "ssh_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    "login_throttle": [
+        # Failure counters and lockouts of the shared throttle store
+        IndexModel([("expires_at", ASCENDING)], name="expiry", expireAfterSeconds=0),
+    ],
+    "sessions": [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Read by every worker rebuilding its revocation filter
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at", sparse=True),
+        IndexModel([("purge_at", ASCENDING)], name="expiry", expireAfterSeconds=0),
+    ],
+    "user_invalidations": [
+        # Only read by workers catching up on the last few seconds
+        IndexModel([("at", ASCENDING)], name="expiry", expireAfterSeconds=3600),
+    ],
+    "stat_buckets": [
+        IndexModel([("bucket", ASCENDING)], name="bucket"),
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING)], name="granularity_bucket"),
+    ],
+    "log_archive": [
+        # Chunks overlapping a window, newest first
+        IndexModel([("end", DESCENDING), ("start", DESCENDING)], name="end_start"),
+        # Oldest first, for exports
+        IndexModel([("start", ASCENDING)], name="start"),
+    ] + ([
+        IndexModel(
+            [("bucket", ASCENDING)],
+            name="retention",
+            expireAfterSeconds=settings.LOG_ARCHIVE_RETENTION_DAYS * 24 * 3600,
+        ),
+    ] if settings.LOG_ARCHIVE_RETENTION_DAYS > 0 else []),
+    "training_jobs": [
+        # At most one queued or running job across all workers
+        IndexModel(
+            [("active", ASCENDING)],
+            name="active",
+            unique=True,
+            partialFilterExpression={"active": True},
+        ),
+        # Finished jobs are kept a week for status queries
+        IndexModel([("finished_at", ASCENDING)], name="expiry", expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "anomaly_results": [
+        IndexModel([("severity", ASCENDING)], name="severity"),
+    ],
+    "incidents": [
+        # Incident a new anomaly of a user joins
+        IndexModel(
+            [("user_id", ASCENDING), ("model_version", ASCENDING), ("last_seen", DESCENDING)],
+            name="user_id_model_version_last_seen"
+        ),
+        # /soc/incidents, most recent activity first
+        IndexModel([("last_seen", DESCENDING)], name="last_seen"),
+    ],
+}
+
+class HotQuery(NamedTuple):
+    name: str
+    collection: str
+    command: str  # "find", "count" or "aggregate"
+    filter: Dict[str, Any]
+    sort: Optional[Dict[str, int]] = None
+
+def _hot_queries() -> List[HotQuery]:
+    """
+    Representative shapes of the queries request handlers run. The values
+    do not matter to the planner, only which fields are constrained.
+    """
+    window = {"$gte": datetime(1970, 1, 1), "$lte": datetime.utcnow()}
+    return [
+        HotQuery("logs by time", "logs", "find", {"timestamp": window}, {"timestamp": -1, "_id": -1}),
+        HotQuery("logs by user", "logs", "find", {"timestamp": window, "user_id": "u"}, {"timestamp": -1, "_id": -1}),
+        HotQuery(
+            "logs by event type", "logs", "find",
+            {"timestamp": window, "event_type": "user_login"}, {"timestamp": -1, "_id": -1}
+        ),
+        HotQuery(
+            "logs by event type prefix", "logs", "find",
+            {"timestamp": window, "event_type": {"$regex": "^ssh_"}}, {"timestamp": -1, "_id": -1}
+        ),
+        HotQuery("logs since", "logs", "count", {"timestamp": {"$gte": window["$gte"]}}),
+        HotQuery("login attempts", "logs", "count", {"event_type": "user_login"}),
+        HotQuery("failed logins", "logs", "count", {"event_type": "user_login", "details.success": False}),
+        HotQuery("training strata", "logs", "aggregate", {"timestamp": window}),
+        HotQuery("analytics by event type", "logs", "aggregate", {"timestamp": window, "event_type": "user_login"}),
+        HotQuery("user by name", "users", "find", {"username": "u"}),
+        HotQuery("user by email", "users", "find", {"email": "u"}),
+        HotQuery("user by id", "users", "find", {"_id": "u"}),
+        HotQuery("ssh session", "ssh_sessions", "find", {"session_token": "t", "user_id": "u"}),
+        HotQuery("ssh sessions by user", "ssh_sessions", "find", {"user_id": "u"}),
+        HotQuery("sessions by user", "sessions", "find", {"user_id": "u", "revoked_at": {"$exists": False}}),
+        HotQuery("revoked sessions", "sessions", "find", {"revoked_at": {"$gte": window["$gte"]}}),
+        HotQuery(
+            "archived logs", "log_archive", "find",
+            {"end": {"$gte": window["$gte"]}, "start": {"$lte": window["$lte"]}}, {"end": -1}
+        ),
+        HotQuery(
+            "exported archive", "log_archive", "find",
+            {"end": {"$gte": window["$gte"]}, "start": {"$lte": window["$lte"]}}, {"start": 1}
+        ),
+        HotQuery("anomalies by severity", "anomaly_results", "count", {"severity": "high"}),
+        HotQuery("incidents", "incidents", "find", {"last_seen": {"$gte": window["$gte"]}}, {"last_seen": -1}),
+        HotQuery(
+            "incidents by user", "incidents", "find",
+            {"last_seen": {"$gte": window["$gte"]}, "user_id": "u"}, {"last_seen": -1}
+        ),
+        HotQuery(
+            "incident to join", "incidents", "find",
+            {"user_id": "u", "model_version": "v", "last_seen": {"$gte": window["$gte"]}, "first_seen": {"$lte": window["$lte"]}}
+        ),
+        HotQuery("stat buckets", "stat_buckets", "find", {"bucket": {"$gte": window["$gte"]}}),
+        HotQuery("hourly stat buckets", "stat_buckets", "find", {"granularity": "hour", "bucket": {"$lt": window["$lte"]}}),
+    ]
+
+# Index options that differ from the existing index of the same name
+INDEX_OPTIONS_CONFLICT = 85
+
+async def ensure_indexes():
+    """
+    Create any missing index. Existing ones with the same spec are left
+    alone; a TTL index whose retention setting changed is updated in place.
+    """
+    for collection, indexes in INDEXES.items():
+        try:
+            await db.db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            if e.code != INDEX_OPTIONS_CONFLICT:
+                raise
+            for index in indexes:
+                if "expireAfterSeconds" in index.document:
+                    await db.db.command({"collMod": collection, "index": {
+                        "name": index.document["name"],
+                        "expireAfterSeconds": index.document["expireAfterSeconds"],
+                    }})
+            await db.db[collection].create_indexes(indexes)
+    print("MongoDB indexes ensured")
+
+async def _explain_command(query: HotQuery) -> Dict[str, Any]:
+    if query.collection == "logs":
+        query = query._replace(
+            filter=await log_codec.encode_query(query.filter),
+            sort={path(key): order for key, order in query.sort.items()} if query.sort else None
+        )
+    if query.command == "count":
+        return {"count": query.collection, "query": query.filter}
+    if query.command == "aggregate":
+        return {"aggregate": query.collection, "pipeline": [{"$match": query.filter}], "cursor": {}}
+    command: Dict[str, Any] = {"find": query.collection, "filter": query.filter}
+    if query.sort:
+        command["sort"] = query.sort
+    return command
+
+def _stages(plan: Any) -> List[str]:
+    """Every stage name in an explain plan tree"""
+    if isinstance(plan, list):
+        return [stage for item in plan for stage in _stages(item)]
+    if not isinstance(plan, dict):
+        return []
+    stages = [plan["stage"]] if "stage" in plan else []
+    for value in plan.values():
+        if isinstance(value, (dict, list)):
+            stages.extend(_stages(value))
+    return stages
+
+async def explain(query: HotQuery) -> List[str]:
+    """Stages of the plan the server picks for a hot query"""
+    result = await db.db.command({"explain": await _explain_command(query), "verbosity": "queryPlanner"})
+    # Aggregations nest the planner output under their first stage
+    planner = result.get("queryPlanner") or result.get("stages", [{}])[0].get("$cursor", {}).get("queryPlanner", {})
+    return _stages(planner.get("winningPlan", {}))
+
+async def verify_query_plans():
+    """Raise if any hot query would scan a whole collection"""
+    scans = []
+    for query in _hot_queries():
+        if "COLLSCAN" in await explain(query):
+            scans.append(query.name)
+    if scans:
+        raise RuntimeError(f"Queries without a usable index: {', '.join(scans)}")
+
+async def _main():
+    # Connect without the startup check, so failing plans can be inspected
+    db.client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db.db = db.client[settings.MONGODB_DB_NAME]
+    try:
+        await ensure_indexes()
+        for query in _hot_queries():
+            print(f"{query.name:>24}: {' <- '.join(await explain(query))}")
+    finally:
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
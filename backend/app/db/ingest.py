@@ -0,0 +1,95 @@
+"""
+Parsing of NDJSON log batches sent by external event sources.
+
+Each line is one LogEntry. Lines are validated as the body arrives, so a
+batch is read, checked and normalized in a single pass.
+"""
+import json
+from datetime import timezone
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from app.db.audit import normalize_event_type
+from app.db.models import LogEntry
+
+# Invalid lines reported back in detail; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+class BatchTooLarge(Exception):
+    pass
+
+def _describe(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+def parse_line(line: bytes) -> Dict[str, Any]:
+    """One NDJSON line as a document for the logs collection; ValueError if invalid"""
+    try:
+        entry = LogEntry(**json.loads(line))
+    except ValidationError as e:
+        raise ValueError(_describe(e))
+    except (TypeError, json.JSONDecodeError, UnicodeDecodeError):
+        raise ValueError("not a JSON object")
+    
+    document = entry.dict(exclude={"id"})
+    document["event_type"] = normalize_event_type(document["event_type"])
+    # Sources may send offsets; everything else in the collection is naive UTC
+    timestamp = document["timestamp"]
+    if timestamp.tzinfo is not None:
+        document["timestamp"] = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return document
+
+async def read_batch(
+    body: AsyncIterator[bytes],
+    max_events: int,
+    max_line_bytes: int,
+    max_body_bytes: int
+) -> Tuple[List[Dict[str, Any]], int, List[Dict[str, Any]]]:
+    """
+    Read an NDJSON body into log documents.
+    
+    Returns the valid entries, the number of invalid lines and details of
+    the first MAX_REPORTED_ERRORS of them. Raises BatchTooLarge once more
+    than `max_events` events, a line over `max_line_bytes` or a body over
+    `max_body_bytes` has been read, so no more than that is ever buffered.
+    """
+    entries: List[Dict[str, Any]] = []
+    invalid = 0
+    errors: List[Dict[str, Any]] = []
+    line_number = 0
+    events = 0
+    
+    def take(line: bytes):
+        nonlocal invalid, line_number, events
+        line_number += 1
+        if len(line) > max_line_bytes:
+            raise BatchTooLarge(f"Line {line_number} is longer than {max_line_bytes} bytes")
+        if not line.strip():
+            return
+        events += 1
+        if events > max_events:
+            raise BatchTooLarge(f"More than {max_events} events in one batch")
+        try:
+            entries.append(parse_line(line))
+        except ValueError as e:
+            invalid += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_number, "error": str(e)})
+    
+    pending = b""
+    received = 0
+    async for chunk in body:
+        received += len(chunk)
+        if received > max_body_bytes:
+            raise BatchTooLarge(f"Batch is larger than {max_body_bytes} bytes")
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            take(line)
+        # The unfinished line is carried into the next chunk; keep it bounded
+        if len(pending) > max_line_bytes:
+            raise BatchTooLarge(f"Line {line_number + 1} is longer than {max_line_bytes} bytes")
+    take(pending)
+    return entries, invalid, errors
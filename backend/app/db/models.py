@@ -38,9 +38,16 @@ class Token(BaseModel):
     access_token: str
     token_type: str
     role: Role
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenPayload(BaseModel):
     sub: Optional[str] = None
+    exp: Optional[int] = None
+    # Session the token was issued for; older tokens have none
+    sid: Optional[str] = None
 
 class MFASetup(BaseModel):
     secret: str
@@ -58,6 +65,13 @@ class LogEntry(BaseModel):
     source_ip: Optional[str] = None
     user_agent: Optional[str] = None
 
+class LogView(LogEntry):
+    """A log as listed by /soc/logs, where clients may leave fields out"""
+    user_id: Optional[str] = None
+    event_type: Optional[str] = None
+    details: Optional[dict] = None
+    timestamp: Optional[datetime] = None
+
 class VM(BaseModel):
     id: str
     name: str
@@ -83,4 +97,58 @@ class LogAnalysisResult(BaseModel):
     anomaly_score: float
     description: str
     detected_at: datetime = Field(default_factory=datetime.utcnow)
-    is_real_threat: Optional[bool] = None
\ No newline at end of file
+    is_real_threat: Optional[bool] = None
+    model_version: Optional[str] = None
+
+class Incident(LogAnalysisResult):
+    """Anomalies of one user close together in time, grouped as one result"""
+    id: Optional[str] = None
+    user_id: Optional[str] = None
+    first_seen: datetime
+    last_seen: datetime
+
+class LogDimension(str, Enum):
+    EVENT_TYPE = "event_type"
+    USER_ID = "user_id"
+    SOURCE_IP = "source_ip"
+
+class TimeBucket(str, Enum):
+    MINUTE = "minute"
+    HOUR = "hour"
+    DAY = "day"
+
+class AnalyticsQuery(BaseModel):
+    """Aggregation over audit logs, run on the server by /soc/analytics"""
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    # Filters; event_type is exact, or a prefix ending in *
+    event_type: Optional[str] = None
+    user_id: Optional[str] = None
+    source_ip: Optional[str] = None
+    # Groups are counted per combination of these, and per time bucket
+    group_by: List[LogDimension] = []
+    bucket: Optional[TimeBucket] = None
+    # Also count the distinct values of this dimension in each group
+    distinct: Optional[LogDimension] = None
+    # Only the N groups with the most logs
+    top: Optional[int] = Field(None, gt=0)
+
+class TrainingJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+class TrainingJob(BaseModel):
+    id: str
+    requested_by: str
+    status: TrainingJobStatus = TrainingJobStatus.QUEUED
+    stage: str = "queued"
+    progress: float = 0.0
+    log_count: Optional[int] = None
+    model_version: Optional[str] = None
+    error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
\ No newline at end of file
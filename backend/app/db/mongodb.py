@@ -4,6 +4,12 @@ from app.core.config import settings
 class MongoDB:
     client: AsyncIOMotorClient = None
     db = None
+    
+    @property
+    def logs(self):
+        """The logs collection, through the compact storage encoding"""
+        from app.db.codec import LogCollection
+        return LogCollection(self.db.logs)
 
 db = MongoDB()
 
@@ -11,8 +17,21 @@ async def connect_to_mongo():
     db.client = AsyncIOMotorClient(settings.MONGODB_URI)
     db.db = db.client[settings.MONGODB_DB_NAME]
     print("Connected to MongoDB")
+    
+    # Imported here: these modules themselves depend on this one
+    from app.db.indexes import ensure_indexes, verify_query_plans
+    await ensure_indexes()
+    if settings.VERIFY_QUERY_PLANS:
+        await verify_query_plans()
+    
+    from app.db.audit import audit_log
+    audit_log.start()
 
 async def close_mongo_connection():
+    from app.db.audit import audit_log
+    # Buffered audit entries must reach the database before it goes away
+    await audit_log.close()
+    
     if db.client:
         db.client.close()
         print("Closed MongoDB connection")
\ No newline at end of file
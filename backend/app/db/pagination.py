@@ -0,0 +1,54 @@
+import base64
+import hashlib
+import hmac
+from datetime import datetime, timedelta
+from typing import Any, Dict, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from app.core.config import settings
+
+# Sort order of paged log queries: newest first, _id breaks timestamp ties
+LOG_SORT = [("timestamp", -1), ("_id", -1)]
+
+_EPOCH = datetime(1970, 1, 1)
+_MILLISECOND = timedelta(milliseconds=1)
+
+def _sign(payload: bytes) -> bytes:
+    return hmac.new(settings.SECRET_KEY.encode(), payload, hashlib.sha256).digest()[:12]
+
+def encode_cursor(timestamp: datetime, log_id: ObjectId) -> str:
+    """Opaque continuation token for the page after the given log"""
+    payload = f"{(timestamp - _EPOCH) // _MILLISECOND}:{log_id}".encode()
+    return base64.urlsafe_b64encode(payload + _sign(payload)).decode().rstrip("=")
+
+def decode_cursor(token: str) -> Tuple[datetime, ObjectId]:
+    """(timestamp, _id) a token continues after; ValueError if it was not issued here"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload, signature = raw[:-12], raw[-12:]
+        if not hmac.compare_digest(signature, _sign(payload)):
+            raise ValueError("bad signature")
+        millis, log_id = payload.decode().split(":")
+        return _EPOCH + int(millis) * _MILLISECOND, ObjectId(log_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {str(e)}")
+
+def after_cursor(query: Dict[str, Any], position: Tuple[datetime, ObjectId]) -> Dict[str, Any]:
+    """
+    Restrict a query to logs sorted after a decoded cursor position.
+    
+    The upper timestamp bound lets the (timestamp, _id) index start the
+    scan at the cursor, so a deep page costs the same as the first one;
+    the $or only drops the few logs sharing the cursor's timestamp.
+    """
+    timestamp, log_id = position
+    bounds = dict(query.get("timestamp", {}))
+    if "$lte" not in bounds or bounds["$lte"] > timestamp:
+        bounds["$lte"] = timestamp
+    return {
+        **query,
+        "timestamp": bounds,
+        "$or": [{"timestamp": {"$lt": timestamp}}, {"_id": {"$lt": log_id}}],
+    }
@@ -0,0 +1,304 @@
+"""
+Pre-aggregated counters behind /soc/stats.
+
+Counts are kept per hour in `stat_buckets` as events are written: total
+events, events by type, login outcomes, stored anomalies by severity and
+login attempts turned away by throttling.
+Hours older than ROLLUP_HOURLY_RETENTION_DAYS are compacted into one
+bucket per day, so any window is answered by summing a bounded number of
+small documents instead of counting logs.
+
+When `stat_buckets` is empty on startup, e.g. on the first deploy, the
+compactor backfills it from existing logs and anomaly results once.
+To recount every bucket (with the app stopped):
+    python -m app.db.rollups --rebuild
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from app.core.config import settings
+from app.db.codec import log_codec
+from app.db.mongodb import db
+
+HOUR = "hour"
+DAY = "day"
+
+# Counter groups and the documents they are counted from
+DIMENSIONS = ["event_type", "login", "anomaly_severity", "throttled"]
+# Groups that --rebuild can recount; throttled attempts exist nowhere else
+RECOUNTED = ["event_type", "login", "anomaly_severity"]
+# Document in `migrations` claimed by the worker backfilling empty buckets
+BACKFILL_ID = "stat_buckets_backfill"
+
+_EPOCH = datetime(1970, 1, 1)
+
+Counts = Dict[str, Any]
+
+def _bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == DAY:
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def _bucket_id(granularity: str, bucket: datetime) -> str:
+    return f"{granularity}|{int((bucket - _EPOCH).total_seconds())}"
+
+def _field(name: Any) -> str:
+    """Make a value safe to use as a field name in an update path"""
+    return str(name).replace(".", "_").lstrip("$") or "unknown"
+
+def _log_counters(log: Dict[str, Any]) -> Dict[str, int]:
+    counters = {"events": 1, f"event_type.{_field(log.get('event_type'))}": 1}
+    if log.get("event_type") == "user_login":
+        details = log.get("details")
+        details = details if isinstance(details, dict) else {}
+        outcome = "failure" if details.get("success") == False else "success"
+        counters[f"login.{outcome}"] = 1
+    return counters
+
+def _anomaly_counters(result: Dict[str, Any]) -> Dict[str, int]:
+    return {f"anomaly_severity.{_field(result.get('severity'))}": 1}
+
+async def _increment(items: Iterable[Tuple[datetime, Dict[str, int]]]):
+    """Add counters to the hourly bucket of each timestamp, one bulk_write in all"""
+    updates: Dict[datetime, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for timestamp, counters in items:
+        if not isinstance(timestamp, datetime):
+            continue
+        bucket = updates[_bucket_start(timestamp, HOUR)]
+        for path, n in counters.items():
+            bucket[path] += n
+    if not updates:
+        return
+    
+    await db.db.stat_buckets.bulk_write([
+        UpdateOne(
+            {"_id": _bucket_id(HOUR, bucket)},
+            {"$inc": dict(counters), "$setOnInsert": {"granularity": HOUR, "bucket": bucket}},
+            upsert=True
+        )
+        for bucket, counters in updates.items()
+    ], ordered=False)
+
+async def record_logs(logs: List[Dict[str, Any]]):
+    """Count newly written logs"""
+    await _increment((log.get("timestamp"), _log_counters(log)) for log in logs)
+
+async def record_anomalies(results: List[Dict[str, Any]]):
+    """Count newly stored anomaly results"""
+    await _increment((result.get("detected_at"), _anomaly_counters(result)) for result in results)
+
+async def record_throttled(counts: Dict[str, int], timestamp: datetime):
+    """Count login attempts turned away by throttling, by attempt kind"""
+    await _increment([(timestamp, {f"throttled.{_field(kind)}": n for kind, n in counts.items()})])
+
+def _flatten(doc: Dict[str, Any]) -> Dict[str, int]:
+    """A bucket's counters as update paths"""
+    counters = {"events": doc.get("events", 0)}
+    for dimension in DIMENSIONS:
+        for key, n in doc.get(dimension, {}).items():
+            counters[f"{dimension}.{key}"] = n
+    return counters
+
+def _add(total: Counts, doc: Dict[str, Any]):
+    total["events"] = total.get("events", 0) + doc.get("events", 0)
+    for dimension in DIMENSIONS:
+        group = total.setdefault(dimension, {})
+        for key, n in doc.get(dimension, {}).items():
+            group[key] = group.get(key, 0) + n
+
+def _empty() -> Counts:
+    return {"events": 0, **{dimension: {} for dimension in DIMENSIONS}}
+
+async def compact(before: Optional[datetime] = None) -> int:
+    """
+    Fold hourly buckets of whole days before `before` into daily buckets.
+    
+    Each hourly bucket is removed before its counts are added to the day,
+    so concurrent workers never fold it twice and increments arriving
+    meanwhile start a fresh hourly bucket. A crash between the two steps
+    loses that hour's counts; it never counts them twice.
+    """
+    if before is None:
+        before = datetime.utcnow() - timedelta(days=settings.ROLLUP_HOURLY_RETENTION_DAYS)
+    before = _bucket_start(before, DAY)
+    
+    compacted = 0
+    cursor = db.db.stat_buckets.find({"granularity": HOUR, "bucket": {"$lt": before}}, {"_id": 1})
+    async for ref in cursor:
+        doc = await db.db.stat_buckets.find_one_and_delete({"_id": ref["_id"]})
+        if doc is None:
+            continue
+        day = _bucket_start(doc["bucket"], DAY)
+        await db.db.stat_buckets.update_one(
+            {"_id": _bucket_id(DAY, day)},
+            {"$inc": _flatten(doc), "$setOnInsert": {"granularity": DAY, "bucket": day}},
+            upsert=True
+        )
+        compacted += 1
+    return compacted
+
+async def query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    group_by: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Sum the buckets overlapping [start, end).
+    
+    Ranges are resolved to whole hours, and to whole days where hours have
+    already been compacted. With group_by "hour" or "day", per-bucket
+    counts are returned as well; compacted days show up as one entry.
+    """
+    buckets = await _read(start, end)
+    total = _empty()
+    series: Dict[datetime, Counts] = {}
+    for doc in buckets:
+        _add(total, doc)
+        if group_by:
+            key = _bucket_start(doc["bucket"], DAY) if group_by == DAY else doc["bucket"]
+            _add(series.setdefault(key, _empty()), doc)
+    
+    result: Dict[str, Any] = {"start_time": start, "end_time": end, "counts": total}
+    if group_by:
+        result["group_by"] = group_by
+        result["series"] = [{"bucket": key, "counts": series[key]} for key in sorted(series)]
+    return result
+
+async def _read(start: Optional[datetime], end: Optional[datetime]) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {}
+    if start is not None:
+        # Day buckets start at midnight, so look back to the start's day
+        query.setdefault("bucket", {})["$gte"] = _bucket_start(start, DAY)
+    if end is not None:
+        query.setdefault("bucket", {})["$lt"] = end
+    docs = await db.db.stat_buckets.find(query).to_list(length=None)
+    
+    if start is None:
+        return docs
+    first_hour = _bucket_start(start, HOUR)
+    return [doc for doc in docs if doc["granularity"] == DAY or doc["bucket"] >= first_hour]
+
+class RollupCompactor:
+    """Periodically compacts hourly buckets in the background"""
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        try:
+            if await backfill():
+                print("Backfilled stat buckets from existing logs")
+        except Exception as e:
+            print(f"Error backfilling stat buckets: {str(e)}")
+        while True:
+            try:
+                compacted = await compact()
+                if compacted:
+                    print(f"Compacted {compacted} hourly stat buckets")
+            except Exception as e:
+                print(f"Error compacting stat buckets: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+rollup_compactor = RollupCompactor(interval=settings.ROLLUP_COMPACT_INTERVAL_SECONDS)
+
+async def rebuild():
+    """Recount every bucket from the logs and anomaly results collections"""
+    await db.db.stat_buckets.update_many({}, {"$unset": {"events": "", **{name: "" for name in RECOUNTED}}})
+    await _recount()
+
+async def backfill() -> bool:
+    """
+    Count existing logs and anomaly results into `stat_buckets` if it is
+    empty. One worker claims the backfill in `migrations`. Events are
+    counted up to the moment the buckets were found empty, since later ones
+    are counted as they are written. Returns whether this worker ran it.
+    """
+    before = datetime.utcnow()
+    if await db.db.stat_buckets.find_one({}, {"_id": 1}) is not None:
+        return False
+    try:
+        await db.db.migrations.insert_one({"_id": BACKFILL_ID, "started_at": before})
+    except DuplicateKeyError:
+        return False
+    await _recount(before)
+    return True
+
+async def _recount(before: Optional[datetime] = None):
+    """Add counts of the logs and anomaly results written before `before`"""
+    log_match: Dict[str, Any] = {}
+    result_match: Dict[str, Any] = {}
+    if before is not None:
+        log_match = {"_id": {"$lt": ObjectId.from_datetime(before)}}
+        result_match = {"detected_at": {"$lt": before}}
+    
+    hour = {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}
+    pipeline = [
+        {"$match": log_match},
+        {"$group": {
+            "_id": {
+                "hour": hour,
+                "event_type": "$event_type",
+                "failed": {"$eq": ["$details.success", False]},
+            },
+            "count": {"$sum": 1},
+        }},
+    ]
+    items = []
+    for row in await db.logs.aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        log = {"event_type": await log_codec.event_name(key.get("event_type")), "details": {"success": False} if key["failed"] else {}}
+        counters = {path: n * row["count"] for path, n in _log_counters(log).items()}
+        items.append((key["hour"], counters))
+    
+    pipeline = [
+        {"$match": result_match},
+        {"$group": {
+            "_id": {"hour": {"$dateTrunc": {"date": "$detected_at", "unit": "hour"}}, "severity": "$severity"},
+            "count": {"$sum": 1},
+        }},
+    ]
+    async for row in db.db.anomaly_results.aggregate(pipeline, allowDiskUse=True):
+        key = row["_id"]
+        items.append((key["hour"], {f"anomaly_severity.{_field(key.get('severity'))}": row["count"]}))
+    
+    await _increment(items)
+    await compact()
+
+async def _main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rebuild", action="store_true", help="recount all buckets from scratch")
+    args = parser.parse_args()
+    
+    from motor.motor_asyncio import AsyncIOMotorClient
+    db.client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db.db = db.client[settings.MONGODB_DB_NAME]
+    try:
+        if args.rebuild:
+            await rebuild()
+        else:
+            print(f"Compacted {await compact()} hourly stat buckets")
+    finally:
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
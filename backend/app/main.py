@@ -1,10 +1,19 @@
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.router import api_router
+from app.auth.sessions import revocation_filter
+from app.auth.throttle import login_throttle
+from app.auth.user_cache import user_cache
 from app.core.config import settings
+from app.core.security import password_hasher
+from app.db.archive import log_archiver
+from app.db.audit import client_ip, request_context
+from app.db.rollups import rollup_compactor
 from app.db.mongodb import connect_to_mongo, close_mongo_connection, db  # Import db
+from app.ml.jobs import training_jobs
+from app.ml.streaming import streaming_scorer
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -18,8 +27,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Continuation token of paged log listings
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Make the client address and user agent available to audit logging
+@app.middleware("http")
+async def audit_request_context(request: Request, call_next):
+    request_context.set({
+        "source_ip": client_ip(request),
+        "user_agent": request.headers.get("user-agent"),
+    })
+    return await call_next(request)
+
 # Add API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -27,9 +47,24 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    if settings.STREAMING_SCORER_ENABLED:
+        streaming_scorer.start()
+    rollup_compactor.start()
+    log_archiver.start()
+    user_cache.start()
+    login_throttle.start()
+    revocation_filter.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await streaming_scorer.stop()
+    await rollup_compactor.stop()
+    await log_archiver.stop()
+    await user_cache.stop()
+    await login_throttle.stop()
+    await revocation_filter.stop()
+    await training_jobs.shutdown()
+    password_hasher.shutdown()
     await close_mongo_connection()
 
     
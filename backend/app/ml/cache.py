@@ -0,0 +1,97 @@
+import heapq
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from bson import ObjectId
+
+from app.core.config import settings
+from app.db.models import LogAnalysisResult
+
+# Rough per-result footprint used for the memory cap, on top of the text
+RESULT_OVERHEAD_BYTES = 400
+
+# (score, sequence, log timestamp, result); the unique sequence number
+# breaks ties so results themselves are never compared
+ScoredResult = Tuple[float, int, datetime, LogAnalysisResult]
+
+CacheKey = Tuple[int, float, str]
+
+class CachedAnomalies:
+    """
+    Top-K anomalies of one (hours, threshold, model version) query, plus the
+    newest log _id they account for.
+    """
+    def __init__(self, high_water: ObjectId, top: List[ScoredResult], truncated: bool, sequence: int):
+        self.high_water = high_water
+        self.top = top
+        # Whether qualifying results were ever dropped to stay within K
+        self.truncated = truncated
+        self.sequence = sequence
+    
+    def expire(self, start_date: datetime) -> Optional["CachedAnomalies"]:
+        """
+        The entry without results whose log slid out of the window, as a new
+        entry so the cached one is never changed. Returns None when the entry
+        can no longer be trusted: results beyond K were discarded earlier and
+        some of them might now belong in the top-K.
+        """
+        kept = [item for item in self.top if item[2] >= start_date]
+        if len(kept) == len(self.top):
+            return self
+        if self.truncated:
+            return None
+        heapq.heapify(kept)
+        return CachedAnomalies(self.high_water, kept, self.truncated, self.sequence)
+    
+    def copy(self) -> "CachedAnomalies":
+        return CachedAnomalies(self.high_water, list(self.top), self.truncated, self.sequence)
+    
+    def results(self) -> List[LogAnalysisResult]:
+        return [item[3] for item in sorted(self.top, reverse=True)]
+    
+    def size_bytes(self) -> int:
+        return sum(RESULT_OVERHEAD_BYTES + len(item[3].description) for item in self.top)
+
+class AnomalyResultCache:
+    """LRU cache of anomaly query results, bounded by entry count and memory"""
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[CachedAnomalies, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: CacheKey) -> Optional[CachedAnomalies]:
+        cached = self._entries.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return cached[0]
+    
+    def put(self, key: CacheKey, entry: CachedAnomalies):
+        self.discard(key)
+        size = entry.size_bytes()
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (entry, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self.discard(next(iter(self._entries)))
+    
+    def discard(self, key: CacheKey):
+        cached = self._entries.pop(key, None)
+        if cached is not None:
+            self._bytes -= cached[1]
+    
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+anomaly_cache = AnomalyResultCache(
+    max_entries=settings.ANOMALY_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANOMALY_CACHE_MAX_BYTES,
+)
@@ -0,0 +1,197 @@
+import hashlib
+import mmap
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Bump when the array layout changes; older files are then ignored
+FORMAT_VERSION = 1
+
+# Arrays are written in this order, each as a standard .npy record padded
+# to ALIGNMENT bytes so they can be read in place from a memory map
+ARRAY_NAMES = [
+    "format", "source", "params", "mean", "scale",
+    "roots", "feature", "threshold", "children", "value",
+]
+ALIGNMENT = 64
+
+# Rows traversed at once; bounds the (rows x trees) node index array
+CHUNK_ROWS = 1024
+
+def compiled_path(model_path: str) -> str:
+    """Where the compiled forest for a model artifact lives"""
+    return f"{model_path}.forest"
+
+def compile_forest(model: Any, scaler: Any, source: bytes) -> Dict[str, np.ndarray]:
+    """
+    Flatten a fitted StandardScaler + IsolationForest into plain arrays.
+    
+    All trees are concatenated into one node table with global child
+    indexes; `children` holds the (left, right) pair of each node. Leaves
+    point to themselves with an infinite threshold, so traversal can take
+    max_depth steps without checking for them, and store the path length
+    sklearn would add for a sample ending there. `source` is the digest of
+    the artifact the forest was compiled from.
+    """
+    from sklearn.ensemble._iforest import _average_path_length
+    
+    n_features = len(scaler.mean_)
+    parts: Dict[str, list] = {name: [] for name in ("feature", "threshold", "children", "value")}
+    roots = []
+    offset = 0
+    max_depth = 0
+    for tree_idx, (estimator, features) in enumerate(zip(model.estimators_, model.estimators_features_)):
+        tree = estimator.tree_
+        leaf = tree.children_left == -1
+        nodes = np.arange(tree.node_count) + offset
+        # Trees fitted on a feature subset index into that subset
+        feature = np.asarray(features)[tree.feature] if model._max_features != n_features else tree.feature
+        value = (
+            model._decision_path_lengths[tree_idx]
+            + model._average_path_length_per_tree[tree_idx]
+            - 1.0
+        )
+        parts["feature"].append(np.where(leaf, 0, feature))
+        parts["threshold"].append(np.where(leaf, np.inf, tree.threshold))
+        parts["children"].append(np.stack([
+            np.where(leaf, nodes, tree.children_left + offset),
+            np.where(leaf, nodes, tree.children_right + offset),
+        ], axis=1))
+        parts["value"].append(value)
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+    
+    denominator = len(model.estimators_) * _average_path_length([model._max_samples])[0]
+    return {
+        "format": np.array([FORMAT_VERSION], dtype=np.int32),
+        "source": np.frombuffer(source, dtype=np.uint8),
+        "params": np.array([n_features, denominator, model.offset_, max_depth], dtype=np.float64),
+        "mean": np.asarray(scaler.mean_, dtype=np.float64),
+        "scale": np.asarray(scaler.scale_, dtype=np.float64),
+        "roots": np.array(roots, dtype=np.int32),
+        "feature": np.concatenate(parts["feature"]).astype(np.int32),
+        "threshold": np.concatenate(parts["threshold"]).astype(np.float64),
+        "children": np.concatenate(parts["children"]).astype(np.int64).ravel(),
+        "value": np.concatenate(parts["value"]).astype(np.float64),
+    }
+
+def save_compiled(path: str, arrays: Dict[str, np.ndarray]):
+    with open(path, "wb") as f:
+        for name in ARRAY_NAMES:
+            np.lib.format.write_array(f, np.ascontiguousarray(arrays[name]), allow_pickle=False)
+            f.write(b"\0" * (-f.tell() % ALIGNMENT))
+
+def load_compiled(path: str) -> Optional[Dict[str, np.ndarray]]:
+    """
+    Memory-map a compiled forest. The arrays are read-only views of the
+    file, so every worker mapping the same file shares its pages.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    arrays: Dict[str, np.ndarray] = {}
+    for name in ARRAY_NAMES:
+        version = np.lib.format.read_magic(buffer)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(buffer)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(buffer)
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=buffer.tell()).reshape(shape)
+        end = buffer.tell() + count * dtype.itemsize
+        buffer.seek(end + (-end % ALIGNMENT))
+        
+        if name == "format" and arrays[name][0] != FORMAT_VERSION:
+            return None
+    return arrays
+
+class CompiledForest:
+    """
+    IsolationForest scoring with NumPy only.
+    
+    Gives the same numbers as StandardScaler.transform followed by
+    IsolationForest.decision_function: features are scaled in float64,
+    cast to float32 like sklearn's tree input, and path lengths are summed
+    tree by tree in the same order.
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self.arrays = arrays
+        n_features, self.denominator, self.offset, max_depth = arrays["params"]
+        self.n_features = int(n_features)
+        self.max_depth = int(max_depth)
+        self.source = arrays["source"].tobytes()
+        self.mean = arrays["mean"]
+        self.scale = arrays["scale"]
+        self.roots = arrays["roots"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.children = arrays["children"]
+        self.value = arrays["value"]
+    
+    @classmethod
+    def from_model(cls, model: Any, scaler: Any, source: bytes = b"") -> "CompiledForest":
+        return cls(compile_forest(model, scaler, source))
+    
+    @classmethod
+    def load(cls, path: str, source: Optional[bytes] = None) -> Optional["CompiledForest"]:
+        """
+        Load a compiled forest, or None if it is missing, of another format,
+        or (when `source` is given) compiled from a different artifact.
+        """
+        if not os.path.exists(path):
+            return None
+        arrays = load_compiled(path)
+        if arrays is None:
+            return None
+        forest = cls(arrays)
+        if source is not None and forest.source != source:
+            return None
+        return forest
+    
+    def save(self, path: str):
+        save_compiled(path, self.arrays)
+    
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Same as scaler.transform + IsolationForest.decision_function"""
+        X = np.array(X, dtype=np.float64)
+        X -= self.mean
+        X /= self.scale
+        # sklearn trees compare float32 inputs against float64 thresholds
+        X = np.ascontiguousarray(X.astype(np.float32), dtype=np.float64)
+        
+        # Log features are small counts and clock fields, so a batch holds
+        # few distinct rows; each is only walked down the trees once
+        rows = X.view(np.dtype((np.void, X.dtype.itemsize * X.shape[1]))).ravel()
+        _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        X = X[first]
+        
+        depths = np.zeros(len(X))
+        for start in range(0, len(X), CHUNK_ROWS):
+            depths[start:start + CHUNK_ROWS] = self._path_lengths(X[start:start + CHUNK_ROWS])
+        depths = depths[inverse.ravel()]
+        
+        ratio = np.divide(depths, self.denominator, out=np.ones_like(depths), where=self.denominator != 0)
+        return -(2 ** -ratio) - self.offset
+    
+    def _path_lengths(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_trees = len(X), len(self.roots)
+        # One entry per (tree, row) pair, tree-major so each tree's nodes
+        # are gathered together
+        node = np.repeat(self.roots.astype(np.intp), n_rows)
+        row_start = np.tile(np.arange(n_rows) * X.shape[1], n_trees)
+        values = X.ravel()
+        for _ in range(self.max_depth):
+            go_right = values[row_start + self.feature[node]] > self.threshold[node]
+            node = self.children[2 * node + go_right]
+        
+        # Accumulate tree by tree, as sklearn does, so rounding matches
+        leaf_values = self.value[node].reshape(n_trees, n_rows)
+        depths = np.zeros(n_rows)
+        for tree in range(n_trees):
+            depths += leaf_values[tree]
+        return depths
+
+def artifact_digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
@@ -0,0 +1,163 @@
+import hashlib
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.db.mongodb import db
+from app.ml.model import COUNTER_COLUMNS, log_flags
+
+# Distinct source IPs per bucket are tracked with a HyperLogLog sketch of
+# 2**HLL_PRECISION registers, merged with $max so updates stay atomic
+HLL_PRECISION = 6
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.709  # bias correction for 64 registers
+
+# Bucket ids per $in query when reading windows back
+WINDOW_QUERY_CHUNK = 10000
+
+_EPOCH = datetime(1970, 1, 1)
+
+def bucket_start(timestamp: datetime) -> datetime:
+    """Start of the feature bucket a timestamp falls into"""
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    width = timedelta(seconds=settings.FEATURE_BUCKET_SECONDS)
+    return _EPOCH + ((timestamp - _EPOCH) // width) * width
+
+def bucket_key(user_id: Any, timestamp: Any) -> Optional[Tuple[str, datetime]]:
+    """(user_id, bucket) a log is counted under, or None if it has neither"""
+    if not user_id or not isinstance(timestamp, datetime):
+        return None
+    return str(user_id), bucket_start(timestamp)
+
+def _bucket_id(user_id: str, bucket: datetime) -> str:
+    return f"{user_id}|{int((bucket - _EPOCH).total_seconds())}"
+
+def _hll_register(value: str) -> Tuple[int, int]:
+    """Register index and rank of a value in the distinct-IP sketch"""
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    hashed = int.from_bytes(digest, "big")
+    index = hashed & (HLL_REGISTERS - 1)
+    rest = hashed >> HLL_PRECISION
+    rank = (64 - HLL_PRECISION) - rest.bit_length() + 1
+    return index, rank
+
+def estimate_distinct(registers: Dict[str, int]) -> float:
+    """HyperLogLog estimate, with linear counting for small cardinalities"""
+    if not registers:
+        return 0.0
+    m = HLL_REGISTERS
+    z = sum(2.0 ** -registers.get(str(i), 0) for i in range(m))
+    estimate = HLL_ALPHA * m * m / z
+    zeros = m - sum(1 for rank in registers.values() if rank)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+async def record_logs(logs: List[Dict[str, Any]]):
+    """Fold newly written logs into the per-user, per-bucket counters"""
+    updates: Dict[Tuple[str, datetime], Dict[str, Dict[str, int]]] = {}
+    for log in logs:
+        key = bucket_key(log.get("user_id"), log.get("timestamp"))
+        if key is None:
+            continue
+        
+        update = updates.setdefault(key, {"$inc": defaultdict(int), "$max": {}})
+        update["$inc"]["events"] += 1
+        for col, flag in log_flags(log).items():
+            if col != "unique_ips" and flag:
+                update["$inc"][col] += flag
+        
+        source_ip = log.get("source_ip")
+        if source_ip:
+            index, rank = _hll_register(str(source_ip))
+            field = f"ips.{index}"
+            update["$max"][field] = max(update["$max"].get(field, 0), rank)
+    
+    if not updates:
+        return
+    
+    operations = []
+    for (user_id, bucket), update in updates.items():
+        doc = {
+            "$inc": dict(update["$inc"]),
+            "$setOnInsert": {"user_id": user_id, "bucket": bucket},
+        }
+        if update["$max"]:
+            doc["$max"] = update["$max"]
+        operations.append(UpdateOne({"_id": _bucket_id(user_id, bucket)}, doc, upsert=True))
+    
+    await db.db.feature_buckets.bulk_write(operations, ordered=False)
+
+async def window_counts(
+    keys: List[Optional[Tuple[str, datetime]]]
+) -> List[Optional[Dict[str, float]]]:
+    """
+    Counts of a user's activity over the FEATURE_WINDOW_BUCKETS buckets
+    before each (user_id, bucket) key (see bucket_key).
+    
+    Only complete buckets are counted: the key's own bucket also holds
+    events after the log, and splitting it would mean reading the logs
+    themselves. Bucket documents are read by _id, in chunks, so the cost
+    depends on the distinct keys rather than the number of logs. Keys
+    whose user has no bucket in the window (or None keys) get None.
+    """
+    width = timedelta(seconds=settings.FEATURE_BUCKET_SECONDS)
+    window = settings.FEATURE_WINDOW_BUCKETS
+    
+    unique_keys = {key for key in keys if key is not None}
+    needed = {
+        (user_id, bucket - step * width)
+        for user_id, bucket in unique_keys
+        for step in range(1, window + 1)
+    }
+    
+    buckets: Dict[Tuple[str, datetime], Dict[str, Any]] = {}
+    ids = [_bucket_id(user_id, bucket) for user_id, bucket in needed]
+    for start in range(0, len(ids), WINDOW_QUERY_CHUNK):
+        cursor = db.db.feature_buckets.find({"_id": {"$in": ids[start:start + WINDOW_QUERY_CHUNK]}})
+        async for doc in cursor:
+            buckets[(doc["user_id"], doc["bucket"])] = doc
+    
+    vectors = {key: _window_vector(buckets, key, width, window) for key in unique_keys}
+    return [vectors[key] if key is not None else None for key in keys]
+
+async def attach_window_counts(logs: List[Dict[str, Any]]):
+    """
+    Replace the per-log activity flags with the user's counts over the
+    sliding window before the log (see window_counts).
+    
+    Logs whose user has no buckets (e.g. written before the store existed)
+    are left alone and fall back to 0/1 flags in feature extraction.
+    """
+    keys = [bucket_key(log.get("user_id"), log.get("timestamp")) for log in logs]
+    for log, vector in zip(logs, await window_counts(keys)):
+        if vector is not None:
+            log.update(vector)
+
+def _window_vector(
+    buckets: Dict[Tuple[str, datetime], Dict[str, Any]],
+    key: Tuple[str, datetime],
+    width: timedelta,
+    window: int
+) -> Optional[Dict[str, float]]:
+    user_id, end = key
+    docs = [buckets.get((user_id, end - step * width)) for step in range(1, window + 1)]
+    docs = [doc for doc in docs if doc is not None]
+    if not docs:
+        return None
+    
+    totals = {col: 0 for col in COUNTER_COLUMNS if col != "unique_ips"}
+    registers: Dict[str, int] = {}
+    for doc in docs:
+        for col in totals:
+            totals[col] += doc.get(col, 0)
+        for index, rank in doc.get("ips", {}).items():
+            registers[index] = max(registers.get(index, 0), rank)
+    
+    totals["unique_ips"] = round(estimate_distinct(registers))
+    return totals
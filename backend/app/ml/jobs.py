@@ -0,0 +1,247 @@
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from app.db.models import TrainingJob, TrainingJobStatus
+from app.db.audit import write_log
+from app.db.mongodb import db
+from app.ml.compiled import compiled_path
+from app.ml.model import LogAnomalyDetector
+from app.ml.registry import model_registry
+from app.ml.train import MIN_TRAINING_LOGS, get_training_frame
+
+# How often the worker running a job records its progress and checks for
+# a cancellation requested through another worker
+JOB_HEARTBEAT_SECONDS = 5
+
+# An active job whose worker has not reported for this long is taken as lost
+JOB_STALE_SECONDS = 60
+
+class TrainingJobManager:
+    """
+    Runs model training off the event loop.
+
+    Logs are fetched on the event loop (it is I/O), the IsolationForest fit
+    runs in a single-worker process pool, and the artifact it writes is
+    promoted to the served model path once the fit succeeds.
+
+    Jobs live in the `training_jobs` collection, so every API worker can
+    report on and cancel them. A unique partial index on `active` lets one
+    job at a time be queued or running across all workers; asking for
+    another returns that one. The worker running a job saves its progress
+    every JOB_HEARTBEAT_SECONDS, and a job that stops reporting is marked
+    failed when the next one is requested.
+    """
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, requested_by: str, sample_size: Optional[int] = None) -> Tuple[TrainingJob, bool]:
+        """Start a training job, or return the one already running"""
+        job = TrainingJob(id=str(uuid.uuid4()), requested_by=requested_by)
+        while True:
+            try:
+                await db.db.training_jobs.insert_one({
+                    **_document(job), "active": True, "heartbeat_at": datetime.utcnow()
+                })
+            except DuplicateKeyError:
+                active = await db.db.training_jobs.find_one({"active": True})
+                if active is None:
+                    # It finished in between
+                    continue
+                if active["heartbeat_at"] >= datetime.utcnow() - timedelta(seconds=JOB_STALE_SECONDS):
+                    return _job(active), False
+                await _abandon(active)
+                continue
+            self._tasks[job.id] = asyncio.create_task(self._run(job, sample_size))
+            return job, True
+
+    async def get(self, job_id: str) -> Optional[TrainingJob]:
+        doc = await db.db.training_jobs.find_one({"_id": job_id})
+        return _job(doc) if doc else None
+
+    async def cancel(self, job_id: str) -> Optional[TrainingJob]:
+        """
+        Cancel a job. A job running in another worker is flagged and stops
+        at that worker's next heartbeat. A fit that already started in the
+        worker process cannot be interrupted; its artifact is discarded
+        instead of promoted.
+        """
+        task = self._tasks.get(job_id)
+        if task is not None:
+            await self._stop(job_id, task)
+        else:
+            await db.db.training_jobs.update_one(
+                {"_id": job_id, "active": True},
+                {"$set": {"cancel_requested": True}}
+            )
+        return await self.get(job_id)
+
+    async def shutdown(self):
+        await asyncio.gather(*(self._stop(job_id, task) for job_id, task in list(self._tasks.items())))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn keeps the worker clear of the event loop and Mongo
+            # client threads of this process
+            self._executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def _stop(self, job_id: str, task: asyncio.Task):
+        """Cancel a job of this worker and wait for it to record its final status"""
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        if self._tasks.pop(job_id, None) is not None:
+            # Cancelled before it started, so _run never recorded it
+            await db.db.training_jobs.update_one(
+                {"_id": job_id, "active": True},
+                {
+                    "$set": {
+                        "status": TrainingJobStatus.CANCELLED.value,
+                        "stage": "cancelled",
+                        "finished_at": datetime.utcnow(),
+                    },
+                    "$unset": {"active": "", "cancel_requested": ""},
+                }
+            )
+
+    async def _heartbeat(self, job: TrainingJob, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            # Filtered on active so a late heartbeat cannot undo the final save
+            doc = await db.db.training_jobs.find_one_and_update(
+                {"_id": job.id, "active": True},
+                {"$set": {**_document(job), "heartbeat_at": datetime.utcnow()}},
+                projection={"cancel_requested": 1}
+            )
+            if doc is not None and doc.get("cancel_requested"):
+                task.cancel()
+
+    async def _save(self, job: TrainingJob):
+        await db.db.training_jobs.update_one(
+            {"_id": job.id, "active": True},
+            {"$set": {**_document(job), "heartbeat_at": datetime.utcnow()}}
+        )
+
+    async def _run(self, job: TrainingJob, sample_size: Optional[int]):
+        staging_path = f"{self.model_path}.{job.id}.staging"
+        future: Optional[Future] = None
+        heartbeat = asyncio.create_task(self._heartbeat(job, asyncio.current_task()))
+        try:
+            job.status = TrainingJobStatus.RUNNING
+            job.started_at = datetime.utcnow()
+            job.stage, job.progress = "loading_logs", 0.1
+            await self._save(job)
+            
+            def report(fraction: float):
+                job.progress = 0.1 + 0.2 * fraction
+            
+            sample = await get_training_frame(sample_size, progress=report)
+            job.log_count = len(sample)
+            if len(sample) < MIN_TRAINING_LOGS:
+                raise ValueError(f"Not enough log data for training (minimum {MIN_TRAINING_LOGS} required)")
+
+            # The detector is pickled into the worker, which fits it and
+            # saves the artifact to the staging path
+            job.stage, job.progress = "fitting", 0.3
+            await self._save(job)
+            detector = LogAnomalyDetector(model_path=staging_path, load=False)
+            future = self._get_executor().submit(detector.train, sample)
+            del sample
+            await asyncio.wrap_future(future)
+
+            job.stage, job.progress = "promoting", 0.9
+            os.replace(compiled_path(staging_path), compiled_path(self.model_path))
+            os.replace(staging_path, self.model_path)
+            # Loading the artifact unpickles the forest; keep it off the event loop
+            loaded = await asyncio.to_thread(model_registry.refresh, force=True)
+            job.model_version = loaded.version if loaded else None
+
+            job.status = TrainingJobStatus.SUCCEEDED
+            job.stage, job.progress = "done", 1.0
+        except asyncio.CancelledError:
+            job.status = TrainingJobStatus.CANCELLED
+            job.stage = "cancelled"
+            if future is not None and not future.done():
+                future.add_done_callback(lambda _: _discard(staging_path))
+            else:
+                _discard(staging_path)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                # A crashed worker poisons the pool; start fresh next time
+                self._executor = None
+            job.status = TrainingJobStatus.FAILED
+            job.stage = "failed"
+            job.error = str(e)
+            _discard(staging_path)
+        finally:
+            heartbeat.cancel()
+            job.finished_at = datetime.utcnow()
+            self._tasks.pop(job.id, None)
+            print(f"Training job {job.id} finished with status {job.status.value}")
+
+        # Leaving the active slot lets the next job start, in any worker
+        await db.db.training_jobs.update_one(
+            {"_id": job.id},
+            {"$set": _document(job), "$unset": {"active": "", "cancel_requested": ""}}
+        )
+
+        await write_log({
+            "user_id": job.requested_by,
+            "event_type": "model_trained",
+            "details": {
+                "role": "soc",
+                "job_id": job.id,
+                "status": job.status.value,
+                "success": job.status == TrainingJobStatus.SUCCEEDED,
+                "model_version": job.model_version
+            }
+        })
+
+def _document(job: TrainingJob) -> Dict[str, Any]:
+    doc = job.dict(exclude={"id"})
+    doc["_id"] = job.id
+    doc["status"] = job.status.value
+    return doc
+
+def _job(doc: Dict[str, Any]) -> TrainingJob:
+    doc["id"] = doc.pop("_id")
+    return TrainingJob(**doc)
+
+async def _abandon(doc: Dict[str, Any]):
+    """Mark an active job failed whose worker stopped reporting (it was restarted or crashed)"""
+    await db.db.training_jobs.update_one(
+        {"_id": doc["_id"], "active": True, "heartbeat_at": doc["heartbeat_at"]},
+        {
+            "$set": {
+                "status": TrainingJobStatus.FAILED.value,
+                "stage": "failed",
+                "error": "The worker running this job stopped reporting",
+                "finished_at": datetime.utcnow(),
+            },
+            "$unset": {"active": "", "cancel_requested": ""},
+        }
+    )
+
+def _discard(path: str):
+    for artifact in (path, compiled_path(path)):
+        try:
+            os.remove(artifact)
+        except FileNotFoundError:
+            pass
+
+training_jobs = TrainingJobManager(model_path=model_registry.model_path)
@@ -1,16 +1,55 @@
 import pandas as pd
 import numpy as np
-from typing import List, Dict, Any, Tuple
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
+from typing import List, Dict, Any, Optional, Tuple, Union
 import joblib
+import io
 import os
+import re
+
+from app.ml.compiled import CompiledForest, artifact_digest, compiled_path
+
+# Substrings of event_type that mark each kind of activity
+LOGIN_EVENT_PATTERN = 'login'
+SUDO_EVENT_PATTERN = 'sudo'
+FILE_EVENT_PATTERN = 'file|read|write|delete'
+NETWORK_EVENT_PATTERN = 'network|connection'
+
+# Columns that hold per-log activity flags, or window counts when the logs
+# were enriched from the feature store
+COUNTER_COLUMNS = [
+    'login_attempts',
+    'failed_login_attempts',
+    'sudo_commands',
+    'file_operations',
+    'network_connections',
+    'unique_ips'
+]
+
+def log_flags(log: Dict[str, Any]) -> Dict[str, int]:
+    """Activity flags of a single log, matching what _extract_features derives"""
+    event = log.get('event_type')
+    event = event if isinstance(event, str) else ''
+    details = log.get('details')
+    details = details if isinstance(details, dict) else {}
+    command = details.get('command')
+    
+    login = LOGIN_EVENT_PATTERN in event
+    return {
+        'login_attempts': int(login),
+        'failed_login_attempts': int(login and details.get('success') == False),
+        'sudo_commands': int(SUDO_EVENT_PATTERN in event or (isinstance(command, str) and 'sudo' in command)),
+        'file_operations': int(re.search(FILE_EVENT_PATTERN, event) is not None),
+        'network_connections': int(re.search(NETWORK_EVENT_PATTERN, event) is not None),
+        'unique_ips': int(bool(log.get('source_ip'))),
+    }
 
 class LogAnomalyDetector:
-    def __init__(self, model_path: str = "ml_models/anomaly_detector.joblib"):
+    def __init__(self, model_path: str = "ml_models/anomaly_detector.joblib", load: bool = True):
         self.model_path = model_path
         self.model = None
         self.scaler = None
+        # NumPy copy of scaler + forest that scoring runs on
+        self.forest: Optional[CompiledForest] = None
         self.feature_columns = [
             'hour_of_day',
             'day_of_week',
@@ -24,33 +63,65 @@ class LogAnomalyDetector:
         ]
         
         # Try to load the model if it exists
-        if os.path.exists(model_path):
+        if load and os.path.exists(model_path):
             self._load_model()
     
-    def _load_model(self):
+    def _load_model(self, data: Optional[bytes] = None):
         try:
-            loaded = joblib.load(self.model_path)
+            if data is None:
+                with open(self.model_path, 'rb') as f:
+                    data = f.read()
+            digest = artifact_digest(data)
+            
+            # The compiled forest is enough to score and loads without
+            # sklearn; it is only used if built from these exact bytes
+            forest = CompiledForest.load(compiled_path(self.model_path), source=digest)
+            if forest is not None:
+                self.forest = forest
+                print(f"Compiled model loaded from {compiled_path(self.model_path)}")
+                return
+            
+            loaded = joblib.load(io.BytesIO(data))
             self.model = loaded['model']
             self.scaler = loaded['scaler']
+            self.forest = CompiledForest.from_model(self.model, self.scaler, digest)
             print(f"Model loaded from {self.model_path}")
         except Exception as e:
             print(f"Error loading model: {str(e)}")
             self.model = None
             self.scaler = None
+            self.forest = None
     
     def _save_model(self):
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(self.model_path), exist_ok=True)
         
-        # Save model and scaler
+        # Save model and scaler to a temporary file and swap it in, so
+        # readers polling the path never see a half-written artifact
+        tmp_path = f"{self.model_path}.{os.getpid()}.tmp"
         joblib.dump({
             'model': self.model,
             'scaler': self.scaler
-        }, self.model_path)
+        }, tmp_path)
+        with open(tmp_path, 'rb') as f:
+            digest = artifact_digest(f.read())
+        
+        # Compile next to it. The forest is swapped in first; until the
+        # artifact follows, its digest no longer matches and loaders fall
+        # back to the artifact
+        forest = CompiledForest.from_model(self.model, self.scaler, digest)
+        forest.save(compiled_path(tmp_path))
+        os.replace(compiled_path(tmp_path), compiled_path(self.model_path))
+        os.replace(tmp_path, self.model_path)
+        self.forest = forest
         print(f"Model saved to {self.model_path}")
     
-    def train(self, log_data: List[Dict[str, Any]]):
-        """Train anomaly detection model using log data"""
+    def train(self, log_data: Union[List[Dict[str, Any]], pd.DataFrame]):
+        """Train anomaly detection model using log data (documents or a column frame)"""
+        # Imported here so processes that only score never load sklearn
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
         # Convert to DataFrame
         df = pd.DataFrame(log_data)
         
@@ -74,31 +145,30 @@ class LogAnomalyDetector:
         
         return True
     
-    def detect_anomalies(self, log_data: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], float]]:
-        """Detect anomalies in log data"""
-        if self.model is None or self.scaler is None:
+    def score(self, log_data: List[Dict[str, Any]]) -> np.ndarray:
+        """Anomaly score for each log, in input order (higher = more anomalous)"""
+        if self.forest is None:
             raise ValueError("Model not trained yet")
         
         # Convert to DataFrame
         df = pd.DataFrame(log_data)
         df = self._extract_features(df)
         
-        # Scale features
-        X = self.scaler.transform(df[self.feature_columns])
-        
-        # Predict anomalies
+        # Scale features and predict anomalies with the compiled forest
         # Isolation Forest returns -1 for anomalies and 1 for normal data
         # We convert to anomaly scores where higher = more anomalous
-        raw_scores = self.model.decision_function(X)
-        anomaly_scores = 1 - (raw_scores + 1) / 2  # Convert to 0-1 range
+        raw_scores = self.forest.decision_function(df[self.feature_columns].to_numpy(dtype=np.float64))
+        return 1 - (raw_scores + 1) / 2  # Convert to 0-1 range
+    
+    def detect_anomalies(self, log_data: List[Dict[str, Any]]) -> List[Tuple[Dict[str, Any], float]]:
+        """Detect anomalies in log data"""
+        anomaly_scores = self.score(log_data)
         
         # Combine results with original data
-        results = []
-        for i, (_, row) in enumerate(df.iterrows()):
-            # Get the original log entry
-            log_entry = log_data[i]
-            score = anomaly_scores[i]
-            results.append((log_entry, float(score)))
+        results = [
+            (log_entry, float(score))
+            for log_entry, score in zip(log_data, anomaly_scores)
+        ]
         
         # Sort by anomaly score (highest first)
         results.sort(key=lambda x: x[1], reverse=True)
@@ -116,38 +186,65 @@ class LogAnomalyDetector:
         df['day_of_week'] = df['timestamp'].dt.dayofweek
         df['is_weekend'] = (df['day_of_week'] >= 5).astype(int)
         
-        # Initialize counters if they don't exist
-        for col in ['login_attempts', 'failed_login_attempts', 'sudo_commands', 
-                    'file_operations', 'network_connections', 'unique_ips']:
+        # Initialize counters if they don't exist. Logs enriched with window
+        # counts carry them already; the rest fall back to 0/1 flags
+        for col in COUNTER_COLUMNS:
             if col not in df.columns:
                 df[col] = 0
-        
-        # Parse event_type and details to extract more features
-        for i, row in df.iterrows():
-            event = row.get('event_type', '')
-            details = row.get('details', {})
-            
-            if 'login' in event:
-                df.at[i, 'login_attempts'] = 1
-                if details.get('success') == False:
-                    df.at[i, 'failed_login_attempts'] = 1
-            
-            if 'sudo' in event or ('command' in details and 'sudo' in details.get('command', '')):
-                df.at[i, 'sudo_commands'] = 1
-            
-            if 'file' in event or any(op in event for op in ['read', 'write', 'delete']):
-                df.at[i, 'file_operations'] = 1
-            
-            if 'network' in event or 'connection' in event:
-                df.at[i, 'network_connections'] = 1
-                
-            # Count unique IPs if source_ip exists
-            if 'source_ip' in row and row['source_ip']:
-                df.at[i, 'unique_ips'] = 1
+            else:
+                df[col] = df[col].fillna(0)
+        
+        # Parse event_type and details column-wise instead of row by row
+        if 'event_type' in df.columns:
+            event = df['event_type'].astype(object)
+        else:
+            event = pd.Series('', index=df.index, dtype=object)
+        details = self._flatten_details(df)
+        
+        def event_contains(pattern: str, regex: bool = False) -> pd.Series:
+            return event.str.contains(pattern, regex=regex, na=False).astype(bool)
+        
+        login = event_contains(LOGIN_EVENT_PATTERN)
+        # Same comparison as `details.get('success') == False`, so 0 counts too
+        failed = login & details['success'].eq(False)
+        command_sudo = details['command'].str.contains('sudo', regex=False, na=False).astype(bool)
+        
+        flags = {
+            'login_attempts': login,
+            'failed_login_attempts': failed,
+            'sudo_commands': event_contains(SUDO_EVENT_PATTERN) | command_sudo,
+            'file_operations': event_contains(FILE_EVENT_PATTERN, regex=True),
+            'network_connections': event_contains(NETWORK_EVENT_PATTERN, regex=True),
+        }
+        if 'source_ip' in df.columns:
+            flags['unique_ips'] = df['source_ip'].astype(bool)
+        
+        # Window counts cover the user's activity before the log, so the
+        # log's own flag is added on top of them
+        for col, mask in flags.items():
+            df[col] = df[col] + mask.to_numpy().astype(int)
         
         # Ensure all feature columns exist
         for col in self.feature_columns:
             if col not in df.columns:
                 df[col] = 0
         
-        return df
\ No newline at end of file
+        return df
+    
+    @staticmethod
+    def _flatten_details(df: pd.DataFrame) -> pd.DataFrame:
+        """Pull the detail fields used as features into their own columns"""
+        # Frames built from sampled columns arrive already flattened
+        flat_columns = {'details.success': 'success', 'details.command': 'command'}
+        if set(flat_columns) <= set(df.columns):
+            return df[list(flat_columns)].rename(columns=flat_columns).astype(object)
+        
+        if 'details' not in df.columns:
+            return pd.DataFrame({'success': None, 'command': None}, index=df.index, dtype=object)
+        
+        records = [
+            (d.get('success'), d.get('command')) if isinstance(d, dict) else (None, None)
+            for d in df['details']
+        ]
+        flat = pd.DataFrame.from_records(records, columns=['success', 'command'], index=df.index)
+        return flat.astype(object)
\ No newline at end of file
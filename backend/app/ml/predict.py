@@ -1,56 +1,150 @@
-from typing import List, Dict, Any
+import asyncio
+import heapq
+from typing import AsyncIterator, List, Dict, Any, Optional
 from datetime import datetime, timedelta
+from bson import ObjectId
+from app.core.config import settings
 from app.db.mongodb import db
-from app.ml.model import LogAnomalyDetector
+from app.ml.cache import CachedAnomalies, anomaly_cache
+from app.ml.feature_store import attach_window_counts
+from app.ml.registry import model_registry
+from app.ml.results import ScoredLog, severity_of, store_results
 from app.db.models import LogAnalysisResult
 
-async def get_recent_logs(hours: int = 1) -> List[Dict[str, Any]]:
-    """Get logs from the last X hours for anomaly detection"""
-    end_date = datetime.utcnow()
-    start_date = end_date - timedelta(hours=hours)
+# Only the fields feature extraction and result building read
+SCORING_PROJECTION = {
+    "timestamp": 1,
+    "event_type": 1,
+    "user_id": 1,
+    "source_ip": 1,
+    "details.success": 1,
+    "details.command": 1,
+}
+
+# How far before the cached high-water mark a refresh starts reading
+HIGH_WATER_OVERLAP = timedelta(seconds=5)
+
+async def iter_log_batches(
+    start_date: datetime,
+    end_date: datetime,
+    batch_size: int = settings.ANOMALY_SCORING_BATCH_SIZE,
+    extra_filter: Optional[Dict[str, Any]] = None
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Stream logs in a time window as fixed-size batches of projected documents"""
+    query = {"timestamp": {"$gte": start_date, "$lte": end_date}}
+    if extra_filter:
+        query.update(extra_filter)
     
-    log_collection = db.db.logs
-    cursor = log_collection.find({
-        "timestamp": {"$gte": start_date, "$lte": end_date}
-    })
+    log_collection = db.logs
+    cursor = log_collection.find(query, SCORING_PROJECTION).batch_size(batch_size)
     
-    logs = await cursor.to_list(length=1000)
-    return logs
+    batch = []
+    async for log in cursor:
+        batch.append(log)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def build_result(log_entry: Dict[str, Any], score: float, model_version: str) -> LogAnalysisResult:
+    """Turn a scored log into an anomaly result"""
+    return LogAnalysisResult(
+        log_ids=[str(log_entry.get("_id", ""))],
+        severity=severity_of(score),
+        anomaly_score=score,
+        description=f"Anomaly detected in {log_entry.get('event_type', 'event')}",
+        detected_at=datetime.utcnow(),
+        model_version=model_version
+    )
+
+async def _newest_log_id() -> Optional[ObjectId]:
+    newest = await db.logs.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return newest["_id"] if newest else None
 
 async def detect_anomalies(hours: int = 1, threshold: float = 0.8) -> List[LogAnalysisResult]:
-    """Detect anomalies in recent logs"""
-    logs = await get_recent_logs(hours)
-    
-    if len(logs) == 0:
-        print("No logs found for anomaly detection")
-        return []
+    """
+    Detect anomalies in recent logs
     
-    detector = LogAnomalyDetector()
-    if detector.model is None:
+    Results are cached per (hours, threshold, model version) together with
+    the newest log _id they cover. A repeat query only scores logs written
+    since then. Window counts only cover events before a log, so a score
+    stays valid as newer logs arrive.
+    """
+    # Use the process-wide model instead of deserializing it per request
+    loaded = model_registry.current()
+    if loaded is None:
         print("Model not found, training new model")
         # You might want to train the model here or return an error
         return []
     
-    # Detect anomalies
-    anomalies = detector.detect_anomalies(logs)
+    newest = await _newest_log_id()
+    if newest is None:
+        print("No logs found for anomaly detection")
+        return []
+    
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(hours=hours)
+    
+    key = (hours, threshold, loaded.version)
+    cached = anomaly_cache.get(key)
+    if cached is not None:
+        # Expiring returns a new entry, so requests still reading the cached
+        # one are not affected; the new one takes its place
+        expired = cached.expire(start_date)
+        if expired is None:
+            anomaly_cache.discard(key)
+        elif expired is not cached:
+            anomaly_cache.put(key, expired)
+        cached = expired
+    if cached is not None and cached.high_water == newest:
+        return cached.results()
     
-    # Filter by threshold and convert to LogAnalysisResult
-    results = []
-    for log_entry, score in anomalies:
-        if score >= threshold:
-            severity = "high" if score > 0.9 else "medium" if score > 0.7 else "low"
+    extra_filter = None
+    if cached is not None:
+        # ObjectIds from different writers are only ordered to the second,
+        # so re-read a short overlap and skip logs already in the results
+        overlap_start = cached.high_water.generation_time - HIGH_WATER_OVERLAP
+        extra_filter = {"_id": {"$gte": ObjectId.from_datetime(overlap_start)}}
+        # Work on a copy so concurrent requests never see a half-merged entry
+        entry = cached.copy()
+    else:
+        entry = CachedAnomalies(high_water=newest, top=[], truncated=False, sequence=0)
+    entry.high_water = newest
+    
+    # Every new log in the window is scored, but only the top-K anomalies
+    # are kept, so memory is bounded by the batch size and K
+    top = entry.top
+    seen_ids = {result.log_ids[0] for _, _, _, result in top}
+    added: List[ScoredLog] = []
+    async for batch in iter_log_batches(start_date, end_date, extra_filter=extra_filter):
+        await attach_window_counts(batch)
+        scores = await asyncio.to_thread(loaded.detector.score, batch)
+        for log_entry, score in zip(batch, scores):
+            log_id = str(log_entry.get("_id", ""))
+            if score < threshold or log_id in seen_ids:
+                continue
+            score = float(score)
+            if len(top) >= settings.ANOMALY_MAX_RESULTS:
+                entry.truncated = True
+                if score <= top[0][0]:
+                    continue
             
-            result = LogAnalysisResult(
-                log_ids=[log_entry.get("_id", "")],
-                severity=severity,
-                anomaly_score=score,
-                description=f"Anomaly detected in {log_entry.get('event_type', 'event')}",
-                detected_at=datetime.utcnow()
-            )
-            results.append(result)
+            result = build_result(log_entry, score, loaded.version)
             
-            # Also store the result in the database
-            result_dict = result.dict()
-            await db.db.anomaly_results.insert_one(result_dict)
+            item = (score, entry.sequence, log_entry["timestamp"], result)
+            entry.sequence += 1
+            seen_ids.add(log_id)
+            if len(top) < settings.ANOMALY_MAX_RESULTS:
+                heapq.heappush(top, item)
+            else:
+                heapq.heapreplace(top, item)
+            added.append((log_entry, result))
+    
+    # Results found by this run and still in the top-K, in one bulk
+    # upsert; logs stored by an earlier run or another worker are skipped
+    kept = {id(item[3]) for item in top}
+    await store_results([(log_entry, result) for log_entry, result in added if id(result) in kept])
     
-    return results
\ No newline at end of file
+    anomaly_cache.put(key, entry)
+    return entry.results()
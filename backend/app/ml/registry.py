@@ -0,0 +1,95 @@
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.ml.model import LogAnomalyDetector
+
+class LoadedModel(NamedTuple):
+    detector: LogAnomalyDetector
+    version: str
+    loaded_at: datetime
+
+class ModelRegistry:
+    """
+    Process-wide holder for the trained anomaly detector.
+
+    The artifact is deserialized once per process. Callers get the current
+    model from an in-memory reference; the file is only stat()ed every
+    `check_interval` seconds, and reloaded when its fingerprint changes.
+    """
+    def __init__(self, model_path: str, check_interval: float):
+        self.model_path = model_path
+        self.check_interval = check_interval
+        self._current: Optional[LoadedModel] = None
+        self._fingerprint: Optional[Tuple[int, int]] = None
+        self._last_check = float("-inf")
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[LoadedModel]:
+        """Return the loaded model, picking up a new artifact if one was written"""
+        if time.monotonic() - self._last_check >= self.check_interval:
+            self.refresh()
+        return self._current
+
+    def refresh(self, force: bool = False) -> Optional[LoadedModel]:
+        """Check the artifact on disk and hot-swap the model if it changed"""
+        with self._lock:
+            self._last_check = time.monotonic()
+            fingerprint = self._stat()
+            if fingerprint is None:
+                # Keep serving the last good model if the file disappears
+                return self._current
+            if fingerprint == self._fingerprint and not force:
+                return self._current
+
+            loaded = self._load()
+            if loaded is not None:
+                # Single reference assignment, so readers see either the old
+                # or the new (detector, version) pair and never a mix
+                self._current = loaded
+                self._fingerprint = fingerprint
+                print(f"Model registry loaded version {loaded.version}")
+            return self._current
+
+    def status(self) -> Dict[str, Any]:
+        current = self.current()
+        return {
+            "loaded": current is not None,
+            "version": current.version if current else None,
+            "loaded_at": current.loaded_at if current else None,
+            "model_path": self.model_path,
+        }
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.model_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self) -> Optional[LoadedModel]:
+        try:
+            with open(self.model_path, "rb") as f:
+                data = f.read()
+        except OSError as e:
+            print(f"Error reading model artifact: {str(e)}")
+            return None
+
+        # Hash the exact bytes we deserialize, so the version always
+        # identifies the model that produced a result
+        detector = LogAnomalyDetector(model_path=self.model_path, load=False)
+        detector._load_model(data)
+        if detector.forest is None:
+            return None
+
+        version = hashlib.sha256(data).hexdigest()[:12]
+        return LoadedModel(detector=detector, version=version, loaded_at=datetime.utcnow())
+
+model_registry = ModelRegistry(
+    model_path=settings.ANOMALY_MODEL_PATH,
+    check_interval=settings.MODEL_RELOAD_INTERVAL_SECONDS,
+)
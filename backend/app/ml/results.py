@@ -0,0 +1,205 @@
+"""
+Storage of anomaly results and incidents.
+
+Every anomalous log gets one document in `anomaly_results` per model
+version, with _id {"log_id", "model_version"}, so scoring the same logs
+again (a cache refresh, another worker, a restart) finds the stored
+result instead of adding a copy.
+
+Anomalies of one user that follow each other within
+INCIDENT_WINDOW_MINUTES are also grouped into one incident in
+`incidents`: a LogAnalysisResult holding all their log_ids, scored and
+rated by the worst of them. An incident is opened under an _id made of
+the user, model version and the window its first anomaly fell in, so
+workers grouping the same anomalies at once open the same incident.
+Anomalies of logs without a user_id are only stored as single results.
+
+To re-key results stored before this layout, dropping duplicates, and
+recount /soc/stats (with the app stopped):
+    python -m app.ml.results --migrate
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+
+from app.core.config import settings
+from app.db import rollups
+from app.db.models import Incident, LogAnalysisResult
+from app.db.mongodb import db
+
+# A scored log and the anomaly result built from it
+ScoredLog = Tuple[Dict[str, Any], LogAnalysisResult]
+
+# Legacy results re-keyed per bulk write by --migrate
+MIGRATION_BATCH_SIZE = 1000
+
+def severity_of(score: float) -> str:
+    if score > settings.ANOMALY_HIGH_SCORE:
+        return "high"
+    return "medium" if score > settings.ANOMALY_MEDIUM_SCORE else "low"
+
+def result_id(result: LogAnalysisResult) -> Dict[str, Any]:
+    """_id of a single-log result"""
+    return {"log_id": result.log_ids[0], "model_version": result.model_version}
+
+def incident_id(user_id: Any, model_version: str, first_seen: datetime) -> str:
+    """_id of the incident opened by an anomaly at first_seen"""
+    window = timedelta(minutes=settings.INCIDENT_WINDOW_MINUTES)
+    opened = datetime.min + (first_seen - datetime.min) // window * window
+    return f"{user_id}|{model_version}|{opened:%Y%m%dT%H%M}"
+
+async def store_results(scored: List[ScoredLog]) -> List[LogAnalysisResult]:
+    """
+    Upsert single-log results in one bulk write and fold them into
+    incidents. Returns the results that were not stored before.
+    """
+    if not scored:
+        return []
+    
+    results = [result for _, result in scored]
+    written = await db.db.anomaly_results.bulk_write([
+        UpdateOne({"_id": result_id(result)}, {"$setOnInsert": result.dict()}, upsert=True)
+        for result in results
+    ], ordered=False)
+    # Only results this call inserted are new; the rest were already counted
+    new = [results[i] for i in sorted(written.upserted_ids)]
+    if new:
+        await rollups.record_anomalies([result.dict() for result in new])
+    
+    await _group_incidents(scored)
+    return new
+
+def _clusters(scored: List[ScoredLog]) -> List[List[ScoredLog]]:
+    """Split results into runs of one user's anomalies with no gap over the incident window"""
+    window = timedelta(minutes=settings.INCIDENT_WINDOW_MINUTES)
+    by_user: Dict[Tuple[Any, Any], List[ScoredLog]] = {}
+    for log_entry, result in scored:
+        by_user.setdefault((log_entry.get("user_id"), result.model_version), []).append((log_entry, result))
+    
+    clusters = []
+    for items in by_user.values():
+        items.sort(key=lambda item: item[0]["timestamp"])
+        cluster = [items[0]]
+        for item in items[1:]:
+            if item[0]["timestamp"] - cluster[-1][0]["timestamp"] > window:
+                clusters.append(cluster)
+                cluster = []
+            cluster.append(item)
+        clusters.append(cluster)
+    return clusters
+
+async def _group_incidents(scored: List[ScoredLog]):
+    """
+    Add each cluster to the incident of the same user and model version it
+    falls within the window of, or open one under incident_id(). Log ids
+    are added as a set, so grouping the same results again, here or on
+    another worker, changes nothing. Anomalies of logs without a user_id
+    are not grouped.
+    
+    Incidents the clusters may join are read with one query, and every
+    cluster is written in one bulk write.
+    """
+    window = timedelta(minutes=settings.INCIDENT_WINDOW_MINUTES)
+    spans = []
+    for cluster in _clusters([item for item in scored if item[0].get("user_id")]):
+        log_entry, first = cluster[0]
+        spans.append((cluster, log_entry["user_id"], first.model_version, log_entry["timestamp"], cluster[-1][0]["timestamp"]))
+    if not spans:
+        return
+    
+    existing = await db.db.incidents.find(
+        {"$or": [{
+            "user_id": user_id,
+            "model_version": model_version,
+            "first_seen": {"$lte": last_seen + window},
+            "last_seen": {"$gte": first_seen - window},
+        } for _, user_id, model_version, first_seen, last_seen in spans]},
+        {"user_id": 1, "model_version": 1, "first_seen": 1, "last_seen": 1}
+    ).to_list(length=None)
+    
+    operations = []
+    for cluster, user_id, model_version, first_seen, last_seen in spans:
+        joined = next((
+            incident for incident in existing
+            if incident["user_id"] == user_id and incident["model_version"] == model_version
+            and incident["first_seen"] <= last_seen + window and incident["last_seen"] >= first_seen - window
+        ), None)
+        # Upserts racing on the same _id end up in one document
+        _id = joined["_id"] if joined is not None else incident_id(user_id, model_version, first_seen)
+        score = max(result.anomaly_score for _, result in cluster)
+        operations.append(UpdateOne({"_id": _id}, {
+            "$addToSet": {"log_ids": {"$each": [result.log_ids[0] for _, result in cluster]}},
+            "$min": {"first_seen": first_seen},
+            "$max": {"last_seen": last_seen, "anomaly_score": score},
+            "$setOnInsert": {
+                "user_id": user_id,
+                "model_version": model_version,
+                "description": f"Anomalous activity by user {user_id}",
+                "detected_at": datetime.utcnow(),
+                "is_real_threat": None,
+            },
+        }, upsert=True))
+        # Severity follows the incident's top score: only set it when this
+        # cluster holds (or matches) that score
+        operations.append(UpdateOne({"_id": _id, "anomaly_score": score}, {"$set": {"severity": severity_of(score)}}))
+    
+    # Ordered, so each severity update sees its cluster's upsert
+    await db.db.incidents.bulk_write(operations)
+
+async def list_incidents(since: datetime, user_id: Optional[str] = None, limit: int = 100) -> List[Incident]:
+    """Incidents active since a time, most recent activity first"""
+    query: Dict[str, Any] = {"last_seen": {"$gte": since}}
+    if user_id:
+        query["user_id"] = user_id
+    cursor = db.db.incidents.find(query).sort("last_seen", -1).limit(limit)
+    return [Incident(id=str(doc.pop("_id")), **doc) async for doc in cursor]
+
+async def migrate() -> int:
+    """Re-key results stored with ObjectId _ids, merging duplicates; returns how many were re-keyed"""
+    migrated = 0
+    legacy = db.db.anomaly_results.find({"_id": {"$type": "objectId"}}).batch_size(MIGRATION_BATCH_SIZE)
+    batch: List[Dict[str, Any]] = []
+    async for doc in legacy:
+        batch.append(doc)
+        if len(batch) >= MIGRATION_BATCH_SIZE:
+            migrated += await _migrate_batch(batch)
+            batch = []
+    if batch:
+        migrated += await _migrate_batch(batch)
+    # Counters were incremented once per copy
+    await rollups.rebuild()
+    return migrated
+
+async def _migrate_batch(batch: List[Dict[str, Any]]) -> int:
+    operations = []
+    for doc in batch:
+        legacy_id = doc.pop("_id")
+        result = LogAnalysisResult(**doc)
+        # The earliest copy of a result survives
+        operations.append(UpdateOne({"_id": result_id(result)}, {"$min": {"detected_at": result.detected_at}}))
+        operations.append(UpdateOne({"_id": result_id(result)}, {"$setOnInsert": doc}, upsert=True))
+        operations.append(DeleteOne({"_id": legacy_id}))
+    await db.db.anomaly_results.bulk_write(operations, ordered=True)
+    return len(batch)
+
+async def _main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--migrate", action="store_true", help="re-key results stored with ObjectId _ids")
+    args = parser.parse_args()
+    if not args.migrate:
+        parser.print_help()
+        return
+    
+    from motor.motor_asyncio import AsyncIOMotorClient
+    db.client = AsyncIOMotorClient(settings.MONGODB_URI)
+    db.db = db.client[settings.MONGODB_DB_NAME]
+    try:
+        print(f"Re-keyed {await migrate()} anomaly results")
+    finally:
+        db.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
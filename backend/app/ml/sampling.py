@@ -0,0 +1,85 @@
+import random
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Optional
+
+import numpy as np
+
+def allocate_quotas(counts: Dict[Hashable, int], size: int, minimum: int) -> Dict[Hashable, int]:
+    """
+    Split a sample of `size` across strata.
+    
+    Every stratum is guaranteed min(count, minimum) slots so rare event types
+    stay represented; the remaining slots are shared in proportion to how
+    many items each stratum has left.
+    """
+    total = sum(counts.values())
+    if total <= size:
+        return dict(counts)
+    
+    quotas = {stratum: min(count, minimum) for stratum, count in counts.items()}
+    if sum(quotas.values()) > size:
+        # Too many strata for the floor; fall back to plain proportional
+        quotas = {stratum: 0 for stratum in counts}
+    
+    remaining = size - sum(quotas.values())
+    leftover = {stratum: counts[stratum] - quotas[stratum] for stratum in counts}
+    leftover_total = sum(leftover.values())
+    shares = {stratum: remaining * n / leftover_total for stratum, n in leftover.items()}
+    for stratum, share in shares.items():
+        quotas[stratum] += int(share)
+    
+    # Hand out slots lost to rounding, largest fractional share first
+    short = size - sum(quotas.values())
+    by_fraction = sorted(shares, key=lambda s: shares[s] - int(shares[s]), reverse=True)
+    for stratum in by_fraction[:short]:
+        quotas[stratum] += 1
+    return quotas
+
+class StratifiedReservoir:
+    """
+    Fixed-size stratified sample filled in a single pass.
+    
+    Each stratum owns a contiguous slot range of preallocated column arrays.
+    Within a stratum, reservoir sampling (Algorithm R) keeps a uniform sample
+    however many items stream past, so memory is fixed by the quotas.
+    """
+    def __init__(self, quotas: Dict[Hashable, int], columns: Dict[str, Any], seed: Optional[int] = None):
+        self._quotas = {stratum: quota for stratum, quota in quotas.items() if quota > 0}
+        self._offsets: Dict[Hashable, int] = {}
+        offset = 0
+        for stratum, quota in self._quotas.items():
+            self._offsets[stratum] = offset
+            offset += quota
+        
+        self.size = offset
+        self.columns = {name: np.empty(self.size, dtype=dtype) for name, dtype in columns.items()}
+        self._filled = np.zeros(self.size, dtype=bool)
+        self._seen: Dict[Hashable, int] = defaultdict(int)
+        self._random = random.Random(seed)
+    
+    def offer(self, stratum: Hashable, values: Dict[str, Any]) -> bool:
+        """Consider one item for the sample; returns whether it was kept"""
+        quota = self._quotas.get(stratum)
+        if quota is None:
+            return False
+        
+        self._seen[stratum] += 1
+        seen = self._seen[stratum]
+        if seen <= quota:
+            slot = seen - 1
+        else:
+            slot = self._random.randrange(seen)
+            if slot >= quota:
+                return False
+        
+        index = self._offsets[stratum] + slot
+        for name, value in values.items():
+            self.columns[name][index] = value
+        self._filled[index] = True
+        return True
+    
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The sampled columns, without slots of strata that came up short"""
+        if self._filled.all():
+            return self.columns
+        return {name: column[self._filled] for name, column in self.columns.items()}
@@ -0,0 +1,156 @@
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+from app.core.config import settings
+from app.db.models import LogAnalysisResult
+from app.db.mongodb import db
+from app.ml.feature_store import attach_window_counts
+from app.ml.predict import SCORING_PROJECTION, build_result
+from app.ml.registry import model_registry
+from app.ml.results import store_results
+
+# Error code Mongo returns for change streams on a standalone server
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+# Results a slow client may have queued before older ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 100
+
+# Wait before re-opening the stream after an unexpected error
+RETRY_SECONDS = 5
+
+class AnomalyBroadcaster:
+    """Fan-out of live anomaly results to connected SOC clients"""
+    def __init__(self):
+        self._subscribers: Set[asyncio.Queue] = set()
+    
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+    
+    def publish(self, result: LogAnalysisResult):
+        for queue in self._subscribers:
+            if queue.full():
+                # A stalled client loses its oldest results, not the newest
+                queue.get_nowait()
+            queue.put_nowait(result)
+
+class StreamingScorer:
+    """
+    Scores logs as they are inserted.
+    
+    Tails db.logs with a change stream. On a standalone server (no change
+    streams) it polls for logs past an _id watermark instead. New logs are
+    scored in micro-batches; anomalies are upserted into anomaly_results
+    and the configured severities are pushed to subscribers.
+    """
+    def __init__(self, broadcaster: AnomalyBroadcaster):
+        self.broadcaster = broadcaster
+        self.batch_size = settings.STREAMING_BATCH_SIZE
+        self.batch_seconds = settings.STREAMING_BATCH_SECONDS
+        self.threshold = settings.STREAMING_THRESHOLD
+        self.push_severities = {s.strip() for s in settings.STREAMING_PUSH_SEVERITIES.split(",") if s.strip()}
+        self.mode: Optional[str] = None
+        # Where the change stream resumes after an error: past the last scored batch
+        self._resume_token: Optional[Dict[str, Any]] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+    
+    async def _run(self):
+        while True:
+            try:
+                self.mode = "change_stream"
+                await self._tail_change_stream()
+            except OperationFailure as e:
+                if e.code != CHANGE_STREAMS_UNSUPPORTED:
+                    print(f"Streaming scorer error: {str(e)}")
+                    await asyncio.sleep(RETRY_SECONDS)
+                    continue
+                print("Change streams not supported, polling for new logs")
+                self.mode = "polling"
+                await self._poll()
+            except PyMongoError as e:
+                print(f"Streaming scorer error: {str(e)}")
+                await asyncio.sleep(RETRY_SECONDS)
+    
+    async def _tail_change_stream(self):
+        projection = {f"fullDocument.{field}": 1 for field in SCORING_PROJECTION}
+        pipeline = [
+            {"$match": {"operationType": "insert"}},
+            {"$project": {"fullDocument._id": 1, **projection}},
+        ]
+        max_await_ms = int(self.batch_seconds * 1000)
+        stream = await db.logs.watch(pipeline, resume_after=self._resume_token, max_await_time_ms=max_await_ms)
+        async with stream:
+            loop = asyncio.get_running_loop()
+            while True:
+                batch: List[Dict[str, Any]] = []
+                deadline = loop.time() + self.batch_seconds
+                while len(batch) < self.batch_size and loop.time() < deadline:
+                    change = await stream.try_next()
+                    if change is not None:
+                        batch.append(change["fullDocument"])
+                if batch:
+                    await self._score(await db.logs.decode(batch, SCORING_PROJECTION))
+                self._resume_token = stream.resume_token
+    
+    async def _poll(self):
+        newest = await db.logs.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        watermark = newest["_id"] if newest else ObjectId("0" * 24)
+        while True:
+            cursor = db.logs.find({"_id": {"$gt": watermark}}, SCORING_PROJECTION)
+            batch = await cursor.sort("_id", 1).limit(self.batch_size).to_list(length=self.batch_size)
+            if batch:
+                watermark = batch[-1]["_id"]
+                await self._score(batch)
+            if len(batch) < self.batch_size:
+                await asyncio.sleep(self.batch_seconds)
+    
+    async def _score(self, batch: List[Dict[str, Any]]):
+        loaded = model_registry.current()
+        if loaded is None:
+            return
+        
+        try:
+            await attach_window_counts(batch)
+            scores = await asyncio.to_thread(loaded.detector.score, batch)
+        except Exception as e:
+            print(f"Error scoring streamed logs: {str(e)}")
+            return
+        
+        scored = [
+            (log_entry, build_result(log_entry, float(score), loaded.version))
+            for log_entry, score in zip(batch, scores)
+            if score >= self.threshold
+        ]
+        if not scored:
+            return
+        
+        # Every worker tails the same inserts; results are keyed by log and
+        # model version, so only one copy is stored
+        await store_results(scored)
+        
+        for _, result in scored:
+            if result.severity in self.push_severities:
+                self.broadcaster.publish(result)
+
+anomaly_broadcaster = AnomalyBroadcaster()
+streaming_scorer = StreamingScorer(anomaly_broadcaster)
@@ -1,33 +1,113 @@
-import asyncio
-from typing import List, Dict, Any
+from typing import Callable, Dict, Optional, Tuple
 from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.db.codec import log_codec
 from app.db.mongodb import db
-from app.ml.model import LogAnomalyDetector
+from app.ml.feature_store import bucket_key, window_counts
+from app.ml.model import COUNTER_COLUMNS
+from app.ml.sampling import StratifiedReservoir, allocate_quotas
 
-async def get_training_logs() -> List[Dict[str, Any]]:
-    """Get logs from the database for training the ML model"""
-    # Get logs from the last 30 days
+# Fitting on fewer logs than this gives a meaningless model
+MIN_TRAINING_LOGS = 100
+
+# Slots every (day, event_type) stratum gets before the proportional split
+MIN_STRATUM_SAMPLE = 20
+
+# Only the fields feature extraction reads
+TRAINING_PROJECTION = {
+    "timestamp": 1,
+    "event_type": 1,
+    "user_id": 1,
+    "source_ip": 1,
+    "details.success": 1,
+    "details.command": 1,
+}
+
+# Preallocated sample columns; details are stored already flattened
+SAMPLE_COLUMNS = {
+    "timestamp": "datetime64[ms]",
+    "event_type": object,
+    "user_id": object,
+    "source_ip": object,
+    "details.success": object,
+    "details.command": object,
+}
+
+async def _stratum_counts(start_date: datetime, end_date: datetime) -> Dict[Tuple[str, Optional[str]], int]:
+    """Number of logs per (day, event_type) in the window, counted server-side"""
+    pipeline = [
+        {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                "event_type": "$event_type"
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    counts = {}
+    for row in await db.logs.aggregate(pipeline):
+        event_type = await log_codec.event_name(row["_id"].get("event_type"))
+        counts[(row["_id"]["day"], event_type)] = row["count"]
+    return counts
+
+async def get_training_frame(
+    sample_size: Optional[int] = None,
+    progress: Optional[Callable[[float], None]] = None
+) -> pd.DataFrame:
+    """
+    Stratified sample of the training window as a column frame.
+    
+    One pass over a projected cursor fills a fixed-size reservoir, so the
+    whole month is represented at bounded memory.
+    """
+    sample_size = sample_size or settings.TRAINING_SAMPLE_SIZE
     end_date = datetime.utcnow()
-    start_date = end_date - timedelta(days=30)
+    start_date = end_date - timedelta(days=settings.TRAINING_WINDOW_DAYS)
     
-    log_collection = db.db.logs
-    cursor = log_collection.find({
-        "timestamp": {"$gte": start_date, "$lte": end_date}
-    })
+    counts = await _stratum_counts(start_date, end_date)
+    total = sum(counts.values())
+    reservoir = StratifiedReservoir(
+        allocate_quotas(counts, sample_size, MIN_STRATUM_SAMPLE),
+        SAMPLE_COLUMNS
+    )
     
-    logs = await cursor.to_list(length=10000)
-    return logs
-
-async def train_model():
-    """Train the anomaly detection model using logs from the database"""
-    logs = await get_training_logs()
+    cursor = db.logs.find(
+        {"timestamp": {"$gte": start_date, "$lte": end_date}},
+        TRAINING_PROJECTION
+    ).batch_size(settings.ANOMALY_SCORING_BATCH_SIZE)
+    
+    scanned = 0
+    async for log in cursor:
+        timestamp = log["timestamp"]
+        details = log.get("details")
+        details = details if isinstance(details, dict) else {}
+        reservoir.offer((timestamp.strftime("%Y-%m-%d"), log.get("event_type")), {
+            "timestamp": timestamp,
+            "event_type": log.get("event_type"),
+            "user_id": log.get("user_id"),
+            "source_ip": log.get("source_ip"),
+            "details.success": details.get("success"),
+            "details.command": details.get("command"),
+        })
+        scanned += 1
+        if progress and scanned % 10000 == 0:
+            progress(min(scanned / total, 1.0))
     
-    if len(logs) < 100:
-        print("Not enough log data for training (minimum 100 required)")
-        return False
+    columns = reservoir.arrays()
     
-    detector = LogAnomalyDetector()
-    result = detector.train(logs)
+    # Train on the same windowed counts scoring sees
+    keys = [
+        bucket_key(user_id, timestamp)
+        for user_id, timestamp in zip(columns["user_id"], columns["timestamp"].astype(object))
+    ]
+    vectors = await window_counts(keys)
+    for col in COUNTER_COLUMNS:
+        columns[col] = np.array(
+            [vector[col] if vector is not None else np.nan for vector in vectors],
+            dtype=float
+        )
     
-    print(f"Model training {'succeeded' if result else 'failed'}")
-    return result
\ No newline at end of file
+    return pd.DataFrame(columns)
@@ -7,6 +7,7 @@ from typing import Dict, Optional
 
 from app.core.config import settings
 from app.db.mongodb import db
+from app.db.audit import write_log
 
 # Store active SSH sessions
 active_sessions: Dict[str, Dict] = {}
@@ -82,8 +83,7 @@ async def handle_ssh_websocket(websocket, session_token: str):
             session["channel"] = channel
             
             # Log successful connection
-            log_collection = db.db.logs
-            await log_collection.insert_one({
+            await write_log({
                 "user_id": session["user_id"],
                 "event_type": "ssh_connection",
                 "details": {
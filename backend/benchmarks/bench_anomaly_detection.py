@@ -0,0 +1,249 @@
+"""
+Benchmark for the anomaly-detection path
+
+For each size, trains LogAnomalyDetector on one synthetic log set and
+scores a second one with injected anomalies, reporting:
+
+    train (s)   LogAnomalyDetector.train, feature extraction included
+    logs/s      scoring throughput, in ANOMALY_SCORING_BATCH_SIZE batches
+    peak RSS    high-water resident memory of the run, generated logs included
+    precision / recall of the injected anomalies at --threshold, and at
+                the model's own cut-off (score 0.5, where the forest's
+                contamination offset puts its decision boundary)
+
+Every size runs in a fresh process so peak RSS is not carried over.
+Window counts are computed in memory to match what the feature store
+attaches, and the features of a sample of scored logs are checked against
+counts taken straight from the raw logs; pass --flags-only to score raw
+per-log flags instead.
+
+With --read-path, training and scoring also pay for reading their logs
+back from BSON as the driver returns them, projected as train.py and
+predict.py request them: `original` for the uncompact layout, `compact`
+for the stored encoding decoded through LogCodec. Window counts are put
+back on after reading, so both only differ in how the logs are stored.
+
+With --mongo-url, the scored logs are also inserted into a throwaway
+database and detect_anomalies() is timed end to end.
+
+Run from the backend directory:
+    python -m benchmarks.bench_anomaly_detection --sizes 10000 100000 1000000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import bson
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.db.codec import encode_projection
+from app.ml.model import COUNTER_COLUMNS, LogAnomalyDetector
+from app.ml.predict import SCORING_PROJECTION
+from app.ml.train import TRAINING_PROJECTION
+from benchmarks.bench_log_encoding import _app_shaped, _codec_for
+from benchmarks.loggen import attach_window_counts, generate_logs, raw_window_features
+
+# Score at which decision_function crosses 0, i.e. IsolationForest.predict == -1
+MODEL_CUTOFF = 0.5
+
+# Logs whose counter features are checked against the raw logs each run
+FEATURE_CHECK_SAMPLE = 200
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _generate(size: int, seed: int, args: argparse.Namespace) -> Any:
+    logs, labels = generate_logs(size, seed=seed, days=args.days, anomaly_rate=args.anomaly_rate)
+    if args.read_path:
+        logs = _app_shaped(logs, seed)
+    if not args.flags_only:
+        attach_window_counts(logs)
+    return logs, np.array(labels)
+
+def _check_features(logs: List[Dict[str, Any]], seed: int):
+    """Fail unless extraction over the attached window counts matches the raw-log computation"""
+    indices = sorted(random.Random(seed).sample(range(len(logs)), min(FEATURE_CHECK_SAMPLE, len(logs))))
+    detector = LogAnomalyDetector(model_path="", load=False)
+    features = detector._extract_features(pd.DataFrame([logs[i] for i in indices]))
+    np.testing.assert_array_equal(
+        features[COUNTER_COLUMNS].to_numpy(dtype=float), np.array(raw_window_features(logs, indices))
+    )
+
+def _project(doc: Dict[str, Any], projection: Dict[str, Any]) -> Dict[str, Any]:
+    """What the server returns for an inclusive projection of top-level and one-level dotted fields"""
+    projected = {"_id": doc["_id"]} if "_id" in doc else {}
+    for name in projection:
+        field, _, sub = name.partition(".")
+        if field not in doc:
+            continue
+        if not sub:
+            projected[field] = doc[field]
+        elif isinstance(doc[field], dict) and sub in doc[field]:
+            projected.setdefault(field, {})[sub] = doc[field][sub]
+    return projected
+
+class LogReader:
+    """Reads logs back from BSON in the given layout, as train.py and predict.py receive them"""
+    def __init__(self, layout: str, logs: List[Dict[str, Any]]):
+        self.layout = layout
+        self.codec = _codec_for(logs)
+        self._loop = asyncio.new_event_loop()
+    
+    def store(self, logs: List[Dict[str, Any]], projection: Dict[str, Any]) -> List[bytes]:
+        """Stored documents of logs, projected as the server would return them"""
+        stored = []
+        for log in logs:
+            doc = {k: v for k, v in log.items() if k not in COUNTER_COLUMNS}
+            if self.layout == "compact":
+                stored.append(bson.encode(_project(self.codec._encode_doc(doc), encode_projection(projection))))
+            else:
+                stored.append(bson.encode(_project(doc, projection)))
+        return stored
+    
+    def read(self, stored: List[bytes], logs: List[Dict[str, Any]], projection: Dict[str, Any]) -> List[Dict[str, Any]]:
+        docs = bson.decode_all(b"".join(stored))
+        if self.layout == "compact":
+            docs = self._loop.run_until_complete(self.codec.decode_many(docs, projection))
+        for doc, log in zip(docs, logs):
+            doc.update((column, log[column]) for column in COUNTER_COLUMNS if column in log)
+        return docs
+
+async def _time_detect_anomalies(mongo_url: str, model_path: str, logs: List[Dict[str, Any]], days: int, threshold: float) -> float:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from app.db.mongodb import db
+    from app.ml.predict import detect_anomalies
+    from app.ml.registry import model_registry
+
+    name = f"benchmark_{os.getpid()}"
+    db.client = AsyncIOMotorClient(mongo_url)
+    db.db = db.client[name]
+    try:
+        # Score from the logs alone, not window counts baked into them
+        await db.logs.insert_many([
+            {k: v for k, v in log.items() if k not in COUNTER_COLUMNS}
+            for log in logs
+        ])
+        model_registry.model_path = model_path
+        model_registry.refresh(force=True)
+        started = time.perf_counter()
+        # One extra day covers the generator rounding its start to midnight
+        await detect_anomalies(hours=(days + 1) * 24, threshold=threshold)
+        return time.perf_counter() - started
+    finally:
+        await db.client.drop_database(name)
+        db.client.close()
+
+def _precision_recall(predicted: np.ndarray, labels: np.ndarray) -> Tuple[float, float]:
+    true_positives = int((predicted & labels).sum())
+    precision = true_positives / predicted.sum() if predicted.any() else float("nan")
+    recall = true_positives / labels.sum() if labels.any() else float("nan")
+    return precision, recall
+
+def run_size(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    model_path = os.path.join(tempfile.mkdtemp(), "anomaly_detector.joblib")
+    train_logs, _ = _generate(size, args.seed, args)
+    score_logs, labels = _generate(size, args.seed + 1, args)
+    if not args.flags_only:
+        _check_features(score_logs, args.seed)
+
+    reader = LogReader(args.read_path, train_logs + score_logs) if args.read_path else None
+    batch_size = settings.ANOMALY_SCORING_BATCH_SIZE
+
+    detector = LogAnomalyDetector(model_path=model_path, load=False)
+    stored = reader.store(train_logs, TRAINING_PROJECTION) if reader else None
+    started = time.perf_counter()
+    detector.train(reader.read(stored, train_logs, TRAINING_PROJECTION) if reader else train_logs)
+    train_time = time.perf_counter() - started
+    del train_logs, stored
+
+    stored = reader.store(score_logs, SCORING_PROJECTION) if reader else None
+    scores = []
+    started = time.perf_counter()
+    for start in range(0, size, batch_size):
+        batch = score_logs[start:start + batch_size]
+        if reader:
+            batch = reader.read(stored[start:start + batch_size], batch, SCORING_PROJECTION)
+        scores.append(detector.score(batch))
+    score_time = time.perf_counter() - started
+    del stored
+
+    scores = np.concatenate(scores)
+    result = {
+        "size": size,
+        "train": train_time,
+        "throughput": size / score_time,
+        "threshold": _precision_recall(scores >= args.threshold, labels),
+        "cutoff": _precision_recall(scores >= MODEL_CUTOFF, labels),
+        "detect": None,
+    }
+    if args.mongo_url:
+        result["detect"] = asyncio.run(
+            _time_detect_anomalies(args.mongo_url, model_path, score_logs, args.days, args.threshold)
+        )
+    result["rss"] = _peak_rss_mb()
+    return result
+
+def _worker(size: int, args: argparse.Namespace, queue: Any):
+    try:
+        queue.put(run_size(size, args))
+    except Exception as exc:
+        # Hand the failure back rather than leaving main() waiting on the queue
+        queue.put(exc)
+        raise
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--anomaly-rate", type=float, default=0.01)
+    parser.add_argument("--threshold", type=float, default=0.7,
+                        help="score cut-off, as in /soc/anomalies")
+    parser.add_argument("--days", type=int, default=30,
+                        help="time span of the generated logs")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--flags-only", action="store_true",
+                        help="skip window counts and score per-log flags")
+    parser.add_argument("--mongo-url", default=None,
+                        help="also time detect_anomalies() against this server")
+    parser.add_argument("--read-path", choices=["original", "compact"], default=None,
+                        help="also read the logs back from BSON stored in this layout")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    at = f"@{args.threshold:g}"
+    header = (
+        f"{'logs':>10} {'train (s)':>10} {'logs/s':>10} {'peak RSS':>10}"
+        f" {'P' + at:>8} {'R' + at:>8} {'P@cut':>8} {'R@cut':>8}"
+    )
+    if args.mongo_url:
+        header += f" {'detect (s)':>11}"
+    print(header)
+    for size in args.sizes:
+        queue = context.Queue()
+        process = context.Process(target=_worker, args=(size, args, queue))
+        process.start()
+        r = queue.get()
+        process.join()
+        if isinstance(r, Exception):
+            raise SystemExit(f"size {size} failed: {r}")
+        line = (
+            f"{r['size']:>10} {r['train']:>10.2f} {r['throughput']:>10.0f} {r['rss']:>8.0f}MB"
+            f" {r['threshold'][0]:>8.3f} {r['threshold'][1]:>8.3f}"
+            f" {r['cutoff'][0]:>8.3f} {r['cutoff'][1]:>8.3f}"
+        )
+        if r["detect"] is not None:
+            line += f" {r['detect']:>11.2f}"
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Benchmark for the compact log encoding
+
+Generates synthetic logs shaped like the app's own (ObjectId user ids,
+UUID session tokens, IPv4 addresses) and compares the original layout
+with the one LogCodec stores, reporting:
+
+    bytes/log   average BSON document size
+    zlib        average size once compressed in 1000-log blocks, roughly
+                what the storage engine's block compression keeps on disk
+    encode/s    LogCodec encoding throughput, logs per second
+    scan/s      logs per second turned from BSON back into logical
+                documents: BSON decoding alone for the original layout,
+                BSON decoding plus LogCodec decoding for the compact one
+
+With --mongo-url, both layouts are also inserted into a throwaway
+database, and collStats sizes and full collection-scan throughput
+through the driver are reported for each.
+
+Run from the backend directory:
+    python -m benchmarks.bench_log_encoding --sizes 10000 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+import uuid
+import zlib
+from typing import Any, Dict, List
+
+import bson
+from bson import ObjectId
+
+from app.db.codec import FIELDS, LogCodec
+from benchmarks.loggen import generate_logs
+
+# Logs per compressed block when estimating on-disk size
+BLOCK_SIZE = 1000
+
+def _app_shaped(logs: List[Dict[str, Any]], seed: int) -> List[Dict[str, Any]]:
+    """Swap the generator's readable ids for the values the app writes"""
+    rng = random.Random(seed)
+    user_ids: Dict[str, str] = {}
+    for log in logs:
+        log["user_id"] = user_ids.setdefault(log["user_id"], str(ObjectId()))
+        details = log["details"]
+        if "session_token" in details:
+            details["session_token"] = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        log["user_agent"] = None
+    return logs
+
+def _codec_for(logs: List[Dict[str, Any]]) -> LogCodec:
+    """A codec with the event types registered, without a database"""
+    codec = LogCodec()
+    for code, name in enumerate(sorted({log["event_type"] for log in logs}), start=1):
+        codec._codes[name] = code
+        codec._names[code] = name
+    return codec
+
+def _sizes(docs: List[Dict[str, Any]]) -> Dict[str, float]:
+    encoded = [bson.encode(doc) for doc in docs]
+    compressed = sum(
+        len(zlib.compress(b"".join(encoded[start:start + BLOCK_SIZE])))
+        for start in range(0, len(encoded), BLOCK_SIZE)
+    )
+    return {"bytes": sum(map(len, encoded)) / len(docs), "zlib": compressed / len(docs)}
+
+def _scan_rate(docs: List[Dict[str, Any]], decode=None) -> float:
+    data = b"".join(bson.encode(doc) for doc in docs)
+    started = time.perf_counter()
+    decoded = bson.decode_all(data)
+    if decode is not None:
+        decoded = [decode(doc) for doc in decoded]
+    return len(decoded) / (time.perf_counter() - started)
+
+async def _server_stats(mongo_url: str, layouts: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Dict[str, float]]:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    name = f"benchmark_{os.getpid()}"
+    client = AsyncIOMotorClient(mongo_url)
+    database = client[name]
+    stats = {}
+    try:
+        for layout, docs in layouts.items():
+            collection = database[layout]
+            await collection.insert_many([dict(doc) for doc in docs], ordered=False)
+            # Timestamp index, as the hot paths use; the rest are the same for both
+            timestamp = FIELDS["timestamp"] if layout == "compact" else "timestamp"
+            await collection.create_index([(timestamp, -1), ("_id", -1)])
+            collection_stats = await database.command("collStats", layout)
+
+            started = time.perf_counter()
+            scanned = 0
+            async for _ in collection.find({}).batch_size(1000):
+                scanned += 1
+            stats[layout] = {
+                "size": collection_stats["size"] / len(docs),
+                "storage": collection_stats["storageSize"] / len(docs),
+                "indexes": collection_stats["totalIndexSize"] / len(docs),
+                "scan": scanned / (time.perf_counter() - started),
+            }
+    finally:
+        await client.drop_database(name)
+        client.close()
+    return stats
+
+def run_size(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    logs, _ = generate_logs(size, seed=args.seed)
+    logs = _app_shaped(logs, args.seed)
+    codec = _codec_for(logs)
+
+    started = time.perf_counter()
+    compact = [codec._encode_doc(log) for log in logs]
+    encode_rate = size / (time.perf_counter() - started)
+
+    # Documents as the driver stores them, with an _id each
+    original = [{"_id": ObjectId(), **log} for log in logs]
+    compact = [{"_id": doc["_id"], **encoded} for doc, encoded in zip(original, compact)]
+
+    result = {
+        "size": size,
+        "original": {**_sizes(original), "encode": None, "scan": _scan_rate(original)},
+        "compact": {**_sizes(compact), "encode": encode_rate, "scan": _scan_rate(compact, codec._decode_doc)},
+        "server": None,
+    }
+    if args.mongo_url:
+        result["server"] = asyncio.run(_server_stats(args.mongo_url, {"original": original, "compact": compact}))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mongo-url", default=None,
+                        help="also measure collStats and scans against this server")
+    args = parser.parse_args()
+
+    print(f"{'logs':>10} {'layout':>9} {'bytes/log':>10} {'zlib':>8} {'encode/s':>10} {'scan/s':>10}")
+    for size in args.sizes:
+        r = run_size(size, args)
+        for layout in ("original", "compact"):
+            m = r[layout]
+            encode = f"{m['encode']:>10.0f}" if m["encode"] is not None else f"{'-':>10}"
+            print(f"{r['size']:>10} {layout:>9} {m['bytes']:>10.1f} {m['zlib']:>8.1f} {encode} {m['scan']:>10.0f}")
+        if r["server"] is not None:
+            print(f"{'':>10} {'server':>9} {'size/log':>10} {'disk/log':>10} {'index/log':>10} {'scan/s':>10}")
+            for layout, m in r["server"].items():
+                print(f"{'':>10} {layout:>9} {m['size']:>10.1f} {m['storage']:>10.1f} {m['indexes']:>10.1f} {m['scan']:>10.0f}")
+
+if __name__ == "__main__":
+    main()
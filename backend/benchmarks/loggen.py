@@ -0,0 +1,220 @@
+"""
+Synthetic audit-log generator for benchmarks
+
+Produces documents shaped like the ones the API endpoints write
+(`user_login`, `ssh_session_created`, `list_instances`, ...) for a fixed
+population of admin, developer and SOC users working office hours, and
+injects labelled anomalies on top:
+
+    brute_force     bursts of failed logins from unknown IPs, at night
+    off_hours_sudo  SSH sessions running sudo commands at night or at weekends
+    ip_hopping      one user showing up from many addresses within minutes
+"""
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.core.config import settings
+from app.ml.feature_store import bucket_start
+from app.ml.model import COUNTER_COLUMNS, log_flags
+
+# Relative frequency of each event per role, from the endpoints each role can call
+EVENT_MIX = {
+    "admin": {
+        "user_login": 10, "list_users": 20, "user_created": 2, "mfa_enabled": 1,
+        "list_instances": 30, "get_instance": 20,
+    },
+    "developer": {
+        "user_login": 10, "list_dev_instances": 20, "ssh_session_created": 10,
+        "ssh_connection": 40, "ssh_session_closed": 10,
+    },
+    "soc": {
+        "user_login": 10, "logs_viewed": 30, "anomalies_detected": 15,
+        "security_stats_viewed": 10, "model_training_requested": 1,
+    },
+}
+ROLE_SHARE = {"admin": 0.1, "developer": 0.7, "soc": 0.2}
+
+COMMANDS = ["ls -la", "uptime", "tail -f /var/log/app.log", "df -h", "git pull"]
+SUDO_COMMANDS = ["sudo su -", "sudo cat /etc/shadow", "sudo useradd backdoor", "sudo systemctl stop auditd"]
+
+ANOMALY_KINDS = ["brute_force", "off_hours_sudo", "ip_hopping"]
+
+def _details(rng: random.Random, role: str, user_id: str, event_type: str, sudo_rate: float) -> Dict[str, Any]:
+    if event_type == "user_login":
+        return {"username": user_id, "mfa_used": rng.random() < 0.5}
+    details: Dict[str, Any] = {"role": role}
+    if event_type in ("ssh_session_created", "ssh_session_closed", "ssh_connection"):
+        details["session_token"] = f"{rng.getrandbits(64):016x}"
+    if event_type == "ssh_connection":
+        details["command"] = rng.choice(SUDO_COMMANDS if rng.random() < sudo_rate else COMMANDS)
+    if event_type in ("get_instance", "ssh_session_created"):
+        details["instance_id"] = f"i-{rng.getrandbits(32):08x}"
+    return details
+
+def _office_time(rng: random.Random, start: datetime, span_days: int) -> datetime:
+    """A timestamp in office hours, most of them on weekdays"""
+    while True:
+        day = start + timedelta(days=rng.randrange(span_days))
+        if day.weekday() < 5 or rng.random() < 0.1:
+            break
+    hour = min(max(int(rng.gauss(13, 2.5)), 7), 20)
+    return day.replace(hour=hour, minute=rng.randrange(60), second=rng.randrange(60))
+
+def generate_logs(
+    count: int,
+    seed: int = 42,
+    users: int = 200,
+    days: int = 30,
+    end: Optional[datetime] = None,
+    anomaly_rate: float = 0.01,
+    failed_login_rate: float = 0.03,
+    sudo_rate: float = 0.02,
+) -> Tuple[List[Dict[str, Any]], List[bool]]:
+    """
+    Generate `count` logs over the `days` before `end`, in timestamp order.
+
+    About `anomaly_rate` of them belong to injected anomalies; the second
+    list flags which ones. Normal traffic fails `failed_login_rate` of its
+    logins and runs sudo in `sudo_rate` of its SSH commands.
+    """
+    rng = random.Random(seed)
+    end = end or datetime.utcnow()
+    start = (end - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    span_days = max(days, 1)
+
+    roles = list(ROLE_SHARE)
+    population = []
+    for i in range(users):
+        role = rng.choices(roles, weights=[ROLE_SHARE[r] for r in roles])[0]
+        home_ips = [f"10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}" for _ in range(rng.randint(1, 2))]
+        population.append((f"user-{i}", role, home_ips))
+    mixes = {
+        role: (list(mix), list(mix.values()))
+        for role, mix in EVENT_MIX.items()
+    }
+
+    logs: List[Dict[str, Any]] = []
+    labels: List[bool] = []
+    anomalous = int(count * anomaly_rate)
+
+    while len(logs) < anomalous:
+        user_id, role, _ = rng.choice(population)
+        kind = rng.choice(ANOMALY_KINDS)
+        day = start + timedelta(days=rng.randrange(span_days))
+        at = min(day.replace(hour=rng.randrange(0, 5), minute=rng.randrange(60)), end - timedelta(hours=1))
+        burst = min(rng.randint(5, 30), anomalous - len(logs))
+        for _ in range(burst):
+            at += timedelta(seconds=rng.randrange(1, 20))
+            ip = f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+            if kind == "brute_force":
+                event_type = "user_login"
+                details = {"username": user_id, "mfa_used": False, "success": False}
+            elif kind == "off_hours_sudo":
+                event_type = "ssh_connection"
+                details = {"role": role, "command": rng.choice(SUDO_COMMANDS)}
+            else:
+                event_type = rng.choice(["user_login", "ssh_session_created", "list_instances"])
+                details = {"role": role}
+            logs.append({
+                "user_id": user_id,
+                "event_type": event_type,
+                "details": details,
+                "timestamp": at,
+                "source_ip": ip,
+            })
+            labels.append(True)
+
+    for _ in range(count - len(logs)):
+        user_id, role, home_ips = rng.choice(population)
+        events, weights = mixes[role]
+        event_type = rng.choices(events, weights=weights)[0]
+        details = _details(rng, role, user_id, event_type, sudo_rate)
+        if event_type == "user_login" and rng.random() < failed_login_rate:
+            details["success"] = False
+        logs.append({
+            "user_id": user_id,
+            "event_type": event_type,
+            "details": details,
+            "timestamp": min(_office_time(rng, start, span_days), end),
+            "source_ip": rng.choice(home_ips),
+        })
+        labels.append(False)
+
+    order = sorted(range(len(logs)), key=lambda i: logs[i]["timestamp"])
+    return [logs[i] for i in order], [labels[i] for i in order]
+
+def attach_window_counts(logs: List[Dict[str, Any]]):
+    """
+    In-memory stand-in for app.ml.feature_store.attach_window_counts
+
+    Gives each log its user's activity counts over the
+    FEATURE_WINDOW_BUCKETS complete buckets before its own, so the model
+    sees the same features as when scoring from Mongo. Feature extraction
+    adds the log's own flags on top. Distinct IPs are counted exactly
+    rather than with the HyperLogLog sketch.
+    """
+    if not logs:
+        return
+    width = pd.Timedelta(seconds=settings.FEATURE_BUCKET_SECONDS)
+    # Per-log flags as the feature store records them
+    flags = pd.DataFrame([log_flags(log) for log in logs])
+    flags["user_id"] = [log["user_id"] for log in logs]
+    flags["bucket"] = pd.to_datetime([log["timestamp"] for log in logs]).floor(width)
+    flags["source_ip"] = [log.get("source_ip") for log in logs]
+    keys = ["user_id", "bucket"]
+    counters = [col for col in COUNTER_COLUMNS if col != "unique_ips"]
+
+    per_bucket = flags.groupby(keys)[counters].sum()
+    bucket_sums = dict(zip(per_bucket.index, per_bucket.to_numpy(dtype=float)))
+    bucket_ips: Dict[Tuple[str, Any], set] = defaultdict(set)
+    with_ip = flags[flags["unique_ips"] > 0]
+    for user_id, bucket, source_ip in zip(with_ip["user_id"], with_ip["bucket"], with_ip["source_ip"]):
+        bucket_ips[(user_id, bucket)].add(source_ip)
+
+    vectors = {}
+    for user_id, bucket in bucket_sums:
+        earlier = [(user_id, bucket - step * width) for step in range(1, settings.FEATURE_WINDOW_BUCKETS + 1)]
+        before = sum((bucket_sums[key] for key in earlier if key in bucket_sums), np.zeros(len(counters)))
+        seen = set().union(*(bucket_ips.get(key, ()) for key in earlier))
+        vectors[(user_id, bucket)] = before.tolist() + [float(len(seen))]
+
+    for log, user_id, bucket in zip(logs, flags["user_id"], flags["bucket"]):
+        log.update(zip(COUNTER_COLUMNS, vectors[(user_id, bucket)]))
+
+def raw_window_features(logs: List[Dict[str, Any]], indices: List[int]) -> List[List[float]]:
+    """
+    Counter features of the logs at `indices`, computed straight from the
+    raw logs: every flag of the user's logs in the window buckets before
+    each one's bucket, plus its own. Slow; used to check what attach_window_counts and
+    feature extraction produce together.
+    """
+    width = timedelta(seconds=settings.FEATURE_BUCKET_SECONDS)
+    window = settings.FEATURE_WINDOW_BUCKETS
+    by_user: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for log in logs:
+        by_user[log["user_id"]].append(log)
+
+    rows = []
+    for index in indices:
+        log = logs[index]
+        bucket = bucket_start(log["timestamp"])
+        first = bucket - window * width
+        totals = log_flags(log)
+        ips = set()
+        for other in by_user[log["user_id"]]:
+            if not first <= bucket_start(other["timestamp"]) < bucket:
+                continue
+            for col, flag in log_flags(other).items():
+                if col != "unique_ips":
+                    totals[col] += flag
+            if other.get("source_ip"):
+                ips.add(other["source_ip"])
+        # Distinct IPs seen before, plus the log's own flag
+        totals["unique_ips"] += len(ips)
+        rows.append([float(totals[col]) for col in COUNTER_COLUMNS])
+    return rows
@@ -0,0 +1,9 @@
+import os
+
+# app.core.config refuses to load without these; tests never call AWS
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ADMIN_ROLE_ARN", "arn:aws:iam::000000000000:role/admin")
+os.environ.setdefault("DEVELOPER_ROLE_ARN", "arn:aws:iam::000000000000:role/developer")
+os.environ.setdefault("SOC_ROLE_ARN", "arn:aws:iam::000000000000:role/soc")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
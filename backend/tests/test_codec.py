@@ -0,0 +1,96 @@
+import asyncio
+import copy
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.db.codec import FIELDS, UNKNOWN_EVENT_TYPE, LogCodec, path
+
+EVENT_TYPES = {"user_login": 1, "ssh_connection": 2, "list_instances": 3}
+
+
+@pytest.fixture
+def codec() -> LogCodec:
+    # A registry that already knows every event type never reads the database
+    codec = LogCodec()
+    for name, code in EVENT_TYPES.items():
+        codec._codes[name] = code
+        codec._names[code] = name
+    return codec
+
+
+def _log(**fields):
+    log = {
+        "_id": ObjectId(),
+        "user_id": "u1",
+        "event_type": "user_login",
+        "details": {"success": False, "username": "alice", "mfa_used": True},
+        "timestamp": datetime(2024, 5, 17, 10, 0),
+        "source_ip": "10.0.0.1",
+        "user_agent": "curl/8.0",
+    }
+    log.update(fields)
+    return log
+
+
+@pytest.mark.parametrize("log", [
+    _log(),
+    _log(source_ip=None, user_agent=None),
+    _log(details={}),
+    _log(event_type="ssh_connection", details={"command": "sudo ls", "role": "admin", "extra": [1, {"a": 2}]}),
+    # Keys that collide with stored names or the escape prefix
+    _log(details={"ok": 1, "cmd": "x", "~success": 2, "~": 3, "success": True}),
+])
+def test_round_trip(codec, log):
+    stored = asyncio.run(codec.encode_many([copy.deepcopy(log)]))
+    decoded = asyncio.run(codec.decode_many(stored))
+    assert decoded == [log]
+
+
+def test_stored_layout(codec):
+    stored, = asyncio.run(codec.encode_many([_log(user_agent=None)]))
+    assert set(stored) == {"_id", "u", "e", "d", "t", "ip"}
+    assert stored["e"] == EVENT_TYPES["user_login"]
+    assert stored["d"] == {"ok": False, "un": "alice", "mfa": True}
+
+
+def test_projection_only_fills_projected_fields(codec):
+    stored, = asyncio.run(codec.encode_many([_log(source_ip=None, user_agent=None)]))
+    stored = {key: stored[key] for key in ("_id", FIELDS["user_id"])}
+    decoded, = asyncio.run(codec.decode_many([stored], {"user_id": 1, "source_ip": 1}))
+    assert decoded == {"_id": stored["_id"], "user_id": "u1", "source_ip": None}
+
+
+def test_path():
+    assert path("details.success") == "d.ok"
+    assert path("details.custom") == "d.custom"
+    assert path("details.ok") == "d.~ok"
+    assert path("fullDocument.event_type") == "fullDocument.e"
+    assert path("_id") == "_id"
+
+
+def test_encode_query(codec):
+    query = {
+        "event_type": {"$in": ["user_login", "ssh_connection"]},
+        "$or": [{"details.success": False}, {"event_type": {"$ne": "list_instances"}}],
+        "timestamp": {"$gte": datetime(2024, 5, 1)},
+    }
+    assert asyncio.run(codec.encode_query(query)) == {
+        "e": {"$in": [1, 2]},
+        "$or": [{"d.ok": False}, {"e": {"$ne": 3}}],
+        "t": {"$gte": datetime(2024, 5, 1)},
+    }
+
+
+def test_encode_query_on_unknown_event_type_matches_nothing(codec, monkeypatch):
+    async def reload():
+        pass
+    monkeypatch.setattr(codec, "_reload", reload)
+    assert asyncio.run(codec.encode_query({"event_type": "never_written"})) == {"e": UNKNOWN_EVENT_TYPE}
+
+
+@pytest.mark.parametrize("condition", [{"$gt": "user_login"}, {"$regex": "^user", "$ne": "x"}])
+def test_unencodable_event_type_conditions_are_rejected(codec, condition):
+    with pytest.raises(ValueError):
+        asyncio.run(codec.encode_query({"event_type": condition}))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from app.ml.compiled import CHUNK_ROWS, CompiledForest, artifact_digest, compiled_path
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    rng = np.random.default_rng(7)
+    # Small counts and clock fields, like the log features
+    X = np.column_stack([
+        rng.integers(0, 24, 4000),
+        rng.integers(0, 7, 4000),
+        rng.poisson(2, (4000, 5)),
+        rng.normal(0, 1, 4000),
+    ]).astype(float)
+    scaler = StandardScaler().fit(X)
+    model = IsolationForest(n_estimators=50, contamination=0.05, random_state=42).fit(scaler.transform(X))
+    return model, scaler, X
+
+
+def _sklearn(fitted, X):
+    model, scaler, _ = fitted
+    return model.decision_function(scaler.transform(X))
+
+
+def test_matches_sklearn(fitted):
+    model, scaler, X = fitted
+    forest = CompiledForest.from_model(model, scaler)
+    np.testing.assert_array_equal(forest.decision_function(X), _sklearn(fitted, X))
+
+
+def test_matches_sklearn_on_unseen_rows(fitted):
+    model, scaler, X = fitted
+    rng = np.random.default_rng(8)
+    # More rows than one chunk, with repeats and values outside the training range
+    unseen = np.vstack([X[:50], rng.normal(0, 50, (CHUNK_ROWS + 300, X.shape[1])), X[:50]])
+    forest = CompiledForest.from_model(model, scaler)
+    np.testing.assert_array_equal(forest.decision_function(unseen), _sklearn(fitted, unseen))
+
+
+def test_saved_forest_loads_for_its_artifact_only(fitted, tmp_path):
+    model, scaler, X = fitted
+    source = artifact_digest(b"model bytes")
+    path = compiled_path(str(tmp_path / "model.joblib"))
+    CompiledForest.from_model(model, scaler, source).save(path)
+
+    loaded = CompiledForest.load(path, source)
+    np.testing.assert_array_equal(loaded.decision_function(X), _sklearn(fitted, X))
+    assert CompiledForest.load(path, artifact_digest(b"other bytes")) is None
+    assert CompiledForest.load(str(tmp_path / "missing.forest")) is None
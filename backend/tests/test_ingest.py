@@ -0,0 +1,72 @@
+import asyncio
+import json
+from datetime import datetime
+
+import pytest
+
+from app.db.ingest import MAX_REPORTED_ERRORS, BatchTooLarge, read_batch
+
+
+async def _chunks(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def _read(*chunks: bytes, max_events=100, max_line_bytes=1024, max_body_bytes=1 << 20):
+    return asyncio.run(read_batch(_chunks(*chunks), max_events, max_line_bytes, max_body_bytes))
+
+
+def _line(**fields) -> bytes:
+    entry = {"user_id": "u1", "event_type": "User Login", "details": {"success": True}}
+    entry.update(fields)
+    return json.dumps(entry).encode() + b"\n"
+
+
+def test_lines_split_across_chunks():
+    body = _line() + _line(user_id="u2", timestamp="2024-05-17T10:00:00+02:00")
+    entries, invalid, errors = _read(body[:7], body[7:60], body[60:])
+    assert invalid == 0 and errors == []
+    assert [entry["user_id"] for entry in entries] == ["u1", "u2"]
+    assert entries[0]["event_type"] == "user_login"
+    assert entries[1]["timestamp"] == datetime(2024, 5, 17, 8, 0)
+
+
+def test_last_line_without_newline_and_blank_lines():
+    entries, invalid, _ = _read(b"\n" + _line() + b"\n\n" + _line().rstrip(b"\n"))
+    assert len(entries) == 2 and invalid == 0
+
+
+def test_invalid_lines_are_counted_with_line_numbers():
+    entries, invalid, errors = _read(_line() + b"not json\n" + _line(user_id=None) + _line())
+    assert len(entries) == 2
+    assert invalid == 2
+    assert [error["line"] for error in errors] == [2, 3]
+
+
+def test_reported_errors_are_capped():
+    _, invalid, errors = _read(b"{}\n" * (MAX_REPORTED_ERRORS + 5))
+    assert invalid == MAX_REPORTED_ERRORS + 5
+    assert len(errors) == MAX_REPORTED_ERRORS
+
+
+def test_too_many_events():
+    _read(_line() * 3, max_events=3)
+    with pytest.raises(BatchTooLarge):
+        _read(_line() * 4, max_events=3)
+
+
+def test_line_too_long():
+    line = _line(details={"command": "x" * 200})
+    with pytest.raises(BatchTooLarge):
+        _read(line, max_line_bytes=100)
+
+
+def test_unfinished_line_too_long():
+    # The line never ends, so it is only ever buffered as the pending tail
+    with pytest.raises(BatchTooLarge):
+        _read(*[b"x" * 50] * 10, max_line_bytes=100)
+
+
+def test_body_too_large():
+    with pytest.raises(BatchTooLarge):
+        _read(_line(), _line(), max_body_bytes=len(_line()) + 1)
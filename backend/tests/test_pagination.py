@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from app.core.config import settings
+from app.db.pagination import after_cursor, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 17, 9, 30, 12, 345000)
+    log_id = ObjectId()
+    assert decode_cursor(encode_cursor(timestamp, log_id)) == (timestamp, log_id)
+
+
+def test_cursor_keeps_milliseconds():
+    timestamp = datetime(2024, 5, 17, 9, 30, 12, 345678)
+    decoded, _ = decode_cursor(encode_cursor(timestamp, ObjectId()))
+    assert decoded == datetime(2024, 5, 17, 9, 30, 12, 345000)
+
+
+def test_tampered_cursor_is_rejected():
+    token = encode_cursor(datetime(2024, 5, 17), ObjectId())
+    tampered = token[:5] + ("A" if token[5] != "A" else "B") + token[6:]
+    with pytest.raises(ValueError):
+        decode_cursor(tampered)
+
+
+def test_cursor_from_another_key_is_rejected(monkeypatch):
+    token = encode_cursor(datetime(2024, 5, 17), ObjectId())
+    monkeypatch.setattr(settings, "SECRET_KEY", settings.SECRET_KEY + "-rotated")
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+@pytest.mark.parametrize("token", ["", "not-a-cursor", "!!!!"])
+def test_garbage_cursor_is_rejected(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def test_after_cursor_tightens_the_upper_bound():
+    position = (datetime(2024, 5, 17), ObjectId())
+    query = {"timestamp": {"$gte": datetime(2024, 5, 1), "$lte": datetime(2024, 6, 1)}, "user_id": "u1"}
+    restricted = after_cursor(query, position)
+    assert restricted["timestamp"] == {"$gte": datetime(2024, 5, 1), "$lte": position[0]}
+    assert restricted["user_id"] == "u1"
+    assert restricted["$or"] == [{"timestamp": {"$lt": position[0]}}, {"_id": {"$lt": position[1]}}]
+    # The caller's query is left as it was
+    assert query["timestamp"]["$lte"] == datetime(2024, 6, 1)
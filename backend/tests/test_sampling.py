@@ -0,0 +1,61 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from app.ml.sampling import StratifiedReservoir, allocate_quotas
+
+
+def test_quotas_take_everything_when_it_fits():
+    assert allocate_quotas({"a": 3, "b": 4}, 10, 2) == {"a": 3, "b": 4}
+
+
+def test_quotas_keep_rare_strata():
+    quotas = allocate_quotas({"common": 10_000, "rare": 3, "other": 500}, 100, 5)
+    assert sum(quotas.values()) == 100
+    assert quotas["rare"] == 3
+    assert quotas["other"] >= 5
+    assert quotas["common"] > quotas["other"]
+
+
+def test_quotas_fall_back_to_proportional():
+    counts = {stratum: 10 for stratum in range(20)}
+    quotas = allocate_quotas(counts, 10, 5)
+    assert sum(quotas.values()) == 10
+    assert max(quotas.values()) <= 1
+
+
+@pytest.mark.parametrize("size", [1, 7, 99, 1000])
+def test_quotas_add_up_to_size(size):
+    counts = {"a": 1234, "b": 567, "c": 89, "d": 1}
+    quotas = allocate_quotas(counts, size, 3)
+    assert sum(quotas.values()) == size
+    assert all(0 <= quotas[stratum] <= counts[stratum] for stratum in counts)
+
+
+def test_reservoir_fills_each_stratum_to_its_quota():
+    reservoir = StratifiedReservoir({"a": 5, "b": 3, "c": 0}, {"value": np.int64, "stratum": object}, seed=1)
+    for stratum, n in (("a", 100), ("b", 2), ("c", 10), ("d", 10)):
+        for i in range(n):
+            reservoir.offer(stratum, {"value": i, "stratum": stratum})
+    arrays = reservoir.arrays()
+    assert Counter(arrays["stratum"]) == {"a": 5, "b": 2}
+    assert len(set(arrays["value"][arrays["stratum"] == "a"])) == 5
+
+
+def test_reservoir_keeps_items_until_full():
+    reservoir = StratifiedReservoir({"a": 3}, {"value": np.int64})
+    assert [reservoir.offer("a", {"value": i}) for i in range(3)] == [True, True, True]
+    assert reservoir.offer("missing", {"value": 9}) is False
+    assert list(reservoir.arrays()["value"]) == [0, 1, 2]
+
+
+def test_reservoir_sample_is_uniform():
+    # Every item of a stream should be kept with probability quota / n
+    kept = Counter()
+    for seed in range(2000):
+        reservoir = StratifiedReservoir({"a": 2}, {"value": np.int64}, seed=seed)
+        for i in range(10):
+            reservoir.offer("a", {"value": i})
+        kept.update(reservoir.arrays()["value"].tolist())
+    assert all(300 <= kept[i] <= 500 for i in range(10))
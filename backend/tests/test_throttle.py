@@ -0,0 +1,54 @@
+import asyncio
+
+from app.auth.throttle import MemoryThrottleStore
+
+
+def _run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_hits_are_counted_per_window():
+    store = MemoryThrottleStore(max_keys=10)
+    assert _run(store.hit("user:a", 5)) == (0, 1)
+    assert _run(store.hit("user:a", 5)) == (0, 2)
+    assert _run(store.hit("user:a", 6)) == (2, 1)
+    # Windows before the previous one are dropped
+    assert _run(store.hit("user:a", 8)) == (0, 1)
+    assert _run(store.hit("user:b", 8)) == (0, 1)
+
+
+def test_locks():
+    store = MemoryThrottleStore(max_keys=10)
+    _run(store.lock("user:a", (100.0, 2, 500.0)))
+    _run(store.lock("ip:1.2.3.4", (150.0, 1, 400.0)))
+    assert _run(store.locked_until(["user:a", "ip:1.2.3.4"], 50.0)) == 150.0
+    assert _run(store.locked_until(["user:a", "ip:9.9.9.9"], 120.0)) == 0
+    # Lockouts are remembered past the lock until they are forgotten
+    assert _run(store.lockouts("user:a", 300.0)) == 2
+    assert _run(store.lockouts("user:a", 500.0)) == 0
+    assert _run(store.lockouts("user:b", 0.0)) == 0
+
+
+def test_reset_forgets_counts_and_locks():
+    store = MemoryThrottleStore(max_keys=10)
+    _run(store.hit("user:a", 1))
+    _run(store.lock("user:a", (100.0, 1, 200.0)))
+    _run(store.reset("user:a"))
+    assert _run(store.hit("user:a", 1)) == (0, 1)
+    assert _run(store.locked_until(["user:a"], 0.0)) == 0
+
+
+def test_keys_are_bounded_in_lru_order():
+    store = MemoryThrottleStore(max_keys=2)
+    _run(store.hit("a", 1))
+    _run(store.hit("b", 1))
+    _run(store.hit("a", 1))
+    _run(store.hit("c", 1))
+    # "b" was the least recently hit
+    assert _run(store.hit("b", 1)) == (0, 1)
+    assert _run(store.hit("a", 1)) == (0, 1)
+    _run(store.lock("a", (100.0, 1, 200.0)))
+    _run(store.lock("b", (100.0, 1, 200.0)))
+    _run(store.lock("c", (100.0, 1, 200.0)))
+    assert _run(store.locked_until(["a"], 0.0)) == 0
+    assert _run(store.locked_until(["b", "c"], 0.0)) == 100.0